@@ -0,0 +1,518 @@
+"""
+Local caching proxy for the static assets of the apps under test.
+
+Every new WebDriver starts with an empty browser cache, so each page load
+of a crawl downloads the app's JS bundles, stylesheets, fonts and images
+again. :class:`CachingProxy` sits between the browsers and the app and
+answers repeated requests for static assets from a content-addressed
+cache on disk, shared by all drivers and kept between runs::
+
+    cache_dir/
+        index.jsonl         url -> digest, status and headers, append-only
+        objects/ab/abcd...  response bodies, named by their SHA-256
+
+A cached asset is served as is while it is fresh: within its
+``Cache-Control: max-age`` (forever if ``immutable``) or, without either,
+within the run that cached it. After that, and always with ``no-cache``,
+it is revalidated with its ``ETag``/``Last-Modified``, so assets of a
+rebuilt app (often under the same file names) are not served stale; a
+``304 Not Modified`` still saves the body.
+
+Documents and API responses are always forwarded, since they change with
+the app's state. Requests to blocked hosts (e.g. trackers, which cannot be
+reached offline anyway and would only stall the load event) are answered
+right away with an empty response. HTTPS requests are tunnelled untouched.
+
+Usage::
+
+    with CachingProxy('cache/assets', allowed_hosts=['localhost']) as proxy:
+        driver = create_driver(proxy=proxy)
+        ...
+        proxy.print_report()
+"""
+import re
+import json
+import time
+import socket
+import select
+import hashlib
+import threading
+import http.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+from urllib.parse import SplitResult, urlsplit
+
+
+INDEX_FILE = 'index.jsonl'
+OBJECTS_DIR = 'objects'
+
+STATIC_CONTENT_TYPES = (
+    'text/css',
+    'text/javascript',
+    'application/javascript',
+    'application/x-javascript',
+    'application/wasm',
+    'application/font-woff',
+    'application/vnd.ms-fontobject',
+    'image/',
+    'font/',
+    'audio/',
+    'video/',
+)
+
+STATIC_EXTENSIONS = (
+    '.js', '.mjs', '.css', '.map', '.wasm',
+    '.woff', '.woff2', '.ttf', '.otf', '.eot',
+    '.png', '.jpg', '.jpeg', '.gif', '.svg', '.webp', '.ico', '.avif',
+    '.mp3', '.mp4', '.webm',
+)
+
+# Response headers kept with a cached body
+_CACHED_HEADERS = ('content-type', 'content-encoding', 'etag', 'last-modified', 'cache-control', 'vary')
+
+# Conditional request headers of the browser, replaced by the cache's own when revalidating
+_CONDITIONAL_HEADERS = ('if-none-match', 'if-modified-since', 'if-match', 'if-unmodified-since', 'if-range')
+
+# Not forwarded in either direction (RFC 9110, section 7.6.1)
+_HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-connection', 'proxy-authorization', 'proxy-authenticate',
+    'te', 'trailer', 'transfer-encoding', 'upgrade',
+}
+
+
+def _empty_stats() -> Dict[str, float]:
+    return {
+        'requests': 0,
+        'hits': 0,
+        'misses': 0,
+        # Hits that were confirmed by the app with a 304
+        'revalidated': 0,
+        'blocked': 0,
+        'bytes_served': 0,
+        'bytes_saved': 0,
+        'seconds_saved': 0.0,
+    }
+
+
+def _host_matches(host: str, patterns: Iterable[str]) -> bool:
+    return any(host == pattern or host.endswith('.' + pattern) for pattern in patterns)
+
+
+def is_static_asset(url: str, headers: Dict[str, str]) -> bool:
+    """
+    Whether a successful GET response may be cached: a static content type
+    (or, without one, a static file extension), no ``no-store`` and no cookie.
+    """
+    cache_control = headers.get('cache-control', '').lower()
+    if 'no-store' in cache_control or 'set-cookie' in headers:
+        return False
+
+    content_type = headers.get('content-type', '').split(';')[0].strip().lower()
+    if content_type:
+        return content_type.startswith(STATIC_CONTENT_TYPES)
+    return urlsplit(url).path.lower().endswith(STATIC_EXTENSIONS)
+
+
+def is_fresh(entry: Dict[str, Any], now: float, session_start: float) -> bool:
+    """
+    Whether a cached entry may be served without asking the app: never with
+    ``no-cache``, while younger than its ``max-age`` (always if
+    ``immutable``), and, without either, if it was stored since
+    ``session_start``.
+    """
+    cache_control = entry['headers'].get('cache-control', '').lower()
+    if 'no-cache' in cache_control:
+        return False
+    if 'immutable' in cache_control:
+        return True
+    stored = entry.get('stored', 0.0)
+    max_age = re.search(r'(?:^|[\s,])max-age\s*=\s*"?(\d+)', cache_control)
+    if max_age is not None:
+        return now - stored < int(max_age.group(1))
+    return stored >= session_start
+
+
+class AssetCache:
+    """
+    Content-addressed store of response bodies with an append-only URL
+    index. Identical bodies served under several URLs (e.g. cache-busting
+    query strings) are stored once. Safe to use from several threads.
+    """
+
+    def __init__(self, cache_dir: Union[str, Path]):
+        self.cache_dir = Path(cache_dir)
+        self.objects_dir = self.cache_dir / OBJECTS_DIR
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # url -> {'digest', 'status', 'headers', 'size', 'seconds', 'stored'}
+        self._index: Dict[str, Dict[str, Any]] = {}
+
+        index_path = self.cache_dir / INDEX_FILE
+        if index_path.is_file():
+            with open(index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn last line from an interrupted run
+                        continue
+                    self._index[entry.pop('url')] = entry
+
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+
+    def _object_path(self, digest: str) -> Path:
+        return self.objects_dir / digest[:2] / digest
+
+
+    def get(self, url: str) -> Optional[Tuple[Dict[str, Any], bytes]]:
+        """The index entry and body cached for ``url``, or None."""
+        entry = self._index.get(url)
+        if entry is None:
+            return None
+        try:
+            with open(self._object_path(entry['digest']), 'rb') as f:
+                return entry, f.read()
+        except FileNotFoundError:
+            return None
+
+
+    def put(self, url: str, status: int, headers: Dict[str, str], body: bytes, seconds: float) -> None:
+        """
+        Stores a response. ``seconds`` is how long it took to fetch and is
+        reported as saved on every later hit.
+        """
+        digest = hashlib.sha256(body).hexdigest()
+        object_path = self._object_path(digest)
+        if not object_path.is_file():
+            object_path.parent.mkdir(exist_ok=True)
+            tmp_path = object_path.with_name(f'{digest}.{threading.get_ident()}.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(body)
+            tmp_path.replace(object_path)
+
+        self._write(url, {
+            'digest': digest,
+            'status': status,
+            'headers': {k: v for k, v in headers.items() if k in _CACHED_HEADERS},
+            'size': len(body),
+            'seconds': seconds,
+            'stored': time.time(),
+        })
+
+
+    def refresh(self, url: str, headers: Dict[str, str]) -> None:
+        """
+        Marks the entry of ``url`` as just stored, after the app confirmed
+        it with a 304, taking the updated headers of that response.
+        """
+        entry = self._index.get(url)
+        if entry is None:
+            return
+        updated = {k: v for k, v in headers.items() if k in _CACHED_HEADERS and k != 'content-type'}
+        self._write(url, {**entry, 'headers': {**entry['headers'], **updated}, 'stored': time.time()})
+
+
+    def _write(self, url: str, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            with open(self.cache_dir / INDEX_FILE, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'url': url, **entry}) + '\n')
+            self._index[url] = entry
+
+
+class _ProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    proxy: 'CachingProxy'
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def _upstream(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        # One keep-alive connection per origin and browser connection
+        connections = self.__dict__.setdefault('_connections', {})
+        key = (scheme, netloc)
+        if key not in connections:
+            connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            connections[key] = connection_class(netloc, timeout=self.proxy.timeout)
+        return connections[key]
+
+
+    def _send(self, status: int, headers: Dict[str, str], body: bytes, reason: Optional[str] = None):
+        self.send_response(status, reason)
+        for key, value in headers.items():
+            if key.lower() not in _HOP_BY_HOP_HEADERS and key.lower() != 'content-length':
+                self.send_header(key, value)
+        if self.command != 'HEAD':
+            self.send_header('Content-Length', str(len(body)))
+        else:
+            # No body follows a HEAD response: report the size of the one a GET would get
+            length = next((value for key, value in headers.items() if key.lower() == 'content-length'), None)
+            if length is not None:
+                self.send_header('Content-Length', length)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+
+    def _handle(self):
+        url = self.path
+        parts = urlsplit(url)
+        if not parts.scheme:
+            self._send(400, {}, b'Not a proxy request')
+            return
+
+        page = self.headers.get('Referer', url).split('#')[0]
+        host = parts.hostname or ''
+        if self.proxy.is_blocked(host):
+            self.proxy._count(page, blocked=1)
+            self._send(204, {}, b'')
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        request_body = self.rfile.read(length) if length else None
+        headers = {k: v for k, v in self.headers.items() if k.lower() not in _HOP_BY_HOP_HEADERS}
+
+        cached = self.proxy.cache.get(url) if self.command == 'GET' else None
+        if cached is not None:
+            entry, body = cached
+            if is_fresh(entry, time.time(), self.proxy.started):
+                self.proxy._count(
+                    page, hits=1, bytes_served=len(body), bytes_saved=len(body), seconds_saved=entry['seconds']
+                )
+                self._send(entry['status'], entry['headers'], body)
+                return
+            validators = {}
+            if 'etag' in entry['headers']:
+                validators['If-None-Match'] = entry['headers']['etag']
+            if 'last-modified' in entry['headers']:
+                validators['If-Modified-Since'] = entry['headers']['last-modified']
+            if validators:
+                headers = {k: v for k, v in headers.items() if k.lower() not in _CONDITIONAL_HEADERS}
+                headers.update(validators)
+            else:
+                # Nothing to revalidate with: download it again
+                cached = None
+
+        start = time.perf_counter()
+        try:
+            response, response_body = self._fetch(parts, headers, request_body)
+        except OSError as e:
+            self.proxy._count(page, misses=1)
+            self._send(502, {'Content-Type': 'text/plain'}, f'Upstream error: {e}'.encode())
+            return
+        seconds = time.perf_counter() - start
+        response_headers = {k.lower(): v for k, v in response.getheaders()}
+
+        if cached is not None and response.status == 304:
+            self.proxy.cache.refresh(url, response_headers)
+            self.proxy._count(
+                page, hits=1, revalidated=1, bytes_served=len(body), bytes_saved=len(body),
+                seconds_saved=max(entry['seconds'] - seconds, 0.0)
+            )
+            self._send(entry['status'], entry['headers'], body)
+            return
+
+        if self.command == 'GET' and response.status == 200 and is_static_asset(url, response_headers):
+            self.proxy.cache.put(url, response.status, response_headers, response_body, seconds)
+
+        self.proxy._count(page, misses=1, bytes_served=len(response_body))
+        self._send(response.status, dict(response.getheaders()), response_body, response.reason)
+
+
+    def _fetch(
+        self,
+        parts: SplitResult,
+        headers: Dict[str, str],
+        request_body: Optional[bytes]
+    ) -> Tuple[http.client.HTTPResponse, bytes]:
+        """Forwards the request to the app; raises OSError if it cannot be reached."""
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        connection = self._upstream(parts.scheme, parts.netloc)
+        try:
+            try:
+                connection.request(self.command, path, request_body, headers)
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # The kept-alive connection was closed by the server; retry on a new one
+                connection.close()
+                connection.request(self.command, path, request_body, headers)
+                response = connection.getresponse()
+            return response, response.read()
+        except OSError:
+            connection.close()
+            raise
+
+
+    do_GET = _handle
+    do_HEAD = _handle
+    do_POST = _handle
+    do_PUT = _handle
+    do_PATCH = _handle
+    do_DELETE = _handle
+    do_OPTIONS = _handle
+
+
+    def do_CONNECT(self):
+        """Tunnels HTTPS without looking into it, so it is never cached."""
+        host, _, port = self.path.rpartition(':')
+        if self.proxy.is_blocked(host):
+            self.proxy._count(self.path, blocked=1)
+            self._send(403, {}, b'')
+            return
+
+        try:
+            upstream = socket.create_connection((host, int(port or 443)), timeout=self.proxy.timeout)
+        except OSError as e:
+            self._send(502, {'Content-Type': 'text/plain'}, f'Upstream error: {e}'.encode())
+            return
+
+        self.send_response(200, 'Connection Established')
+        self.end_headers()
+        self.close_connection = True
+
+        sockets = [self.connection, upstream]
+        try:
+            while True:
+                readable, _, errored = select.select(sockets, [], sockets, self.proxy.timeout)
+                if errored or not readable:
+                    break
+                for source in readable:
+                    data = source.recv(65536)
+                    if not data:
+                        return
+                    (upstream if source is self.connection else self.connection).sendall(data)
+        except OSError:
+            pass
+        finally:
+            upstream.close()
+
+
+class CachingProxy:
+    """
+    HTTP proxy serving repeated static assets from an :class:`AssetCache`.
+    Runs in a background thread; point browsers at it with
+    ``create_driver(proxy=...)``.
+
+    Requests are counted per page, i.e. per document URL (the Referer of its
+    subresources), in :attr:`page_stats`: requests, cache hits and misses,
+    blocked requests, bytes served, and the bytes and download seconds the
+    cache saved.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Union[str, Path],
+        port: int = 0,
+        allowed_hosts: Optional[List[str]] = None,
+        blocked_hosts: Optional[List[str]] = None,
+        timeout: float = 30
+    ):
+        """
+        Args:
+            cache_dir: Directory of the asset cache, kept between runs.
+            port: Port to listen on (on 127.0.0.1); 0 picks a free one.
+            allowed_hosts: If given, requests to any other host (or its
+                subdomains) are blocked, e.g. ``['localhost', '127.0.0.1']``.
+            blocked_hosts: Hosts (and their subdomains) whose requests are
+                blocked, e.g. analytics and ad servers.
+            timeout: Seconds to wait for the app's responses.
+        """
+        self.cache = AssetCache(cache_dir)
+        self.port = port
+        self.allowed_hosts = allowed_hosts
+        self.blocked_hosts = blocked_hosts or []
+        self.timeout = timeout
+
+        # Entries without freshness information are fresh if cached since then
+        self.started = time.time()
+        self.page_stats: Dict[str, Dict[str, float]] = {}
+        self._stats_lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+
+    @property
+    def address(self) -> str:
+        """``host:port`` to give to the browser, once started."""
+        if self._server is None:
+            raise RuntimeError("The proxy is not running. Call start() first.")
+        host, port = self._server.server_address[:2]
+        return f'{host}:{port}'
+
+
+    def start(self) -> 'CachingProxy':
+        if self._server is None:
+            handler = type('ProxyHandler', (_ProxyHandler,), {'proxy': self})
+            self._server = ThreadingHTTPServer(('127.0.0.1', self.port), handler)
+            self._server.daemon_threads = True
+            self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+            self._thread.start()
+            print(f"▶ Asset cache proxy on {self.address} ({len(self.cache)} cached assets)")
+        return self
+
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            self._thread = None
+
+
+    def __enter__(self) -> 'CachingProxy':
+        return self.start()
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+    def is_blocked(self, host: str) -> bool:
+        if self.allowed_hosts is not None and not _host_matches(host, self.allowed_hosts):
+            return True
+        return _host_matches(host, self.blocked_hosts)
+
+
+    def _count(self, page: str, **counts: float) -> None:
+        with self._stats_lock:
+            stats = self.page_stats.setdefault(page, _empty_stats())
+            stats['requests'] += 1
+            for key, value in counts.items():
+                stats[key] += value
+
+
+    def totals(self) -> Dict[str, float]:
+        """The statistics of all pages, summed."""
+        with self._stats_lock:
+            totals = _empty_stats()
+            for stats in self.page_stats.values():
+                for key, value in stats.items():
+                    totals[key] += value
+            return totals
+
+
+    def take_page_stats(self) -> Dict[str, Dict[str, float]]:
+        """Returns the statistics gathered so far and starts new ones."""
+        with self._stats_lock:
+            page_stats, self.page_stats = self.page_stats, {}
+            return page_stats
+
+
+    def print_report(self) -> None:
+        for page, stats in list(self.page_stats.items()):
+            print(f"  {page}: {stats['hits']}/{stats['requests']} cached ({stats['revalidated']} revalidated), "
+                  f"{stats['blocked']} blocked, "
+                  f"{stats['bytes_saved'] / 1e6:.1f} MB and {stats['seconds_saved']:.2f}s saved")
+        totals = self.totals()
+        print(f"✔ Asset cache: {totals['hits']}/{totals['requests']} requests cached "
+              f"({totals['revalidated']} revalidated), "
+              f"{totals['blocked']} blocked, {totals['bytes_saved'] / 1e6:.1f} MB and "
+              f"{totals['seconds_saved']:.1f}s saved")
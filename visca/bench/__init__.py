@@ -0,0 +1,34 @@
+"""
+Offline benchmark of the pipeline: replays saved pages (a screenshot and
+their elements, as written by ``save_capture`` or ``save_elements``)
+through post-processing, cropping, dedup, tree building, PSI segmentation,
+page context, classification and code generation, with a deterministic
+fake model instead of Gemini, and reports per-stage timings, memory and
+model calls as JSON that can be compared across commits::
+
+    python -m visca.bench synth bench/pages --pages 3
+    python -m visca.bench run bench/pages --latency 0.05 --out bench/report.json
+    python -m visca.bench compare bench/baseline.json bench/report.json
+"""
+from .fake_model import create_fake_model_factory
+from .synthetic import make_synthetic_page
+from .runner import (
+    STAGES,
+    find_pages,
+    run_page,
+    run_benchmark,
+    print_report,
+    compare_reports,
+)
+
+
+__all__ = [
+    'create_fake_model_factory',
+    'make_synthetic_page',
+    'STAGES',
+    'find_pages',
+    'run_page',
+    'run_benchmark',
+    'print_report',
+    'compare_reports',
+]
@@ -0,0 +1,67 @@
+import json
+import argparse
+from pathlib import Path
+
+from .synthetic import make_synthetic_page
+from .runner import run_benchmark, compare_reports
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m visca.bench', description="Offline pipeline benchmark")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="benchmark saved pages")
+    run.add_argument('pages', help="a page directory or a directory of them")
+    run.add_argument('--out', default=None, help="where to write the JSON report")
+    run.add_argument('--latency', type=float, default=0.0, help="seconds per fake model call")
+    run.add_argument('--seconds-per-1k-tokens', type=float, default=0.0)
+    run.add_argument('--repeat', type=int, default=1)
+    run.add_argument('--no-trace-memory', action='store_true', help="skip tracemalloc")
+    run.add_argument('--verbose', action='store_true', help="show the stages' output")
+    run.add_argument('--trace', default=None, help="where to write a JSONL trace of the spans")
+    run.add_argument('--preclassify', type=float, default=None, metavar='THRESHOLD',
+                     help="skip the model for the nodes the heuristic pre-classifier is this confident about")
+
+    synth = commands.add_parser('synth', help="write synthetic pages")
+    synth.add_argument('out_dir')
+    synth.add_argument('--pages', type=int, default=3)
+    synth.add_argument('--rows', type=int, default=20)
+    synth.add_argument('--cards', type=int, default=6)
+
+    compare = commands.add_parser('compare', help="compare two reports")
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run_benchmark(
+            args.pages,
+            output=args.out,
+            latency=args.latency,
+            seconds_per_1k_tokens=args.seconds_per_1k_tokens,
+            repeat=args.repeat,
+            trace_memory=not args.no_trace_memory,
+            quiet=not args.verbose,
+            trace_path=args.trace,
+            preclassify=args.preclassify
+        )
+    elif args.command == 'synth':
+        for i in range(args.pages):
+            page_dir = make_synthetic_page(Path(args.out_dir) / f'page{i}', rows=args.rows, cards=args.cards, seed=i)
+            print(f"✔ {page_dir}")
+        # Dedup leaves two of its table rows: lists must be found before dedup
+        page_dir = make_synthetic_page(
+            Path(args.out_dir) / 'repeated_rows', rows=args.rows, cards=args.cards, seed=args.pages, distinct_rows=2
+        )
+        print(f"✔ {page_dir}")
+    else:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        with open(args.current, 'r', encoding='utf-8') as f:
+            current = json.load(f)
+        compare_reports(baseline, current)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import time
+import hashlib
+from typing import Callable, Optional
+
+from PIL import Image
+
+from visca.instrument import span
+from visca.llm.usage import record_call
+from visca.prompts import (
+    PAGE_CONTEXT_EXTRACTION_SYSTEM_PROMPT,
+    CLASSIFICATION_AND_CONTEXT_PROMPT,
+    COMPONENT_GENERATION_PROMPT,
+)
+
+
+# Tokens Gemini bills for an attached image
+IMAGE_TOKENS = 258
+
+
+class FakeUsage:
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class FakeResponse:
+    def __init__(self, text: str, usage: FakeUsage):
+        self.text = text
+        self.usage_metadata = usage
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _digest(file: Optional[str], prompt: str) -> str:
+    content = prompt.encode()
+    if file is not None:
+        with open(file, 'rb') as f:
+            content += f.read()
+    return hashlib.sha256(content).hexdigest()
+
+
+def create_fake_model_factory(
+    latency: float = 0.0,
+    seconds_per_1k_tokens: float = 0.0,
+    container_area: int = 200_000
+) -> Callable:
+    """
+    Returns a drop-in replacement for ``visca.llm.gemini.create_model`` that
+    answers without a network, deterministically (the same file and prompt
+    always get the same answer) and in the formats the pipeline parses.
+
+    Classification: elements of at least ``container_area`` px² are
+    containers, smaller ones components or lists depending on their digest.
+
+    Args:
+        latency: Seconds every call sleeps, to simulate the round trip.
+        seconds_per_1k_tokens: Additional sleep per 1000 prompt and response tokens.
+        container_area: Smallest area classified as a container.
+    """
+
+    def create_model(system_prompt, settings=None, **kwargs):
+        stats = {
+            "calls": 0,
+            "prompt_tokens": 0,
+            "response_tokens": 0,
+            "total_tokens": 0,
+        }
+
+        def respond(file=None, prompt=''):
+            digest = _digest(file, prompt)
+
+            if system_prompt == CLASSIFICATION_AND_CONTEXT_PROMPT:
+                width, height = Image.open(file).size if file is not None else (0, 0)
+                if width * height >= container_area:
+                    component_type = 'Container'
+                else:
+                    component_type = 'List' if int(digest[:2], 16) % 4 == 0 else 'Component'
+                text = (f"<Response><Classification>{component_type}</Classification>"
+                        f"<Context>Synthetic context {digest[:8]}</Context>"
+                        f"<Title>{component_type}{digest[:6].upper()}</Title></Response>")
+            elif system_prompt == COMPONENT_GENERATION_PROMPT:
+                name = f"Component{digest[:6].upper()}"
+                text = (f"<JsxOutput>\nexport default function {name}() {{\n"
+                        f"  return <div className=\"{name.lower()}\" />;\n}}\n</JsxOutput>")
+            elif system_prompt == PAGE_CONTEXT_EXTRACTION_SYSTEM_PROMPT:
+                text = f"A synthetic page ({digest[:8]}) of the benchmarked app."
+            else:
+                text = f"Fake response {digest[:8]}"
+
+            usage = FakeUsage(
+                _estimate_tokens(system_prompt) + _estimate_tokens(prompt) + (IMAGE_TOKENS if file is not None else 0),
+                _estimate_tokens(text)
+            )
+            time.sleep(latency + seconds_per_1k_tokens * usage.total_token_count / 1000)
+
+            stats["calls"] += 1
+            stats["prompt_tokens"] += usage.prompt_token_count
+            stats["response_tokens"] += usage.candidates_token_count
+            stats["total_tokens"] += usage.total_token_count
+            return FakeResponse(text, usage)
+
+        def invoke(file=None, prompt=''):
+            with span('llm', model='fake', file=file is not None) as llm_span:
+                start = time.perf_counter()
+                response = respond(file, prompt)
+                record_call('fake', response.usage_metadata, time.perf_counter() - start)
+                llm_span.set(
+                    prompt_tokens=response.usage_metadata.prompt_token_count,
+                    response_tokens=response.usage_metadata.candidates_token_count,
+                    total_tokens=response.usage_metadata.total_token_count
+                )
+                return response
+
+        invoke.stats = stats
+        create_model.models.append(invoke)
+        return invoke
+
+    # Every model created, so a benchmark can sum their stats
+    create_model.models = []
+    return create_model
@@ -0,0 +1,369 @@
+import io
+import os
+import json
+import time
+import shutil
+import hashlib
+import platform
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+import contextlib
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+
+from PIL import Image
+
+from visca.element_extractor import postprocess_elements, save_elements_from_image
+from visca.dedup import deduplicate_screenshots
+from visca.virtual_node import build_dom_tree
+from visca.segment import segment_tree, find_lists, map_lists
+from visca.preclassify import Preclassifier
+from visca.prompts import (
+    PAGE_CONTEXT_EXTRACTION_SYSTEM_PROMPT,
+    CLASSIFICATION_AND_CONTEXT_PROMPT,
+    COMPONENT_GENERATION_PROMPT,
+)
+from visca.llm_processing import (
+    classify_and_describe_candidates,
+    transform_candidate,
+    build_component_model,
+)
+
+from visca.instrument import Tracer, max_rss_bytes
+from visca.llm.usage import usage_context
+
+from .fake_model import create_fake_model_factory
+
+
+REPORT_VERSION = 1
+
+STAGES = ('postprocess', 'crop', 'dedup', 'tree', 'segment', 'context', 'classify', 'generate')
+
+# Values summed over the pages of a run and compared between reports
+METRICS = ('wall_seconds', 'cpu_seconds', 'peak_alloc_bytes', 'model_calls', 'model_tokens')
+
+
+def find_pages(path: Union[str, Path]) -> List[Path]:
+    """
+    Page directories under ``path`` (or ``path`` itself): directories with a
+    ``screenshot.png`` and an ``elements.json`` (see ``save_capture``) or a
+    ``segments.json`` (see ``save_elements``).
+    """
+    path = Path(path)
+    candidates = [path] + sorted(p for p in path.rglob('*') if p.is_dir())
+    return [
+        p for p in candidates
+        if (p / 'screenshot.png').is_file() and ((p / 'elements.json').is_file() or (p / 'segments.json').is_file())
+    ]
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class _StageRecorder:
+    def __init__(self, model_factory: Callable, trace_memory: bool):
+        self.model_factory = model_factory
+        self.trace_memory = trace_memory
+        self.stages: Dict[str, Dict[str, Any]] = {}
+
+
+    def _model_totals(self):
+        models = getattr(self.model_factory, 'models', [])
+        return (
+            sum(model.stats['calls'] for model in models),
+            sum(model.stats['total_tokens'] for model in models),
+        )
+
+
+    @contextlib.contextmanager
+    def measure(self, stage: str) -> Iterator[None]:
+        calls, tokens = self._model_totals()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            allocated = tracemalloc.get_traced_memory()[0]
+        wall, cpu = time.perf_counter(), time.process_time()
+
+        yield
+
+        record = {
+            'wall_seconds': time.perf_counter() - wall,
+            'cpu_seconds': time.process_time() - cpu,
+            'peak_alloc_bytes': tracemalloc.get_traced_memory()[1] - allocated if self.trace_memory else None,
+            'max_rss_bytes': max_rss_bytes(),
+        }
+        end_calls, end_tokens = self._model_totals()
+        record['model_calls'] = end_calls - calls
+        record['model_tokens'] = end_tokens - tokens
+        self.stages[stage] = record
+
+
+def _load_page(page_dir: Path):
+    elements_path = page_dir / 'elements.json'
+    if not elements_path.is_file():
+        elements_path = page_dir / 'segments.json'
+    with open(elements_path, 'r', encoding='utf-8') as f:
+        elements = json.load(f)
+    screenshot = Image.open(page_dir / 'screenshot.png')
+    screenshot.load()
+    return elements, screenshot
+
+
+def run_page(
+    page_dir: Union[str, Path],
+    work_dir: Union[str, Path],
+    model_factory: Callable,
+    memory: dict,
+    trace_memory: bool = True,
+    preclassifier: Optional[Preclassifier] = None
+) -> Dict[str, Any]:
+    """
+    Runs every offline stage of the pipeline on one saved page, writing
+    its outputs to ``work_dir``.
+
+    Returns:
+        ``{'stages': {stage: measurements}, 'output': {...}}``, where the
+        output counts and digest tell whether a change altered the results.
+    """
+    page_dir, work_dir = Path(page_dir), Path(work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    shutil.copy(page_dir / 'screenshot.png', work_dir / 'screenshot.png')
+    saved_elements, screenshot = _load_page(page_dir)
+    recorder = _StageRecorder(model_factory, trace_memory)
+
+    with recorder.measure('postprocess'):
+        # Text elements are the ones without a parentIndex
+        dom_elements = postprocess_elements(
+            [e for e in saved_elements if 'parentIndex' in e],
+            [e for e in saved_elements if 'parentIndex' not in e]
+        )
+
+    with recorder.measure('crop'):
+        elements = save_elements_from_image(screenshot, str(work_dir), dom_elements)
+        elements = [e for e in elements if 'screenshot' in e]
+
+    with recorder.measure('dedup'):
+        deduplicated = deduplicate_screenshots(elements)
+
+    with recorder.measure('tree'):
+        tree = build_dom_tree(list(deduplicated))
+
+    with recorder.measure('segment'):
+        instances = segment_tree(tree, work_dir, name='aa', mode='sum')
+
+    with recorder.measure('context'), usage_context(purpose='context'):
+        page_context = model_factory(PAGE_CONTEXT_EXTRACTION_SYSTEM_PROMPT)(
+            file=str(work_dir / 'screenshot.png')
+        ).text
+
+    with recorder.measure('classify'):
+        # On all elements: dedup removes most items of a list
+        lists = map_lists(find_lists(build_dom_tree(list(elements))), tree)
+        classified_tree, _ = classify_and_describe_candidates(
+            root=tree,
+            classification_model=model_factory(CLASSIFICATION_AND_CONTEXT_PROMPT, settings={'temperature': 0}),
+            page_context=page_context,
+            memory=memory,
+            segment_json_path=work_dir / 'segmentation_xpath_aa.json',
+            lists=lists,
+            preclassifier=preclassifier
+        )
+
+    with recorder.measure('generate'):
+        _, transformed_tree = transform_candidate(
+            root=classified_tree,
+            component_generation_model=model_factory(COMPONENT_GENERATION_PROMPT),
+            page_context=page_context,
+            memory=memory,
+            state_id=page_dir.name,
+            lists=lists
+        )
+
+    components = build_component_model(transformed_tree)
+    return {
+        'stages': recorder.stages,
+        'output': {
+            'elements': len(dom_elements),
+            'deduplicated': len(deduplicated),
+            'segments': len(instances),
+            'lists': len(lists),
+            'components': len(components),
+            'digest': hashlib.sha256(json.dumps(components, sort_keys=True).encode()).hexdigest(),
+        },
+    }
+
+
+def _sum_stages(pages: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    totals: Dict[str, Dict[str, float]] = {}
+    for page in pages.values():
+        for stage, record in page['stages'].items():
+            stage_totals = totals.setdefault(stage, {metric: 0 for metric in METRICS})
+            for metric in METRICS:
+                if metric == 'peak_alloc_bytes':
+                    stage_totals[metric] = max(stage_totals[metric], record[metric] or 0)
+                else:
+                    stage_totals[metric] += record[metric]
+    return totals
+
+
+def run_benchmark(
+    pages: Union[str, Path, List[Union[str, Path]]],
+    output: Optional[Union[str, Path]] = None,
+    latency: float = 0.0,
+    seconds_per_1k_tokens: float = 0.0,
+    repeat: int = 1,
+    trace_memory: bool = True,
+    quiet: bool = True,
+    work_dir: Optional[Union[str, Path]] = None,
+    trace_path: Optional[Union[str, Path]] = None,
+    preclassify: Optional[float] = None
+) -> Dict[str, Any]:
+    """
+    Replays saved pages through the offline stages of the pipeline with a
+    fake model (see :func:`create_fake_model_factory`) and reports, per
+    stage, wall and CPU time, peak Python allocations, the process' peak
+    RSS and the model calls and tokens.
+
+    Each repetition starts with an empty component memory that its pages
+    share, as in a crawl. The report's ``stages`` hold the median over the
+    repetitions of the per-stage sums over all pages (peak allocations: the
+    largest of any page).
+
+    Args:
+        pages: Page directories, or a directory to search with :func:`find_pages`.
+        output: If given, the JSON report is written there.
+        latency: Seconds every fake model call takes.
+        seconds_per_1k_tokens: Additional fake model time per 1000 tokens.
+        repeat: Number of repetitions.
+        trace_memory: Measure allocations with tracemalloc (slows Python code down).
+        quiet: Hide the stages' progress output.
+        work_dir: Where the stages write their outputs; a temporary directory by default.
+        trace_path: If given, the spans of every stage and model call (see
+            :mod:`visca.instrument`) are written there as JSONL, and next to
+            it as a Chrome trace (``.chrome.json``).
+        preclassify: If given, classification skips the model for the nodes
+            a :class:`Preclassifier` with this threshold is confident about.
+
+    Returns:
+        The report.
+    """
+    if isinstance(pages, (str, Path)):
+        pages = find_pages(pages)
+    pages = [Path(p) for p in pages]
+    if not pages:
+        raise ValueError("No saved pages to benchmark.")
+
+    print(f"▶ Benchmarking {len(pages)} pages, {repeat} run(s)")
+    if trace_memory:
+        tracemalloc.start()
+    tracer = None
+    if trace_path is not None:
+        tracer = Tracer(trace_path, chrome_path=Path(trace_path).with_suffix('.chrome.json')).install()
+
+    preclassifier = Preclassifier(threshold=preclassify) if preclassify is not None else None
+    runs: List[Dict[str, Any]] = []
+    temp_dir = tempfile.TemporaryDirectory() if work_dir is None else None
+    base_dir = Path(temp_dir.name if temp_dir is not None else work_dir)
+    try:
+        for run in range(repeat):
+            model_factory = create_fake_model_factory(latency, seconds_per_1k_tokens)
+            memory: dict = {}
+            page_results: Dict[str, Dict[str, Any]] = {}
+            start = time.perf_counter()
+            for i, page_dir in enumerate(pages):
+                key = str(page_dir)
+                out = io.StringIO()
+                with contextlib.redirect_stdout(out) if quiet else contextlib.nullcontext(), \
+                        usage_context(state_id=page_dir.name):
+                    page_results[key] = run_page(
+                        page_dir, base_dir / f'run{run}' / f'{i}_{page_dir.name}', model_factory, memory, trace_memory,
+                        preclassifier
+                    )
+            runs.append({'wall_seconds': time.perf_counter() - start, 'pages': page_results})
+            print(f"  run {run + 1}/{repeat}: {runs[-1]['wall_seconds']:.2f}s")
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+        if tracer is not None:
+            tracer.close()
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    run_totals = [_sum_stages(run['pages']) for run in runs]
+    stages = {
+        stage: {metric: statistics.median(totals[stage][metric] for totals in run_totals) for metric in METRICS}
+        for stage in STAGES if stage in run_totals[0]
+    }
+
+    report = {
+        'version': REPORT_VERSION,
+        'meta': {
+            'commit': _git_commit(),
+            'time': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'pages': [str(p) for p in pages],
+            'repeat': repeat,
+            'latency': latency,
+            'seconds_per_1k_tokens': seconds_per_1k_tokens,
+            'trace_memory': trace_memory,
+            'preclassify': preclassify,
+        },
+        'wall_seconds': statistics.median(run['wall_seconds'] for run in runs),
+        'max_rss_bytes': max_rss_bytes(),
+        'stages': stages,
+        'outputs': {page: result['output'] for page, result in runs[0]['pages'].items()},
+        'runs': runs,
+    }
+
+    if output is not None:
+        Path(output).parent.mkdir(parents=True, exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    print_report(report)
+    return report
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"{'stage':<12}{'wall s':>10}{'cpu s':>10}{'peak MB':>10}{'calls':>8}{'tokens':>10}")
+    for stage, totals in report['stages'].items():
+        print(f"{stage:<12}{totals['wall_seconds']:>10.3f}{totals['cpu_seconds']:>10.3f}"
+              f"{totals['peak_alloc_bytes'] / 1e6:>10.1f}{totals['model_calls']:>8.0f}{totals['model_tokens']:>10.0f}")
+    print(f"✔ Total {report['wall_seconds']:.2f}s, peak RSS {(report['max_rss_bytes'] or 0) / 1e6:.0f} MB")
+
+
+def compare_reports(baseline: Dict[str, Any], current: Dict[str, Any]) -> Dict[str, Dict[str, float]]:
+    """
+    Relative change (``current / baseline - 1``) of every stage metric, and
+    prints them along with the pages whose output changed.
+    """
+    for setting in ('latency', 'seconds_per_1k_tokens', 'trace_memory', 'repeat', 'preclassify'):
+        if baseline['meta'].get(setting) != current['meta'].get(setting):
+            print(f"Warning: the reports differ in {setting} "
+                  f"({baseline['meta'].get(setting)} vs {current['meta'].get(setting)})")
+
+    changes: Dict[str, Dict[str, float]] = {}
+    print(f"{'stage':<12}" + ''.join(f"{metric:>18}" for metric in METRICS))
+    for stage in STAGES:
+        if stage not in baseline['stages'] or stage not in current['stages']:
+            continue
+        changes[stage] = {}
+        for metric in METRICS:
+            before, after = baseline['stages'][stage][metric], current['stages'][stage][metric]
+            changes[stage][metric] = after / before - 1 if before else 0.0
+        print(f"{stage:<12}" + ''.join(f"{changes[stage][metric]:>+18.1%}" for metric in METRICS))
+
+    for page, output in current['outputs'].items():
+        if page in baseline['outputs'] and baseline['outputs'][page]['digest'] != output['digest']:
+            print(f"✘ Output changed for {page}: {baseline['outputs'][page]} -> {output}")
+
+    return changes
@@ -0,0 +1,124 @@
+import json
+import random
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+from PIL import Image, ImageDraw
+
+
+PAGE_WIDTH = 1280
+
+
+class _PageBuilder:
+    def __init__(self):
+        self.elements: List[Dict[str, Any]] = []
+        self._child_counts: Dict[Optional[int], Dict[str, int]] = {}
+
+
+    def add(self, parent: Optional[int], tag: str, x: int, y: int, width: int, height: int, text: str = '') -> int:
+        counts = self._child_counts.setdefault(parent, {})
+        counts[tag] = counts.get(tag, 0) + 1
+        parent_xpath = self.elements[parent]['xpath'] if parent is not None else '//html[1]'
+        index = len(self.elements)
+        self.elements.append({
+            'tag': tag,
+            'id': '',
+            'classes': [],
+            'x': x,
+            'y': y,
+            'width': width,
+            'height': height,
+            'visible': True,
+            'text': text[:50],
+            'html': '',
+            'xpath': f"{parent_xpath}/{tag}[{counts[tag]}]",
+            'index': index,
+            'parentIndex': parent,
+            'gt_dataBlock': None,
+            'gt_dataBlockType': None,
+        })
+        return index
+
+
+    def finish(self) -> List[Dict[str, Any]]:
+        # outerHTML of every element, built bottom-up like a browser would report it
+        children: Dict[int, List[int]] = {}
+        for element in self.elements:
+            if element['parentIndex'] is not None:
+                children.setdefault(element['parentIndex'], []).append(element['index'])
+        for element in reversed(self.elements):
+            inner = ''.join(self.elements[i]['html'] for i in children.get(element['index'], []))
+            element['html'] = f"<{element['tag']}>{inner or element['text']}</{element['tag']}>"
+        return self.elements
+
+
+def make_synthetic_page(
+    page_dir: Union[str, Path],
+    rows: int = 20,
+    cards: int = 6,
+    seed: int = 0,
+    distinct_rows: Optional[int] = None
+) -> Path:
+    """
+    Writes a deterministic page to ``page_dir`` in the format of
+    :func:`visca.crawl.save_capture` (``screenshot.png`` and
+    ``elements.json``): a header with a navigation bar, a table of ``rows``
+    rows and a grid of ``cards`` cards. Repeated rows and cards look alike,
+    as in a real app, so dedup and segmentation have work to do. With
+    ``distinct_rows``, the rows cycle through that many different ones,
+    so dedup keeps only those and the table is only found as a list on
+    the elements before dedup.
+    """
+    rng = random.Random(seed)
+    page = _PageBuilder()
+
+    header_height, row_height, card_height = 80, 48, 220
+    table_height = 60 + rows * row_height
+    grid_rows = (cards + 2) // 3
+    height = header_height + table_height + grid_rows * (card_height + 20) + 60
+
+    body = page.add(None, 'body', 0, 0, PAGE_WIDTH, height)
+    header = page.add(body, 'header', 0, 0, PAGE_WIDTH, header_height)
+    page.add(header, 'h1', 20, 20, 240, 40, f'App {seed}')
+    nav = page.add(header, 'nav', 700, 20, 560, 40)
+    for i in range(5):
+        page.add(nav, 'a', 700 + i * 110, 25, 100, 30, f'Menu {i + 1}')
+
+    main = page.add(body, 'main', 0, header_height, PAGE_WIDTH, height - header_height)
+    table = page.add(main, 'table', 20, header_height + 20, PAGE_WIDTH - 40, table_height)
+    for r in range(rows):
+        y = header_height + 70 + r * row_height
+        row = page.add(table, 'tr', 20, y, PAGE_WIDTH - 40, row_height - 4)
+        for c in range(4):
+            text = f'Cell {r % distinct_rows}-{c}' if distinct_rows else f'Cell {r}-{c} {rng.randint(0, 999)}'
+            page.add(row, 'td', 30 + c * 300, y + 6, 280, row_height - 16, text)
+
+    grid_y = header_height + table_height + 40
+    grid = page.add(main, 'section', 20, grid_y, PAGE_WIDTH - 40, grid_rows * (card_height + 20))
+    for i in range(cards):
+        x, y = 20 + (i % 3) * 410, grid_y + (i // 3) * (card_height + 20)
+        card = page.add(grid, 'div', x, y, 390, card_height)
+        page.add(card, 'h3', x + 15, y + 15, 300, 30, f'Card {i}')
+        page.add(card, 'p', x + 15, y + 60, 360, 100, f'Description of card {i}')
+        page.add(card, 'button', x + 15, y + 170, 120, 36, 'Open')
+
+    elements = page.finish()
+
+    screenshot = Image.new('RGB', (PAGE_WIDTH, height), 'white')
+    draw = ImageDraw.Draw(screenshot)
+    palette = {'header': (40, 60, 90), 'nav': (50, 75, 110), 'tr': (245, 245, 245), 'div': (235, 240, 250),
+               'button': (30, 120, 220), 'a': (70, 100, 140)}
+    for element in elements:
+        box = (element['x'], element['y'], element['x'] + element['width'] - 1, element['y'] + element['height'] - 1)
+        fill = palette.get(element['tag'])
+        draw.rectangle(box, fill=fill, outline=(200, 200, 200))
+        if element['text']:
+            draw.text((element['x'] + 5, element['y'] + 5), element['text'], fill=(0, 0, 0))
+
+    page_dir = Path(page_dir)
+    page_dir.mkdir(parents=True, exist_ok=True)
+    screenshot.save(page_dir / 'screenshot.png')
+    with open(page_dir / 'elements.json', 'w', encoding='utf-8') as f:
+        json.dump(elements, f)
+
+    return page_dir
@@ -1,7 +1,7 @@
 import os
 import io
 import time
-from typing import Tuple
+from typing import Any, Dict, Optional, Tuple
 
 from PIL import Image
 
@@ -13,8 +13,17 @@ from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.remote.webdriver import WebDriver
 from selenium.webdriver.remote.webelement import WebElement
 
+from visca.asset_cache import CachingProxy
 
-def create_driver(headless=True) -> WebDriver:
+
+def create_driver(headless=True, proxy: Optional[CachingProxy] = None) -> WebDriver:
+    """
+    Args:
+        headless: Run Chrome without a window.
+        proxy: A started :class:`CachingProxy` all requests go through,
+            including those to localhost, so repeated static assets are
+            served from its cache.
+    """
     chrome_options = Options()
     if headless:
         chrome_options.add_argument("--headless")
@@ -22,6 +31,10 @@ def create_driver(headless=True) -> WebDriver:
     chrome_options.add_argument("--hide-scrollbars")  # Hide scrollbars to avoid affecting layout
     chrome_options.add_argument("--force-device-scale-factor=1")  # Force known scale factor
     chrome_options.add_argument("--disable-gpu")
+    if proxy is not None:
+        chrome_options.add_argument(f"--proxy-server=http://{proxy.address}")
+        # Chrome bypasses proxies for loopback addresses unless told otherwise
+        chrome_options.add_argument("--proxy-bypass-list=<-loopback>")
     
     chrome_path = ChromeDriverManager().install()
     if "THIRD_PARTY_NOTICES.chromedriver" in chrome_path:
@@ -127,3 +140,42 @@ def get_element_xpath(driver: WebDriver, element: WebElement) -> str:
     
     xpath = driver.execute_script(xpath_script, element)
     return xpath
+
+
+def snapshot_storage(driver: WebDriver) -> Dict[str, Any]:
+    """
+    Captures what a page keeps between loads: the current URL, cookies and
+    the origin's localStorage and sessionStorage.
+    """
+    return {
+        'url': driver.current_url,
+        'cookies': driver.get_cookies(),
+        'local_storage': driver.execute_script("return Object.assign({}, window.localStorage);"),
+        'session_storage': driver.execute_script("return Object.assign({}, window.sessionStorage);"),
+    }
+
+
+def restore_storage(driver: WebDriver, snapshot: Dict[str, Any], timeout: int = 10):
+    """
+    Restores a :func:`snapshot_storage` snapshot and loads its URL. The page
+    is loaded twice, since cookies and storage can only be set for the
+    origin that is currently open.
+    """
+    driver.get(snapshot['url'])
+
+    driver.delete_all_cookies()
+    for cookie in snapshot['cookies']:
+        try:
+            driver.add_cookie(cookie)
+        except Exception as e:
+            print(f"Warning: could not restore cookie {cookie.get('name')}: {e}")
+
+    driver.execute_script("""
+        window.localStorage.clear();
+        for (const [key, value] of Object.entries(arguments[0])) window.localStorage.setItem(key, value);
+        window.sessionStorage.clear();
+        for (const [key, value] of Object.entries(arguments[1])) window.sessionStorage.setItem(key, value);
+    """, snapshot['local_storage'], snapshot['session_storage'])
+
+    driver.get(snapshot['url'])
+    ensure_page_loaded(driver, timeout)
@@ -0,0 +1,416 @@
+"""
+Capture bundles: what the browser stage saves of a page, so that every
+later stage can run again from disk without a browser.
+
+A bundle is a directory with
+
+- ``screenshot.png``: the full-page screenshot,
+- ``elements.json``: the extracted elements (after ``postprocess_elements``),
+- ``page.html``: the cleaned HTML of the page, if it was captured,
+- ``capture.json``: metadata (format version, URL, title, device pixel
+  ratio, screenshot size, element count and capture time), written last.
+
+The crawl pipeline's ``save_capture`` writes bundles. Result directories
+saved before this format (without ``capture.json``) load as bundles with
+empty metadata.
+
+The CPU stages (crop, dedup, tree building, PSI or VIPS segmentation) of
+a bundle run again with :func:`replay_bundle`. :func:`sweep` runs them over
+a parameter grid for many bundles in a process pool, cropping every bundle
+only once::
+
+    bundles = find_bundles('segmentation_results/TASKCAFE')
+    results = sweep(bundles, 'sweeps/dedup', {'allowed_deviation': [0.05, 0.075, 0.1], 'mode': ['sum', 'avg']})
+    results = sweep(bundles, 'sweeps/psi_vips', {'segmenter': ['psi', 'vips'], 'pdoc': [6, 8, 10]})
+"""
+import os
+import io
+import json
+import time
+import hashlib
+import itertools
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, TypedDict, Union
+
+from PIL import Image
+
+from selenium.webdriver.remote.webdriver import WebDriver
+
+from visca.browser import get_driver_dpr
+from visca.element_extractor import ElementInfo, save_elements_from_image
+from visca.dedup import deduplicate_screenshots
+from visca.virtual_node import build_dom_tree
+from visca.segment import DEFAULT_PDOC, segment_tree, vips_tree
+from visca.html_processing import clean_html
+
+
+BUNDLE_VERSION = 1
+
+SCREENSHOT_FILE = 'screenshot.png'
+ELEMENTS_FILE = 'elements.json'
+HTML_FILE = 'page.html'
+METADATA_FILE = 'capture.json'
+
+# Elements with their element screenshot, written by crop_bundle
+CROPPED_FILE = 'cropped.json'
+
+# Parameters of replay_bundle that a sweep can vary, with their defaults
+REPLAY_PARAMETERS: Dict[str, Any] = {
+    'allowed_deviation': 0.075,
+    'segmenter': 'psi',
+    'mode': 'sum',
+    'pdoc': DEFAULT_PDOC,
+}
+
+# Parameters that only apply to one segmenter
+_SEGMENTER_PARAMETERS = {
+    'psi': ('mode',),
+    'vips': ('pdoc',),
+}
+
+
+class PageInfo(TypedDict):
+    url: str
+    title: str
+    device_pixel_ratio: float
+    html: str
+
+
+def read_page(driver: WebDriver) -> PageInfo:
+    """URL, title, device pixel ratio and cleaned HTML of the page the driver shows."""
+    return {
+        'url': driver.current_url,
+        'title': driver.title,
+        'device_pixel_ratio': get_driver_dpr(driver),
+        'html': str(clean_html(driver.page_source)),
+    }
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    tmp_path.replace(path)
+
+
+class CaptureBundle:
+    """A saved capture of a page; every load returns fresh objects, as the stages annotate the elements in place."""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._metadata: Optional[Dict[str, Any]] = None
+
+
+    @staticmethod
+    def is_bundle(path: Union[str, Path]) -> bool:
+        path = Path(path)
+        return (path / SCREENSHOT_FILE).is_file() and (path / ELEMENTS_FILE).is_file()
+
+
+    @property
+    def name(self) -> str:
+        return self.path.name
+
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        if self._metadata is None:
+            metadata_path = self.path / METADATA_FILE
+            if metadata_path.is_file():
+                with open(metadata_path, 'r', encoding='utf-8') as f:
+                    self._metadata = json.load(f)
+            else:
+                self._metadata = {}
+        return self._metadata
+
+
+    def elements(self) -> List[ElementInfo]:
+        with open(self.path / ELEMENTS_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+
+    def screenshot(self) -> Image.Image:
+        screenshot = Image.open(self.path / SCREENSHOT_FILE)
+        screenshot.load()
+        return screenshot
+
+
+    def html(self) -> Optional[str]:
+        html_path = self.path / HTML_FILE
+        if not html_path.is_file():
+            return None
+        return html_path.read_text(encoding='utf-8')
+
+
+    def __repr__(self) -> str:
+        return f"CaptureBundle({str(self.path)!r})"
+
+
+def save_bundle(
+    bundle_dir: Union[str, Path],
+    elements: List[ElementInfo],
+    screenshot: Image.Image,
+    page: Optional[PageInfo] = None
+) -> CaptureBundle:
+    """
+    Saves a capture as a bundle. The metadata is written last, so a bundle
+    interrupted while saving has none.
+
+    Args:
+        bundle_dir: The bundle's directory, created if needed.
+        elements: The extracted elements.
+        screenshot: The full-page screenshot.
+        page: The page's URL, title, DPR and HTML (see :func:`read_page`).
+    """
+    bundle_dir = Path(bundle_dir)
+    bundle_dir.mkdir(parents=True, exist_ok=True)
+
+    png = io.BytesIO()
+    screenshot.save(png, format='PNG')
+    _write_atomic(bundle_dir / SCREENSHOT_FILE, png.getvalue())
+    _write_atomic(bundle_dir / ELEMENTS_FILE, json.dumps(elements).encode('utf-8'))
+    if page is not None:
+        _write_atomic(bundle_dir / HTML_FILE, page['html'].encode('utf-8'))
+
+    metadata = {
+        'version': BUNDLE_VERSION,
+        'time': time.time(),
+        'url': page['url'] if page is not None else None,
+        'title': page['title'] if page is not None else None,
+        'device_pixel_ratio': page['device_pixel_ratio'] if page is not None else None,
+        'screenshot_size': list(screenshot.size),
+        'elements': len(elements),
+        'html': page is not None,
+    }
+    _write_atomic(bundle_dir / METADATA_FILE, json.dumps(metadata, indent=2).encode('utf-8'))
+
+    return CaptureBundle(bundle_dir)
+
+
+def capture_bundle(driver: WebDriver, bundle_dir: Union[str, Path]) -> CaptureBundle:
+    """Captures the page the driver shows into a bundle."""
+    # Imported here as visca.crawl imports this module
+    from visca.crawl import capture_page
+
+    elements, screenshot, page = capture_page(driver)
+    return save_bundle(bundle_dir, elements, screenshot, page)
+
+
+def find_bundles(path: Union[str, Path]) -> List[CaptureBundle]:
+    """Bundles under ``path`` (or ``path`` itself), in path order."""
+    path = Path(path)
+    candidates = [path] + sorted(p for p in path.rglob('*') if p.is_dir())
+    return [CaptureBundle(p) for p in candidates if CaptureBundle.is_bundle(p)]
+
+
+def crop_bundle(bundle: CaptureBundle, crops_dir: Union[str, Path]) -> List[ElementInfo]:
+    """
+    Crops the element screenshots of a bundle into ``crops_dir`` (with
+    ``segments.json``, as ``save_elements_from_image`` does) and returns the
+    elements that have one. Reuses an earlier crop of the same bundle.
+    """
+    crops_dir = Path(crops_dir)
+    cropped_path = crops_dir / CROPPED_FILE
+    if cropped_path.is_file() and \
+            cropped_path.stat().st_mtime >= (bundle.path / ELEMENTS_FILE).stat().st_mtime:
+        with open(cropped_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    elements = save_elements_from_image(bundle.screenshot(), str(crops_dir), bundle.elements())
+    elements = [e for e in elements if 'screenshot' in e]
+    _write_atomic(cropped_path, json.dumps(elements).encode('utf-8'))
+    return elements
+
+
+def replay_bundle(
+    bundle: CaptureBundle,
+    work_dir: Union[str, Path],
+    allowed_deviation: float = REPLAY_PARAMETERS['allowed_deviation'],
+    segmenter: str = REPLAY_PARAMETERS['segmenter'],
+    mode: str = REPLAY_PARAMETERS['mode'],
+    pdoc: int = REPLAY_PARAMETERS['pdoc'],
+    crops_dir: Optional[Union[str, Path]] = None
+) -> Dict[str, Any]:
+    """
+    Runs the CPU stages of the pipeline on a bundle: crop, dedup, tree
+    building and segmentation, with PSI (``segmentation_xpath_aa.json``,
+    as the pipeline does) or VIPS (``segmentation_xpath_vips.json``). Without ``crops_dir``, ``work_dir`` ends
+    up like a result directory of the crawl pipeline after its image stage
+    (``screenshot.png``, ``segments.json``, ``deduplicated.json``), so the
+    model stages (``describe_page``, ``classify_state``, ...) can run on it.
+
+    Args:
+        bundle: The capture to replay.
+        work_dir: Where to write the outputs.
+        allowed_deviation: Dedup's padding tolerance.
+        segmenter: ``"psi"`` or ``"vips"``.
+        mode: PSI aggregation, ``"sum"`` or ``"avg"``.
+        pdoc: VIPS' permitted degree of coherence.
+        crops_dir: Where to crop to (or reuse the crops from) instead of
+            ``work_dir``, to share the crops between replays.
+
+    Returns:
+        Element, deduplicated element and segment counts, a digest of the
+        segmentation and the seconds of every stage.
+    """
+    if segmenter not in _SEGMENTER_PARAMETERS:
+        raise ValueError(f"Unknown segmenter '{segmenter}'. Expected 'psi' or 'vips'.")
+
+    work_dir = Path(work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    crops_dir = Path(crops_dir) if crops_dir is not None else work_dir
+    seconds: Dict[str, float] = {}
+
+    start = time.perf_counter()
+    elements = crop_bundle(bundle, crops_dir)
+    seconds['crop'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    deduplicated = deduplicate_screenshots(elements, allowed_deviation=allowed_deviation)
+    seconds['dedup'] = time.perf_counter() - start
+    with open(work_dir / 'deduplicated.json', 'w', encoding='utf-8') as f:
+        json.dump(deduplicated, f)
+
+    start = time.perf_counter()
+    tree = build_dom_tree(list(deduplicated))
+    seconds['tree'] = time.perf_counter() - start
+
+    with open(crops_dir / 'segments.json', 'r', encoding='utf-8') as f:
+        segments = json.load(f)
+    start = time.perf_counter()
+    if segmenter == 'psi':
+        instances = segment_tree(tree, work_dir, name='aa', mode=mode, elements=segments)
+    else:
+        instances = vips_tree(tree, work_dir, name='vips', pdoc=pdoc, elements=segments)
+    seconds['segment'] = time.perf_counter() - start
+
+    if crops_dir == work_dir and not (work_dir / SCREENSHOT_FILE).exists():
+        try:
+            os.link(bundle.path / SCREENSHOT_FILE, work_dir / SCREENSHOT_FILE)
+        except OSError:
+            bundle.screenshot().save(work_dir / SCREENSHOT_FILE)
+
+    return {
+        'elements': len(elements),
+        'deduplicated': len(deduplicated),
+        'segments': len(instances),
+        'digest': hashlib.sha256(json.dumps(instances, sort_keys=True).encode()).hexdigest(),
+        'seconds': seconds,
+    }
+
+
+def _parameters_name(parameters: Dict[str, Any]) -> str:
+    return ','.join(f'{key}={value}' for key, value in sorted(parameters.items()))
+
+
+def _crop_task(bundle_path: str, crops_dir: str, quiet: bool) -> int:
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull) if quiet else contextlib.nullcontext():
+        return len(crop_bundle(CaptureBundle(bundle_path), crops_dir))
+
+
+def _replay_task(bundle_path: str, work_dir: str, crops_dir: str, parameters: Dict[str, Any], quiet: bool) -> Dict[str, Any]:
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull) if quiet else contextlib.nullcontext():
+        return replay_bundle(CaptureBundle(bundle_path), work_dir, crops_dir=crops_dir, **parameters)
+
+
+def sweep(
+    bundles: Iterable[CaptureBundle],
+    work_dir: Union[str, Path],
+    grid: Dict[str, Iterable[Any]],
+    processes: Optional[int] = None,
+    quiet: bool = True
+) -> List[Dict[str, Any]]:
+    """
+    Replays every bundle with every combination of the parameters of
+    ``grid`` (see :data:`REPLAY_PARAMETERS`; missing ones keep their
+    default), in a process pool. Parameters of the other segmenter than a
+    combination's are left at their default, so no combination runs twice. Every bundle is cropped once, in
+    ``work_dir/<i>_<name>/crops``; each combination writes to a directory
+    named after its parameters next to it. The results are also written
+    to ``work_dir/sweep.json``.
+
+    Args:
+        bundles: The captures to replay.
+        work_dir: Where to write the outputs.
+        grid: The values to try, per parameter.
+        processes: Worker processes; defaults to the number of CPUs.
+        quiet: Hide the stages' output.
+
+    Returns:
+        One result of :func:`replay_bundle` per bundle and combination,
+        with its ``bundle`` and ``parameters``.
+    """
+    unknown = set(grid) - set(REPLAY_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown replay parameters: {', '.join(sorted(unknown))}")
+
+    bundles = list(bundles)
+    work_dir = Path(work_dir)
+    keys = list(grid)
+    combinations: List[Dict[str, Any]] = []
+    for values in itertools.product(*(list(grid[key]) for key in keys)):
+        parameters = {**REPLAY_PARAMETERS, **dict(zip(keys, values))}
+        for segmenter, segmenter_keys in _SEGMENTER_PARAMETERS.items():
+            if parameters['segmenter'] != segmenter:
+                parameters.update({key: REPLAY_PARAMETERS[key] for key in segmenter_keys})
+        if parameters not in combinations:
+            combinations.append(parameters)
+    bundle_dirs = [work_dir / f'{i}_{bundle.name}' for i, bundle in enumerate(bundles)]
+    print(f"▶ Replaying {len(bundles)} bundles × {len(combinations)} parameter combinations")
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        list(pool.map(
+            _crop_task,
+            [str(bundle.path) for bundle in bundles],
+            [str(bundle_dir / 'crops') for bundle_dir in bundle_dirs],
+            itertools.repeat(quiet)
+        ))
+        futures = [
+            (bundle, parameters, pool.submit(
+                _replay_task, str(bundle.path), str(bundle_dir / _parameters_name(parameters)),
+                str(bundle_dir / 'crops'), parameters, quiet
+            ))
+            for bundle, bundle_dir in zip(bundles, bundle_dirs)
+            for parameters in combinations
+        ]
+        results = []
+        for bundle, parameters, future in futures:
+            try:
+                results.append({'bundle': str(bundle.path), 'parameters': parameters, **future.result()})
+            except Exception as e:
+                print(f"✘ {bundle.path} with {_parameters_name(parameters)}: {e}")
+                results.append({'bundle': str(bundle.path), 'parameters': parameters, 'error': str(e)})
+
+    work_dir.mkdir(parents=True, exist_ok=True)
+    with open(work_dir / 'sweep.json', 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"✔ Sweep done in {time.perf_counter() - start:.1f}s")
+    print_sweep(results)
+    return results
+
+
+def print_sweep(results: List[Dict[str, Any]]) -> None:
+    """Deduplicated elements, segments and seconds summed over the bundles, per parameter combination."""
+    totals: Dict[str, Dict[str, float]] = {}
+    for result in results:
+        total = totals.setdefault(_parameters_name(result['parameters']),
+                                  {'deduplicated': 0, 'segments': 0, 'seconds': 0.0, 'errors': 0})
+        if 'error' in result:
+            total['errors'] += 1
+            continue
+        total['deduplicated'] += result['deduplicated']
+        total['segments'] += result['segments']
+        total['seconds'] += sum(v for k, v in result['seconds'].items() if k != 'crop')
+
+    width = max([len(name) for name in totals] + [10]) + 2
+    print(f"{'parameters':<{width}}{'dedup':>8}{'segments':>10}{'seconds':>10}{'errors':>8}")
+    for name, total in totals.items():
+        print(f"{name:<{width}}{total['deduplicated']:>8}{total['segments']:>10}"
+              f"{total['seconds']:>10.2f}{total['errors']:>8}")
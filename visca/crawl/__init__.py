@@ -0,0 +1,64 @@
+from .model import (
+    AppModel,
+    load_app_model,
+    save_app_model,
+    annotate_routes,
+    get_state_route,
+)
+from .journal import (
+    PIPELINE_VERSION,
+    STAGES,
+    CheckpointJournal,
+    JournaledMemory,
+)
+from .navigator import (
+    FormFillCache,
+    StateNavigator,
+    dfs_state_order,
+    perform_action,
+)
+from .session import SessionManager
+from .pipeline import (
+    CrawlPipeline,
+    capture_page,
+    capture_state,
+    navigate_and_capture,
+    save_capture,
+    load_capture,
+    crop_and_deduplicate,
+    load_deduplicated,
+    describe_page,
+    classify_state,
+    transform_state,
+    label_state,
+)
+
+
+__all__ = [
+    'AppModel',
+    'load_app_model',
+    'save_app_model',
+    'annotate_routes',
+    'get_state_route',
+    'PIPELINE_VERSION',
+    'STAGES',
+    'CheckpointJournal',
+    'JournaledMemory',
+    'FormFillCache',
+    'StateNavigator',
+    'dfs_state_order',
+    'perform_action',
+    'SessionManager',
+    'CrawlPipeline',
+    'capture_page',
+    'capture_state',
+    'navigate_and_capture',
+    'save_capture',
+    'load_capture',
+    'crop_and_deduplicate',
+    'load_deduplicated',
+    'describe_page',
+    'classify_state',
+    'transform_state',
+    'label_state',
+]
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import imagehash
+
+from visca.virtual_node import ComponentType
+
+
+# Bump when a stage's output changes meaning, so a resumed crawl redoes the
+# stages recorded by an older pipeline instead of reusing them
+PIPELINE_VERSION = '1'
+
+# Stages of a state, in order; a state resumes after its last recorded one
+STAGES = ('capture', 'images', 'context', 'classify', 'transform')
+
+
+class CheckpointJournal:
+    """
+    Append-only JSONL journal of the finished stages of every state::
+
+        {"state_id": "...", "stage": "classify", "version": "1", "time": 1718000000.0, "result": {...}}
+
+Entries of the component memory are journaled too, as they are written
+(see :class:`JournaledMemory`), so a resumed crawl does not generate the
+components it already paid for again::
+
+        {"memory": "<screenshot hash>", "version": "1", "time": 1718000000.0, "result": {...}}
+
+    Every record is flushed and fsynced before :meth:`record` returns, so a
+    crash loses at most the stage that was running. A torn last line (from
+    a crash mid-write) is dropped when the journal is opened. Records of
+    other pipeline versions are ignored. Safe to use from several threads.
+    """
+
+    def __init__(self, path: Union[str, Path], version: str = PIPELINE_VERSION):
+        """
+        Opens the journal at ``path``, creating it if needed, and loads the
+        stages recorded so far.
+
+        Args:
+            path: The JSONL file, e.g. ``<result_dir>/journal.jsonl``.
+            version: Pipeline version of the records to write and to trust.
+        """
+        self.path = Path(path)
+        self.version = version
+        self._lock = threading.Lock()
+        # state_id -> stage -> result of the latest record
+        self._finished: Dict[str, Dict[str, Any]] = {}
+        # Screenshot hash -> latest component memory entry
+        self._memory: Dict[str, Dict[str, Any]] = {}
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.path.is_file():
+            self._load()
+
+
+    def _load(self) -> None:
+        with open(self.path, 'rb') as f:
+            data = f.read()
+
+        # Everything after the last newline is an unfinished record
+        committed = data.rfind(b'\n') + 1
+        if committed < len(data):
+            print(f"Warning: dropping a torn record at the end of {self.path}")
+            with open(self.path, 'r+b') as f:
+                f.truncate(committed)
+
+        for line in data[:committed].splitlines():
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Warning: skipping an unreadable record in {self.path}")
+                continue
+            if entry.get('version') != self.version:
+                continue
+            if 'memory' in entry:
+                self._memory[entry['memory']] = entry.get('result')
+                continue
+            self._finished.setdefault(entry['state_id'], {})[entry['stage']] = entry.get('result')
+
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+    def record(self, state_id: str, stage: str, result: Optional[Dict[str, Any]] = None) -> None:
+        """Durably records that ``stage`` finished for ``state_id``, with its (JSON) result."""
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage '{stage}'. Expected one of {STAGES}.")
+
+        with self._lock:
+            self._append({
+                'state_id': state_id,
+                'stage': stage,
+                'version': self.version,
+                'time': time.time(),
+                'result': result,
+            })
+            self._finished.setdefault(state_id, {})[stage] = result
+
+
+    def record_memory(self, key: str, entry: Dict[str, Any]) -> None:
+        """Durably records the (JSON) component memory entry of the screenshot hash ``key``."""
+        with self._lock:
+            self._append({'memory': key, 'version': self.version, 'time': time.time(), 'result': entry})
+            self._memory[key] = entry
+
+
+    def memory_entries(self) -> Dict[str, Dict[str, Any]]:
+        """The recorded component memory entries, by screenshot hash."""
+        return dict(self._memory)
+
+
+    def is_finished(self, state_id: str, stage: str) -> bool:
+        return stage in self._finished.get(state_id, {})
+
+
+    def result(self, state_id: str, stage: str) -> Optional[Dict[str, Any]]:
+        """The recorded result of ``stage``, or None if it has not finished."""
+        return self._finished.get(state_id, {}).get(stage)
+
+
+    def last_stage(self, state_id: str) -> Optional[str]:
+        """The last stage (in pipeline order) recorded for ``state_id``, if any."""
+        finished = self._finished.get(state_id, {})
+        for stage in reversed(STAGES):
+            if stage in finished:
+                return stage
+        return None
+
+
+    def finished_states(self) -> List[str]:
+        """States that went through every stage."""
+        return [state_id for state_id, stages in self._finished.items() if STAGES[-1] in stages]
+
+
+class JournaledMemory(dict):
+    """
+    Component memory (see ``transform_candidate``) that records every entry
+    in a :class:`CheckpointJournal` as it is set, and starts with the
+    entries recorded by earlier runs of the crawl.
+    """
+
+    def __init__(self, journal: CheckpointJournal, initial: Optional[dict] = None):
+        """
+        Args:
+            journal: Where the entries are recorded and restored from.
+            initial: Entries to start with (not journaled), e.g. a memory
+                shared with earlier crawls.
+        """
+        super().__init__(initial or {})
+        self.journal = journal
+        for key, entry in journal.memory_entries().items():
+            super().__setitem__(imagehash.hex_to_hash(key), {
+                **entry, 'type': ComponentType(entry['type']) if entry.get('type') else None
+            })
+
+
+    def __setitem__(self, node_id, entry: Dict[str, Any]) -> None:
+        super().__setitem__(node_id, entry)
+        component_type = entry.get('type')
+        self.journal.record_memory(str(node_id), {
+            **entry, 'type': component_type.value if isinstance(component_type, ComponentType) else component_type
+        })
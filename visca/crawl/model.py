@@ -0,0 +1,91 @@
+import os
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+
+# A crawl model as stored in models/*.json: {'nodes': {state_id: state}, 'edges': {state_id: {action_id: state_id}}}
+AppModel = Dict[str, Any]
+
+
+def load_app_model(
+    model_path: Union[str, Path],
+    fallback_path: Optional[Union[str, Path]] = None
+) -> AppModel:
+    """
+    Loads the app model saved by a previous run, or the crawl model it
+    started from if there is none yet.
+
+    Args:
+        model_path: The ``model.json`` checkpointed by earlier runs.
+        fallback_path: The crawled model, e.g. ``models/TASKCAFE.json``.
+    """
+    if os.path.isfile(model_path) or fallback_path is None:
+        with open(model_path, 'r', encoding='utf-8') as f:
+            print('pre-loaded')
+            return json.load(f)
+
+    with open(fallback_path, 'r', encoding='utf-8') as f:
+        print('from scratch')
+        return json.load(f)
+
+
+def save_app_model(model: AppModel, model_path: Union[str, Path]) -> None:
+    """
+    Writes ``model`` to ``model_path`` atomically: a crash mid-write leaves the
+    previous checkpoint in place.
+    """
+    model_path = Path(model_path)
+    model_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = model_path.with_name(model_path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(model, f)
+        f.flush()
+        os.fsync(f.fileno())
+    tmp_path.replace(model_path)
+
+
+def annotate_routes(model: AppModel) -> AppModel:
+    """
+    Sets ``prev_state``, ``prev_action`` and ``depth`` on every state from the
+    model's edges, with the first state as the entry point.
+    """
+    nodes = model['nodes']
+    first_state_id = next(iter(nodes))
+    nodes[first_state_id]['depth'] = 0
+    nodes[first_state_id]['prev_action'] = None
+    nodes[first_state_id]['prev_state'] = None
+
+    for state_id, edges in model['edges'].items():
+        actions_by_id = {action['id']: action for action in nodes[state_id]['actions']}
+        for action_id, target_state_id in edges.items():
+            nodes[target_state_id]['prev_state'] = state_id
+            nodes[target_state_id]['prev_action'] = actions_by_id[action_id]
+            nodes[target_state_id]['depth'] = nodes[state_id].get('depth', 0) + 1
+
+    return model
+
+
+def get_state_route(nodes: Dict[str, Dict[str, Any]], state_id: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    Follows ``prev_state`` links back from ``state_id``.
+
+    Returns:
+        The initial state and the actions leading from it to ``state_id``,
+        in order.
+    """
+    curr_state = nodes[state_id]
+    prev_actions = [curr_state['prev_action']]
+
+    while True:
+        prev_state_id = curr_state['prev_state']
+
+        if prev_state_id is None:
+            break
+
+        curr_state = nodes[prev_state_id]
+        prev_actions.append(curr_state['prev_action'])
+
+    prev_actions = list(filter(lambda x: x is not None, reversed(prev_actions)))
+
+    return curr_state, prev_actions
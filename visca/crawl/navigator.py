@@ -0,0 +1,257 @@
+import json
+import time
+import hashlib
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
+from selenium.webdriver.support.ui import Select, WebDriverWait
+from selenium.webdriver.remote.webdriver import WebDriver
+
+from visca.browser import (
+    ensure_page_loaded,
+    snapshot_storage,
+    restore_storage,
+)
+from visca.llm.usage import usage_context
+
+from .model import AppModel, annotate_routes
+
+
+def dfs_state_order(model: AppModel) -> List[str]:
+    """
+    Orders the states depth-first over their ``prev_state`` links (see
+    :func:`annotate_routes`), children in model order. Consecutive states
+    then share the longest possible route prefix.
+    """
+    nodes = model['nodes']
+    children: Dict[Optional[str], List[str]] = {}
+    for state_id, state in nodes.items():
+        parent = state.get('prev_state')
+        children.setdefault(parent if parent in nodes else None, []).append(state_id)
+
+    order: List[str] = []
+    seen = set()
+    stack = list(reversed(children.get(None, [])))
+    while stack:
+        state_id = stack.pop()
+        if state_id in seen:
+            continue
+        seen.add(state_id)
+        order.append(state_id)
+        stack.extend(reversed(children.get(state_id, [])))
+
+    # States on a prev_state cycle are not reachable from a root
+    order.extend(state_id for state_id in nodes if state_id not in seen)
+    return order
+
+
+class FormFillCache:
+    """
+    Form-filling scripts generated by the model, keyed by the SHA-256 of
+    the form's outerHTML, so every form costs one model call per app.
+    Optionally persisted to a JSON file.
+    """
+
+    def __init__(self, path: Optional[Union[str, Path]] = None):
+        self.path = Path(path) if path is not None else None
+        self.scripts: Dict[str, str] = {}
+        if self.path is not None and self.path.is_file():
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.scripts = json.load(f)
+
+
+    def get_script(self, outer_html: str, form_filling_model: Callable) -> str:
+        key = hashlib.sha256(outer_html.encode()).hexdigest()
+        if key not in self.scripts:
+            with usage_context(purpose='form'):
+                response = form_filling_model(prompt=outer_html)
+            self.scripts[key] = response.text.replace('```python', '').replace('```', '')
+            self._save()
+        return self.scripts[key]
+
+
+    def evict(self, outer_html: str) -> None:
+        """Drops the script of a form, e.g. after it failed, so the next fill asks the model again."""
+        key = hashlib.sha256(outer_html.encode()).hexdigest()
+        if self.scripts.pop(key, None) is not None:
+            self._save()
+
+
+    def _save(self) -> None:
+        if self.path is not None:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(self.scripts, f)
+
+
+def script_globals(form: Any, driver: WebDriver) -> Dict[str, Any]:
+    """The globals a form-filling script runs with: the form, the driver and the usual selenium helpers."""
+    return {
+        'form': form,
+        'driver': driver,
+        'time': time,
+        'json': json,
+        'By': By,
+        'Keys': Keys,
+        'Select': Select,
+        'WebDriverWait': WebDriverWait,
+    }
+
+
+def perform_action(
+    driver: WebDriver,
+    action: Dict[str, Any],
+    form_filling_model: Optional[Callable] = None,
+    form_fill_cache: Optional[FormFillCache] = None
+) -> bool:
+    """
+    Performs a crawl model action: clicks its element, or fills and submits
+    its form with a generated script. Returns False if it could not be done.
+    """
+    try:
+        try:
+            element = driver.find_element(By.XPATH, action['id'])
+        except Exception:
+            element = driver.find_element(By.ID, action['id'])
+
+        if action['type'] == 'click':
+            element.click()
+        else:
+            if form_filling_model is None:
+                raise ValueError("a form action needs a form filling model")
+            cache = form_fill_cache if form_fill_cache is not None else FormFillCache()
+            script = cache.get_script(action['outerHTML'], form_filling_model)
+            try:
+                exec(script, script_globals(element, driver))
+            except Exception:
+                # A broken script would otherwise be replayed (and persisted) forever
+                cache.evict(action['outerHTML'])
+                raise
+        return True
+    except Exception as e:
+        print(f"Warning: could not perform {action['type']} on {action['id']}: {e}")
+        return False
+
+
+class StateNavigator:
+    """
+    Brings one WebDriver to any state of an app model by replaying the
+    actions of its route, starting from the closest point already reached
+    instead of the initial URL:
+
+    - the current state, if it lies on the route;
+    - its ancestors, through the browser history, as long as the actions
+      leading to them changed the URL;
+    - the deepest state of the route with a storage checkpoint, taken the
+      first time each state was reached.
+
+    Checkpoints and history are only used for states with a URL of their
+    own; states reached in-page (a modal, an expanded row) have to be
+    replayed from their closest ancestor that has one.
+    """
+
+    def __init__(
+        self,
+        driver: WebDriver,
+        model: AppModel,
+        form_filling_model: Optional[Callable] = None,
+        form_fill_cache: Optional[FormFillCache] = None,
+        timeout: int = 10
+    ):
+        """
+        Args:
+            driver: The driver to navigate.
+            model: The app model. Its routes are annotated if needed.
+            form_filling_model: Generates the scripts of form actions.
+            form_fill_cache: Shared cache of those scripts.
+            timeout: Passed to ``ensure_page_loaded``.
+        """
+        if any('prev_state' not in state for state in model['nodes'].values()):
+            annotate_routes(model)
+
+        self.driver = driver
+        self.nodes = model['nodes']
+        self.form_filling_model = form_filling_model
+        self.form_fill_cache = form_fill_cache if form_fill_cache is not None else FormFillCache()
+        self.timeout = timeout
+
+        self.current: Optional[str] = None
+        self._checkpoints: Dict[str, Dict[str, Any]] = {}
+        self.steps_replayed = 0
+
+
+    def reset(self) -> None:
+        """Forgets the current state and the checkpoints, e.g. after the session was renewed."""
+        self.current = None
+        self._checkpoints.clear()
+
+
+    def route(self, state_id: str) -> List[str]:
+        """States from the route's initial state to ``state_id``, both included."""
+        route = [state_id]
+        seen = {state_id}
+        prev_state = self.nodes[state_id].get('prev_state')
+        while prev_state is not None and prev_state not in seen:
+            route.append(prev_state)
+            seen.add(prev_state)
+            prev_state = self.nodes[prev_state].get('prev_state')
+        return list(reversed(route))
+
+
+    def _has_own_url(self, state_id: str) -> bool:
+        prev_state = self.nodes[state_id].get('prev_state')
+        return prev_state is None or self.nodes[prev_state]['url'] != self.nodes[state_id]['url']
+
+
+    def _back_to(self, route: List[str]) -> Optional[int]:
+        """Goes back in history from the current state to the route; returns its position on it."""
+        on_route = {state_id: i for i, state_id in enumerate(route)}
+        while self.current is not None and self.current not in on_route:
+            parent = self.nodes[self.current].get('prev_state')
+            if parent is None or not self._has_own_url(self.current):
+                return None
+            self.driver.back()
+            ensure_page_loaded(self.driver, self.timeout)
+            if self.driver.current_url != self.nodes[parent]['url']:
+                return None
+            self.current = parent
+        return on_route.get(self.current)
+
+
+    def goto(self, state_id: str) -> bool:
+        """
+        Navigates to ``state_id``. Returns False if an action of the route
+        could not be performed (the driver is then on the closest state the
+        replay reached).
+        """
+        route = self.route(state_id)
+
+        start = self._back_to(route) if self.current is not None else None
+        if start is None:
+            start = next(
+                (i for i in range(len(route) - 1, -1, -1)
+                 if route[i] in self._checkpoints and self._has_own_url(route[i])),
+                None
+            )
+            if start is not None:
+                restore_storage(self.driver, self._checkpoints[route[start]], self.timeout)
+            else:
+                start = 0
+                self.driver.get(self.nodes[route[0]]['url'])
+                ensure_page_loaded(self.driver, self.timeout)
+            self.current = route[start]
+            self._checkpoints.setdefault(self.current, snapshot_storage(self.driver))
+
+        for next_state in route[start + 1:]:
+            if not perform_action(
+                self.driver, self.nodes[next_state]['prev_action'],
+                self.form_filling_model, self.form_fill_cache
+            ):
+                return False
+            ensure_page_loaded(self.driver, self.timeout)
+            self.steps_replayed += 1
+            self.current = next_state
+            self._checkpoints.setdefault(next_state, snapshot_storage(self.driver))
+
+        return True
@@ -0,0 +1,572 @@
+"""
+Pipelined processing of all states of a crawled app.
+
+Each state goes through three stages, each with its own workers, connected
+by bounded queues so a fast stage blocks instead of piling up work:
+
+1. Browser: one thread per WebDriver of the pool navigates to the state and
+   extracts its elements and full-page screenshot.
+2. Images: a process pool crops the element screenshots and deduplicates
+   them (CPU bound, so kept off the GIL).
+3. Models: segmentation, classification and code generation. The model
+   calls block on the network, so several states are in flight at once,
+   each in a thread driven by the asyncio event loop.
+
+Every finished state is written into the app model, which is saved
+atomically, so an interrupted run resumes with the states it has not
+finished yet.
+"""
+import os
+import json
+import time
+import asyncio
+import contextvars
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from PIL import Image
+
+from selenium.webdriver.remote.webdriver import WebDriver
+
+from visca.browser import (
+    create_driver,
+    ensure_page_loaded,
+    capture_full_page_screenshot,
+)
+from visca.element_extractor import (
+    ElementInfo,
+    extract_elements_from_driver,
+    save_elements_from_image,
+)
+from visca.dedup import deduplicate_screenshots
+from visca.capture import PageInfo, CaptureBundle, read_page, save_bundle
+from visca.virtual_node import VirtualNode, build_dom_tree
+from visca.segment import RepeatedGroup, segment_tree, find_lists, map_lists
+from visca.preclassify import Preclassifier
+from visca.prompts import (
+    PAGE_CONTEXT_EXTRACTION_SYSTEM_PROMPT,
+    CLASSIFICATION_AND_CONTEXT_PROMPT,
+    COMPONENT_GENERATION_PROMPT,
+)
+from visca.instrument import span
+from visca.llm.usage import usage_context
+from visca.llm_processing import (
+    classify_and_describe_candidates,
+    transform_candidate,
+    build_component_model,
+    export_component_labels,
+    apply_component_labels,
+)
+
+from .model import AppModel, save_app_model
+from .journal import CheckpointJournal, JournaledMemory
+from .navigator import StateNavigator, dfs_state_order
+from .session import SessionManager
+
+
+def capture_page(driver: WebDriver) -> Tuple[List[ElementInfo], Image.Image, PageInfo]:
+    """Returns the elements, full-page screenshot and URL, title and HTML of the page the driver shows."""
+    dom_elements = extract_elements_from_driver(driver)
+    page = read_page(driver)
+    screenshot = capture_full_page_screenshot(driver)
+
+    return dom_elements, screenshot, page
+
+
+def capture_state(driver: WebDriver, url: str, timeout: int = 10) -> Tuple[List[ElementInfo], Image.Image, PageInfo]:
+    """Browser stage: loads ``url`` and returns its elements and full-page screenshot."""
+    driver.get(url)
+    ensure_page_loaded(driver, timeout)
+
+    return capture_page(driver)
+
+
+def navigate_and_capture(navigator: StateNavigator, state_id: str) -> Tuple[List[ElementInfo], Image.Image, PageInfo]:
+    """Browser stage with route replay: reaches ``state_id`` with ``navigator`` and captures it."""
+    if not navigator.goto(state_id):
+        raise RuntimeError(f"could not replay the route to {state_id}")
+
+    return capture_page(navigator.driver)
+
+
+def save_capture(
+    result_dir: str,
+    dom_elements: List[ElementInfo],
+    screenshot: Image.Image,
+    page: Optional[PageInfo] = None
+) -> None:
+    """
+    Saves the output of the browser stage to ``result_dir`` as a capture
+    bundle (see :mod:`visca.capture`), so it is never captured twice and
+    the later stages can be replayed without a browser.
+    """
+    save_bundle(result_dir, dom_elements, screenshot, page)
+
+
+def load_capture(result_dir: str) -> Tuple[List[ElementInfo], Image.Image]:
+    bundle = CaptureBundle(result_dir)
+    return bundle.elements(), bundle.screenshot()
+
+
+def crop_and_deduplicate(
+    result_dir: str,
+    dom_elements: Optional[List[ElementInfo]] = None,
+    screenshot: Optional[Image.Image] = None
+) -> List[ElementInfo]:
+    """
+    Image stage: saves the element screenshots and ``segments.json`` to
+    ``result_dir`` and returns the deduplicated elements, which are also
+    saved to ``deduplicated.json``. Without elements and screenshot, those
+    of :func:`save_capture` are loaded. Runs in a worker process.
+    """
+    if dom_elements is None or screenshot is None:
+        dom_elements, screenshot = load_capture(result_dir)
+    elif not os.path.isfile(f'{result_dir}/screenshot.png'):
+        save_capture(result_dir, dom_elements, screenshot)
+
+    dom_elements_with_screenshot = save_elements_from_image(screenshot, result_dir, dom_elements)
+    dom_elements_with_screenshot = list(filter(lambda x: 'screenshot' in x, dom_elements_with_screenshot))
+
+    deduplicated_elements = deduplicate_screenshots(dom_elements_with_screenshot)
+
+    with open(f'{result_dir}/deduplicated.json', 'w', encoding='utf-8') as f:
+        json.dump(deduplicated_elements, f)
+
+    return deduplicated_elements
+
+
+def load_deduplicated(result_dir: str) -> List[ElementInfo]:
+    with open(f'{result_dir}/deduplicated.json', 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def describe_page(result_dir: str, deduplicated_elements: List[ElementInfo], model_factory: Callable) -> str:
+    """
+    First model step: segments the state's tree (writing
+    ``segmentation_xpath_aa.json``) and returns the page context.
+    """
+    reduced_tree = build_dom_tree(list(deduplicated_elements))
+    segment_tree(reduced_tree, result_dir, name='aa', mode='sum')
+
+    page_context_model = model_factory(PAGE_CONTEXT_EXTRACTION_SYSTEM_PROMPT)
+    with usage_context(purpose='context'):
+        return page_context_model(file=f'{result_dir}/screenshot.png').text
+
+
+def find_state_lists(result_dir: str, reduced_tree: VirtualNode) -> Dict[str, RepeatedGroup]:
+    """
+    The obvious lists of a state (see :func:`find_lists`), found on the
+    tree of all its cropped elements (``segments.json``), since dedup
+    removes most of their alike items, and mapped onto ``reduced_tree``.
+    Without ``segments.json``, they are found on ``reduced_tree`` itself.
+    """
+    if not os.path.isfile(f'{result_dir}/segments.json'):
+        return find_lists(reduced_tree)
+    with open(f'{result_dir}/segments.json', 'r', encoding='utf-8') as f:
+        full_tree = build_dom_tree(json.load(f))
+    return map_lists(find_lists(full_tree), reduced_tree)
+
+
+def classify_state(
+    result_dir: str,
+    deduplicated_elements: List[ElementInfo],
+    page_context: str,
+    model_factory: Callable,
+    memory: dict,
+    preclassifier: Optional[Preclassifier] = None
+) -> Dict[str, dict]:
+    """
+    Second model step: classifies the segments and returns the labels of
+    the tree. Obvious lists are labeled from their repeated children, and
+    the nodes ``preclassifier`` is confident about from their features.
+    """
+    reduced_tree = build_dom_tree(list(deduplicated_elements))
+
+    classification_model = model_factory(CLASSIFICATION_AND_CONTEXT_PROMPT, settings={'temperature': 0})
+    classified_tree, _ = classify_and_describe_candidates(
+        root=reduced_tree,
+        classification_model=classification_model,
+        page_context=page_context,
+        memory=memory,
+        segment_json_path=f'{result_dir}/segmentation_xpath_aa.json',
+        lists=find_state_lists(result_dir, reduced_tree),
+        preclassifier=preclassifier
+    )
+
+    return export_component_labels(classified_tree)
+
+
+def transform_state(
+    state_id: str,
+    result_dir: str,
+    deduplicated_elements: List[ElementInfo],
+    page_context: str,
+    labels: Dict[str, dict],
+    model_factory: Callable,
+    memory: dict
+) -> Dict[str, Any]:
+    """
+    Last model step: generates the code of the classified tree, writes
+    ``transformed.jsx`` and returns the state's ``context`` and
+    ``components`` entries for the app model.
+    """
+    classified_tree = apply_component_labels(build_dom_tree(list(deduplicated_elements)), labels)
+
+    component_generation_model = model_factory(COMPONENT_GENERATION_PROMPT)
+    _, transformed_tree = transform_candidate(
+        root=classified_tree,
+        component_generation_model=component_generation_model,
+        page_context=page_context,
+        memory=memory,
+        state_id=state_id,
+        lists=find_state_lists(result_dir, classified_tree)
+    )
+
+    if transformed_tree.component_info is not None:
+        with open(f'{result_dir}/transformed.jsx', 'w', encoding='utf-8') as f:
+            f.write(transformed_tree.component_info.get_component_code())
+
+    return {
+        'context': page_context,
+        'components': build_component_model(transformed_tree),
+    }
+
+
+def label_state(
+    state_id: str,
+    result_dir: str,
+    deduplicated_elements: List[ElementInfo],
+    model_factory: Callable,
+    memory: dict
+) -> Dict[str, Any]:
+    """
+    Model stage in one call: :func:`describe_page`, :func:`classify_state`
+    and :func:`transform_state`.
+    """
+    page_context = describe_page(result_dir, deduplicated_elements, model_factory)
+    labels = classify_state(result_dir, deduplicated_elements, page_context, model_factory, memory)
+    return transform_state(state_id, result_dir, deduplicated_elements, page_context, labels, model_factory, memory)
+
+
+class CrawlPipeline:
+    """
+    Processes the states of an app model with all three stages (see the
+    module docstring) busy at once, and checkpoints every finished state
+    into ``model_path``.
+
+    Every finished step is also recorded in a :class:`CheckpointJournal`,
+    with the captures and deduplicated elements saved next to it. A
+    restarted run resumes every state after its last recorded step: states
+    that were captured are not navigated to again, and model calls of
+    finished steps are not repeated.
+
+    Example:
+        pipeline = CrawlPipeline(model, result_dir=DIR, model_path=f'{DIR}/model.json')
+        pipeline.run()               # or, inside a notebook: await pipeline.run_async()
+    """
+
+    def __init__(
+        self,
+        model: AppModel,
+        result_dir: Union[str, Path],
+        model_path: Optional[Union[str, Path]] = None,
+        browsers: int = 2,
+        processes: Optional[int] = None,
+        llm_concurrency: int = 4,
+        queue_size: int = 4,
+        memory: Optional[dict] = None,
+        model_factory: Optional[Callable] = None,
+        driver_factory: Callable[[], WebDriver] = create_driver,
+        prepare_driver: Optional[Callable[[WebDriver], None]] = None,
+        page_load_timeout: int = 10,
+        journal: Optional[CheckpointJournal] = None,
+        navigator_factory: Optional[Callable[[WebDriver], StateNavigator]] = None,
+        session: Optional[SessionManager] = None,
+        preclassifier: Optional[Preclassifier] = None
+    ):
+        """
+        Args:
+            model: The app model; states that already have 'components' are skipped.
+            result_dir: Directory of the per-state result directories.
+            model_path: Where the model is checkpointed after every state.
+                Defaults to ``result_dir/model.json``.
+            browsers: Number of WebDrivers (and browser threads).
+            processes: Number of image worker processes; defaults to the CPU count.
+            llm_concurrency: Number of states in the model stage at once.
+            queue_size: Capacity of the queues between stages.
+            memory: Initial entries of the component memory shared by all
+                states (see ``classify_and_describe_candidates``). Entries
+                the crawl adds are journaled and restored when it resumes
+                (see :class:`JournaledMemory`).
+            model_factory: Creates a model from a system prompt, like
+                ``visca.llm.gemini.create_model`` (the default).
+            driver_factory: Creates one WebDriver of the pool.
+            prepare_driver: Called on every new WebDriver, e.g. to log in.
+            page_load_timeout: Passed to ``ensure_page_loaded``.
+            journal: The checkpoint journal; defaults to ``result_dir/journal.jsonl``.
+            navigator_factory: Creates the :class:`StateNavigator` of every
+                WebDriver, to reach states by replaying their routes instead
+                of loading their URLs. States are then captured in DFS order.
+            session: Shares one login between the WebDrivers; it is restored
+                into every new WebDriver (after ``prepare_driver``) and
+                renewed before a capture once it has expired.
+            preclassifier: Labels the nodes it is confident about without
+                the model (see ``visca.preclassify``); None (the default)
+                classifies every node with the model.
+        """
+        if model_factory is None:
+            from visca.llm.gemini import create_model
+            model_factory = create_model
+
+        self.model = model
+        self.result_dir = Path(result_dir)
+        self.model_path = Path(model_path) if model_path is not None else self.result_dir / 'model.json'
+        self.browsers = browsers
+        self.processes = processes
+        self.llm_concurrency = llm_concurrency
+        self.queue_size = queue_size
+        self.model_factory = model_factory
+        self.driver_factory = driver_factory
+        self.prepare_driver = prepare_driver
+        self.page_load_timeout = page_load_timeout
+        self.journal = journal if journal is not None else CheckpointJournal(self.result_dir / 'journal.jsonl')
+        # New entries are journaled, so a resumed crawl reuses the components it already generated
+        self.memory = JournaledMemory(self.journal, memory)
+        self.navigator_factory = navigator_factory
+        self.session = session
+        self.preclassifier = preclassifier
+
+        # state_id -> error message of the stage that failed on it
+        self.failed: Dict[str, str] = {}
+        # Seconds spent in each stage, summed over its workers
+        self.stage_seconds: Dict[str, float] = {'browser': 0.0, 'images': 0.0, 'models': 0.0}
+
+
+    def pending_states(self) -> List[str]:
+        return [
+            state_id for state_id, state in self.model['nodes'].items()
+            if 'components' not in state
+        ]
+
+
+    def run(self, state_ids: Optional[List[str]] = None) -> AppModel:
+        """Blocking version of :meth:`run_async`, for scripts."""
+        return asyncio.run(self.run_async(state_ids))
+
+
+    async def run_async(self, state_ids: Optional[List[str]] = None) -> AppModel:
+        """
+        Processes ``state_ids`` (by default every state without components)
+        and returns the updated model. States that fail in a stage are
+        recorded in :attr:`failed` and left unprocessed.
+        """
+        if state_ids is None:
+            state_ids = self.pending_states()
+        if self.navigator_factory is not None:
+            position = {state_id: i for i, state_id in enumerate(dfs_state_order(self.model))}
+            state_ids = sorted(state_ids, key=lambda state_id: position.get(state_id, len(position)))
+
+        # Route every state to the stage after its last journaled one
+        to_capture: asyncio.Queue = asyncio.Queue()
+        resume_images: List[tuple] = []
+        resume_models: List[tuple] = []
+        restored = 0
+        for state_id in state_ids:
+            stage = self.journal.last_stage(state_id)
+            if stage == 'transform':
+                # Finished, but the model was not saved after it
+                self.model['nodes'][state_id].update(self.journal.result(state_id, 'transform'))
+                restored += 1
+            elif stage == 'capture':
+                resume_images.append((state_id, None, None, None))
+            elif stage is not None:
+                resume_models.append((state_id, None))
+            else:
+                to_capture.put_nowait(state_id)
+        if restored:
+            save_app_model(self.model, self.model_path)
+        print(f"▶ Processing {len(state_ids) - restored} states "
+              f"({len(resume_images)} resumed after capture, {len(resume_models)} after deduplication)")
+
+        loop = asyncio.get_running_loop()
+        captured: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        deduplicated: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+
+        n_browsers = max(0, min(self.browsers, to_capture.qsize()))
+        n_processes = self.processes or os.cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=max(n_browsers, 1)) as browser_pool, \
+                ThreadPoolExecutor(max_workers=self.llm_concurrency) as llm_pool, \
+                ProcessPoolExecutor(max_workers=n_processes) as image_pool:
+            drivers = await asyncio.gather(*(
+                loop.run_in_executor(browser_pool, self._new_driver) for _ in range(n_browsers)
+            ))
+            try:
+                image_workers = [
+                    asyncio.create_task(self._image_worker(image_pool, captured, deduplicated))
+                    for _ in range(n_processes)
+                ]
+                llm_workers = [
+                    asyncio.create_task(self._llm_worker(llm_pool, deduplicated))
+                    for _ in range(self.llm_concurrency)
+                ]
+                resume_models_feeder = asyncio.create_task(self._feed(deduplicated, resume_models))
+
+                # Each stage stops its successor once all of its own producers are done
+                await asyncio.gather(
+                    self._feed(captured, resume_images),
+                    *(self._browser_worker(browser_pool, driver, to_capture, captured) for driver in drivers)
+                )
+                for _ in image_workers:
+                    await captured.put(None)
+                await asyncio.gather(*image_workers, resume_models_feeder)
+                for _ in llm_workers:
+                    await deduplicated.put(None)
+                await asyncio.gather(*llm_workers)
+            finally:
+                await asyncio.gather(*(
+                    loop.run_in_executor(browser_pool, self._quit_driver, driver) for driver in drivers
+                ), return_exceptions=True)
+
+        print(f"▶ Done: {len(state_ids) - restored - len(self.failed)} processed, {len(self.failed)} failed. "
+              f"Stage time: " + ", ".join(f"{k}={v:.1f}s" for k, v in self.stage_seconds.items()))
+        return self.model
+
+
+    def _new_driver(self) -> WebDriver:
+        driver = self.driver_factory()
+        if self.prepare_driver is not None:
+            self.prepare_driver(driver)
+        if self.session is not None:
+            self.session.prepare(driver)
+        return driver
+
+
+    def _quit_driver(self, driver: WebDriver) -> None:
+        if self.session is not None:
+            self.session.forget(driver)
+        driver.quit()
+
+
+    @staticmethod
+    def _in_thread(pool, fn, *args):
+        # Runs in the caller's context, so spans in ``fn`` nest under the caller's
+        # and its model calls are attributed to the caller's usage context
+        return asyncio.get_running_loop().run_in_executor(pool, contextvars.copy_context().run, fn, *args)
+
+
+    def _fail(self, state_id: str, stage: str, error: Exception):
+        print(f"✘ {stage} failed for {state_id}: {error}")
+        self.failed[state_id] = f"{stage}: {error}"
+
+
+    async def _feed(self, queue: asyncio.Queue, items: List[tuple]):
+        for item in items:
+            await queue.put(item)
+
+
+    async def _browser_worker(self, pool, driver: WebDriver, to_capture: asyncio.Queue, captured: asyncio.Queue):
+        navigator = self.navigator_factory(driver) if self.navigator_factory is not None else None
+        while not to_capture.empty():
+            state_id = to_capture.get_nowait()
+            start = time.perf_counter()
+            try:
+                with span('state.capture', state_id=state_id):
+                    if self.session is not None and \
+                            await self._in_thread(pool, self.session.ensure, driver) and navigator is not None:
+                        navigator.reset()
+                    if navigator is not None:
+                        dom_elements, screenshot, page = await self._in_thread(
+                            pool, navigate_and_capture, navigator, state_id
+                        )
+                    else:
+                        dom_elements, screenshot, page = await self._in_thread(
+                            pool, capture_state, driver, self.model['nodes'][state_id]['url'], self.page_load_timeout
+                        )
+            except Exception as e:
+                self._fail(state_id, 'browser', e)
+                continue
+            finally:
+                self.stage_seconds['browser'] += time.perf_counter() - start
+            # Blocks while the image stage is behind
+            await captured.put((state_id, dom_elements, screenshot, page))
+
+
+    async def _image_worker(self, pool, captured: asyncio.Queue, deduplicated: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await captured.get()
+            if item is None:
+                return
+            state_id, dom_elements, screenshot, page = item
+            result_dir = str(self.result_dir / state_id)
+            start = time.perf_counter()
+            try:
+                # Runs in a worker process, which records no spans of its own
+                with span('state.images', state_id=state_id):
+                    if dom_elements is not None:
+                        await loop.run_in_executor(pool, save_capture, result_dir, dom_elements, screenshot, page)
+                        self.journal.record(state_id, 'capture')
+                    deduplicated_elements = await loop.run_in_executor(
+                        pool, crop_and_deduplicate, result_dir, dom_elements, screenshot
+                    )
+                self.journal.record(state_id, 'images')
+            except Exception as e:
+                self._fail(state_id, 'images', e)
+                continue
+            finally:
+                self.stage_seconds['images'] += time.perf_counter() - start
+            await deduplicated.put((state_id, deduplicated_elements))
+
+
+    async def _llm_worker(self, pool, deduplicated: asyncio.Queue):
+        while True:
+            item = await deduplicated.get()
+            if item is None:
+                return
+            state_id, deduplicated_elements = item
+            result_dir = str(self.result_dir / state_id)
+            start = time.perf_counter()
+            try:
+                if deduplicated_elements is None:
+                    deduplicated_elements = await self._in_thread(pool, load_deduplicated, result_dir)
+
+                context = self.journal.result(state_id, 'context')
+                if context is None:
+                    with span('state.context', state_id=state_id), usage_context(state_id=state_id):
+                        page_context = await self._in_thread(
+                            pool, describe_page, result_dir, deduplicated_elements, self.model_factory
+                        )
+                    self.journal.record(state_id, 'context', {'context': page_context})
+                else:
+                    page_context = context['context']
+
+                classified = self.journal.result(state_id, 'classify')
+                if classified is None:
+                    with span('state.classify', state_id=state_id), usage_context(state_id=state_id):
+                        labels = await self._in_thread(
+                            pool, classify_state,
+                            result_dir, deduplicated_elements, page_context, self.model_factory, self.memory,
+                            self.preclassifier
+                        )
+                    self.journal.record(state_id, 'classify', {'labels': labels})
+                else:
+                    labels = classified['labels']
+
+                with span('state.transform', state_id=state_id), usage_context(state_id=state_id):
+                    result = await self._in_thread(
+                        pool, transform_state,
+                        state_id, result_dir, deduplicated_elements, page_context, labels,
+                        self.model_factory, self.memory
+                    )
+                self.journal.record(state_id, 'transform', result)
+            except Exception as e:
+                self._fail(state_id, 'models', e)
+                continue
+            finally:
+                self.stage_seconds['models'] += time.perf_counter() - start
+
+            # Checkpoint; runs on the event loop thread, so saves never overlap
+            self.model['nodes'][state_id].update(result)
+            save_app_model(self.model, self.model_path)
+            print(f"✔ {state_id}")
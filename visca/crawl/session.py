@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from selenium.webdriver.remote.webdriver import WebDriver
+
+from visca.browser import (
+    snapshot_storage,
+    restore_storage,
+)
+
+
+class SessionManager:
+    """
+    Logs in to an app once and shares the authenticated session (cookies,
+    localStorage and sessionStorage) with every driver of a pool.
+
+    The session is saved to ``path``, so later runs skip the login as well.
+    It is considered expired once it is older than ``max_age``, when one
+    of the tracked cookies expires, or when ``is_logged_in`` says so after
+    it was restored. Only then is ``login`` run again, by a single driver;
+    the others wait for it and reuse the new session.
+    """
+
+    def __init__(
+        self,
+        login: Callable[[WebDriver], None],
+        path: Optional[Union[str, Path]] = None,
+        is_logged_in: Optional[Callable[[WebDriver], bool]] = None,
+        max_age: Optional[float] = None,
+        auth_cookies: Optional[List[str]] = None,
+        timeout: int = 10
+    ):
+        """
+        Args:
+            login: Logs a driver in, e.g. the notebook's ``authenticate``.
+            path: JSON file the session is saved to and loaded from.
+            is_logged_in: Checks a driver showing the restored session.
+            max_age: Seconds after which a session is logged in again.
+            auth_cookies: Names of the cookies whose expiry ends the
+                session; by default every cookie with an expiry.
+            timeout: Passed to ``ensure_page_loaded``.
+        """
+        self.login = login
+        self.path = Path(path) if path is not None else None
+        self.is_logged_in = is_logged_in
+        self.max_age = max_age
+        self.auth_cookies = set(auth_cookies) if auth_cookies is not None else None
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._snapshot: Optional[Dict[str, Any]] = None
+        # Bumped by every login; id(driver) -> generation of the session it has
+        self._generation = 0
+        self._driver_generation: Dict[int, int] = {}
+        self.logins = 0
+
+        if self.path is not None and self.path.is_file():
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._snapshot = json.load(f)
+
+
+    def is_expired(self, snapshot: Optional[Dict[str, Any]] = None) -> bool:
+        snapshot = snapshot if snapshot is not None else self._snapshot
+        if snapshot is None:
+            return True
+
+        now = time.time()
+        if self.max_age is not None and now - snapshot['time'] > self.max_age:
+            return True
+
+        for cookie in snapshot['cookies']:
+            if self.auth_cookies is not None and cookie.get('name') not in self.auth_cookies:
+                continue
+            if 'expiry' in cookie and cookie['expiry'] <= now:
+                return True
+
+        return False
+
+
+    def _login(self, driver: WebDriver) -> None:
+        print("▶ Logging in")
+        self.login(driver)
+        self.logins += 1
+
+        snapshot = snapshot_storage(driver)
+        snapshot['time'] = time.time()
+        self._snapshot = snapshot
+        self._generation += 1
+        self._driver_generation[id(driver)] = self._generation
+
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f)
+                f.flush()
+                os.fsync(f.fileno())
+            tmp_path.replace(self.path)
+
+
+    def _restore(self, driver: WebDriver) -> bool:
+        """Restores the current session into ``driver``; False if it turns out to be logged out."""
+        restore_storage(driver, self._snapshot, self.timeout)
+        self._driver_generation[id(driver)] = self._generation
+        return self.is_logged_in is None or self.is_logged_in(driver)
+
+
+    def prepare(self, driver: WebDriver) -> None:
+        """Gives a new driver the shared session, logging in first if there is no valid one."""
+        with self._lock:
+            if not self.is_expired() and self._restore(driver):
+                return
+            self._login(driver)
+
+
+    def ensure(self, driver: WebDriver) -> bool:
+        """
+        Called before each navigation: renews an expired session (once for
+        the whole pool) and hands a session renewed by another driver to
+        this one.
+
+        Returns:
+            Whether the driver's session changed, which invalidates any
+            storage snapshot taken with the previous one.
+        """
+        if not self.is_expired() and self._driver_generation.get(id(driver)) == self._generation:
+            return False
+
+        with self._lock:
+            if self.is_expired():
+                self._login(driver)
+            elif self._driver_generation.get(id(driver)) != self._generation and not self._restore(driver):
+                self._login(driver)
+        return True
+
+
+    def forget(self, driver: WebDriver) -> None:
+        """Drops the bookkeeping of a driver that is about to quit."""
+        self._driver_generation.pop(id(driver), None)
@@ -2,6 +2,7 @@ import numpy as np
 from PIL import Image
 
 from visca.virtual_node import build_dom_tree
+from visca.instrument import traced
 from .hash import (
     compute_image_hashes,
     remove_hash_duplicates
@@ -24,6 +25,7 @@ def load_image_arrays(segments):
     return image_arrays
 
 
+@traced('dedup')
 def deduplicate_screenshots(
     segments,
     allowed_deviation=0.075,
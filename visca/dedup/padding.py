@@ -1,6 +1,9 @@
+from typing import Optional, Tuple
+
 import numpy as np
 
-from visca.virtual_node import VirtualNode
+from visca.geometry import boxes_from_elements
+from visca.virtual_node import VirtualNode, iter_preorder
 
 
 def analyze_image_flatness(image, bin_size=1):
@@ -54,7 +57,12 @@ def analyze_image_flatness(image, bin_size=1):
     }
 
 
-def is_padding_duplicate(parent_array, child_array, allowed_deviation=0.075):
+def is_padding_duplicate(
+    parent_array,
+    child_array,
+    allowed_deviation=0.075,
+    offset: Optional[Tuple[int, int]] = None
+):
     """
     Check if parent is the same as child but with added padding.
     
@@ -66,15 +74,15 @@ def is_padding_duplicate(parent_array, child_array, allowed_deviation=0.075):
     Args:
         parent_array: Numpy array of parent image
         child_array: Numpy array of child image
-        color_threshold: Maximum color distance allowed between padding pixels
         allowed_deviation: Maximum percentage of outlier padding pixels allowed
-        debug: Whether to print debugging information
+        offset: (x, y) of the child within the parent, if known from their
+            boxes; only that position is checked instead of all of them
     
     Returns:
-        tuple: (is_duplicate, offset_x, offset_y) or (False, None, None)
+        bool: Whether the parent is the child with single-color padding
     """
     if parent_array is None or child_array is None:
-        return False, None, None
+        return False
     
     # Get dimensions
     parent_h, parent_w = parent_array.shape[:2]
@@ -82,35 +90,40 @@ def is_padding_duplicate(parent_array, child_array, allowed_deviation=0.075):
     
     # Child must be smaller than parent
     if child_h > parent_h or child_w > parent_w:
-        return False, None, None
+        return False
     
     # Calculate all possible positions to check
     max_x = parent_w - child_w + 1
     max_y = parent_h - child_h + 1
+    if offset is not None:
+        if not (0 <= offset[0] < max_x and 0 <= offset[1] < max_y):
+            return False
+        positions = [(offset[1], offset[0])]
+    else:
+        positions = ((y, x) for y in range(max_y) for x in range(max_x))
     
     # Try all possible positions
-    for start_y in range(max_y):
-        for start_x in range(max_x):
-            # Extract region from parent
-            region = parent_array[start_y:start_y+child_h, start_x:start_x+child_w]
+    for start_y, start_x in positions:
+        # Extract region from parent
+        region = parent_array[start_y:start_y+child_h, start_x:start_x+child_w]
+        
+        # Check if region matches child (with exact match first for efficiency)
+        if np.array_equal(region, child_array):
+            # Create a mask where True = child area, False = padding
+            mask = np.zeros((parent_h, parent_w), dtype=bool)
+            mask[start_y:start_y+child_h, start_x:start_x+child_w] = True
+            
+            # Extract all padding pixels
+            padding_pixels = parent_array[~mask]
+            
+            # Skip if no padding (shouldn't happen but just in case)
+            if padding_pixels.size == 0:
+                continue
             
-            # Check if region matches child (with exact match first for efficiency)
-            if np.array_equal(region, child_array):
-                # Create a mask where True = child area, False = padding
-                mask = np.zeros((parent_h, parent_w), dtype=bool)
-                mask[start_y:start_y+child_h, start_x:start_x+child_w] = True
-                
-                # Extract all padding pixels
-                padding_pixels = parent_array[~mask]
-                
-                # Skip if no padding (shouldn't happen but just in case)
-                if padding_pixels.size == 0:
-                    continue
-                
-                flatness = analyze_image_flatness(padding_pixels)
-                
-                if flatness['non_dominant_percentage'] < allowed_deviation:
-                    return True
+            flatness = analyze_image_flatness(padding_pixels)
+            
+            if flatness['non_dominant_percentage'] < allowed_deviation:
+                return True
     
     return False
 
@@ -137,34 +150,50 @@ def process_padding_duplicates(
     if visited is None:
         visited = set()
     
-    # Skip if already visited to avoid cycles
-    node_path = node.data.xpath if hasattr(node, 'xpath') else str(id(node))
-    if node_path in visited:
+    # Nodes whose path was already visited are skipped with their subtree, to avoid cycles.
+    # The loop body runs before the iterator decides whether to enter a node's children.
+    revisited = set()
+    
+    # Every parent-child pair is checked independently, so a pre-order walk
+    # finds the same pairs as the bottom-up one
+    pairs = []
+    for current in iter_preorder(node, skip_children=lambda n: id(n) in revisited):
+        node_path = current.data.xpath if hasattr(current, 'xpath') else str(id(current))
+        if node_path in visited:
+            revisited.add(id(current))
+            continue
+        visited.add(node_path)
+        
+        # Skip root node
+        if current.data.tag_name == "root":
+            continue
+        
+        # Only process nodes with exactly one child
+        if len(current.children) == 1:
+            pairs.append((current.data, current.children[0].data))
+    
+    if not pairs:
         return set()
-    visited.add(node_path)
     
-    to_remove = set()
+    # Element screenshots are crops of the page at their boxes (clipped at
+    # the top-left corner), so the child's crop can only be at this offset
+    parent_boxes = boxes_from_elements([parent for parent, _ in pairs])
+    child_boxes = boxes_from_elements([child for _, child in pairs])
+    offsets = (np.maximum(child_boxes[:, :2], 0) - np.maximum(parent_boxes[:, :2], 0)).astype(np.int64)
+    has_box = (child_boxes[:, 2] > child_boxes[:, 0]) & (child_boxes[:, 3] > child_boxes[:, 1])
     
-    # Process all children first (bottom-up approach)
-    for child in node.children:
-        to_remove.update(process_padding_duplicates(
-            child, image_arrays, allowed_deviation, visited
-        ))
-    
-    # Skip root node
-    if node.data.tag_name == "root":
-        return to_remove
-    
-    # Only process nodes with exactly one child
-    if len(node.children) == 1:
-        child = node.children[0]
-        parent_array = image_arrays.get(node.data.xpath)
-        child_array = image_arrays.get(child.data.xpath)
+    to_remove = set()
+    for (parent, child), offset, known in zip(pairs, offsets, has_box):
+        parent_array = image_arrays.get(parent.xpath)
+        child_array = image_arrays.get(child.xpath)
         
         # Check if parent contains child with single-color padding
-        is_padding = is_padding_duplicate(parent_array, child_array, allowed_deviation)
+        is_padding = is_padding_duplicate(
+            parent_array, child_array, allowed_deviation,
+            offset=(int(offset[0]), int(offset[1])) if known else None
+        )
         
         if is_padding:
-            to_remove.add(child.data.xpath)
+            to_remove.add(child.xpath)
     
     return to_remove
@@ -2,7 +2,7 @@ import os
 import json
 import traceback
 from pathlib import Path
-from typing import List, TypedDict
+from typing import List, Optional, TypedDict
 
 import numpy as np
 from PIL import Image
@@ -14,6 +14,7 @@ from visca.browser import (
     capture_full_page_screenshot,
 )
 from visca.html_processing import clean_html
+from visca.instrument import traced
 
 
 class ElementInfo(TypedDict):
@@ -27,9 +28,12 @@ class ElementInfo(TypedDict):
     visible: bool
     text: str
     html: str
+    # [checked, value, selected] properties of form elements
+    formState: Optional[List]
     xpath: str
     screenshot: str
     index: int
+    parentIndex: Optional[int]
     gt_dataBlock: str     
     gt_dataBlockType: str
 
@@ -43,7 +47,7 @@ def extract_dom_elements(driver: WebDriver) -> List[ElementInfo]:
     Extract DOM elements with accurate bounding boxes and XPath information.
     """
     script = """
-    function getElementInfo(element, index) {
+    function getElementInfo(element, index, parentIndex) {
         // Get element position relative to the page (not viewport)
         const rect = element.getBoundingClientRect();
         const scrollLeft = window.pageXOffset || document.documentElement.scrollLeft;
@@ -106,8 +110,14 @@ def extract_dom_elements(driver: WebDriver) -> List[ElementInfo]:
                         getComputedStyle(element).visibility !== 'hidden',
             text: element.textContent.trim().substring(0, 50),
             html: element.outerHTML,
+            // Form state lives in properties, which outerHTML does not reflect
+            formState: ('checked' in element || 'value' in element)
+                ? [element.checked ?? null, element.value ?? null, element.selected ?? null]
+                : null,
             xpath: getXPath(element),
-            index: index
+            index: index,
+            // Index of the closest extracted ancestor (null for the body)
+            parentIndex: parentIndex
         };
     }
     
@@ -131,7 +141,7 @@ def extract_dom_elements(driver: WebDriver) -> List[ElementInfo]:
             if (!isElementVisible(element)) return;
             
             const index = elements.length;
-            const info = getElementInfo(element, index);
+            const info = getElementInfo(element, index, parentIndex);
             
             // Skip elements outside the viewport or too small
             if (info.width < 5 || info.height < 5 || 
@@ -288,6 +298,44 @@ def scale_coordinates(dom_elements: List[ElementInfo], dpr: float = 1.0) -> List
     return dom_elements
 
 
+def postprocess_elements(
+    dom_elements: List[ElementInfo],
+    small_elements: List[TextElementInfo],
+    dpr: float = 1.0
+) -> List[ElementInfo]:
+    """
+    Merges the text elements into the DOM elements, scales both to CSS
+    pixels and drops the ones too small to be components.
+    """
+    for small_elem in small_elements:
+        # Check if this element is already in dom_elements to avoid duplicates
+        is_duplicate = False
+        for dom_elem in dom_elements:
+            if (dom_elem.get('xpath') == small_elem.get('xpath') or
+                (dom_elem.get('x') == small_elem.get('x') and
+                dom_elem.get('y') == small_elem.get('y') and
+                dom_elem.get('width') == small_elem.get('width') and
+                dom_elem.get('height') == small_elem.get('height'))):
+                is_duplicate = True
+                # Enhance existing element with interactive flag
+                if small_elem.get('isInteractive'):
+                    dom_elem['isInteractive'] = True
+                break
+        
+        if not is_duplicate:
+            dom_elements.append(small_elem)
+    
+    dom_elements = scale_coordinates(dom_elements, dpr=dpr)
+    
+    # Filter super small elements
+    dom_elements = list(filter(
+        lambda e: e['width'] >= 10 and e['height'] >= 10,
+        dom_elements
+    ))
+    
+    return dom_elements
+
+
 def extract_elements_from_driver(driver: WebDriver):
     try:
         print(f"Processing {driver.current_url}...")
@@ -296,37 +344,11 @@ def extract_elements_from_driver(driver: WebDriver):
 
         small_elements = extract_text_elements(driver)
         
-        # Merge small elements with main DOM elements
-        for small_elem in small_elements:
-            # Check if this element is already in dom_elements to avoid duplicates
-            is_duplicate = False
-            for dom_elem in dom_elements:
-                if (dom_elem.get('xpath') == small_elem.get('xpath') or
-                    (dom_elem.get('x') == small_elem.get('x') and
-                    dom_elem.get('y') == small_elem.get('y') and
-                    dom_elem.get('width') == small_elem.get('width') and
-                    dom_elem.get('height') == small_elem.get('height'))):
-                    is_duplicate = True
-                    # Enhance existing element with interactive flag
-                    if small_elem.get('isInteractive'):
-                        dom_elem['isInteractive'] = True
-                    break
-            
-            if not is_duplicate:
-                dom_elements.append(small_elem)
-        
-        dom_elements = scale_coordinates(
+        return postprocess_elements(
             dom_elements,
+            small_elements,
             dpr=get_driver_dpr(driver)
         )
-        
-        # Filter super small elements
-        dom_elements = list(filter(
-            lambda e: e['width'] >= 10 and e['height'] >= 10,
-            dom_elements
-        ))
-        
-        return dom_elements
     except Exception as e:
         print(f"Error segmenting webpage: {e}")
         traceback.print_exc()
@@ -426,24 +448,41 @@ def elements_to_json(elements: List[ElementInfo]):
             'gt_dataBlock': element['gt_dataBlock'],
             'gt_dataBlockType': element['gt_dataBlockType']
         })
+        
+        # Only elements from extract_dom_elements have it: their indexes share one
+        # numbering, unlike the merged-in text elements
+        if 'parentIndex' in element:
+            result[-1]['parentIndex'] = element['parentIndex']
     
     return result
 
 
-def save_elements(
-    driver: WebDriver,
+@traced('crop')
+def save_elements_from_image(
+    image: Image.Image,
     result_dir: str,
-    dom_elements
+    dom_elements,
+    crop_elements: Optional[List[ElementInfo]] = None
 ):
+    """
+    Crops the screenshot of every element from a full-page screenshot of the
+    page and writes all of them to ``segments.json``. Needs no driver, so it
+    can run in a worker process.
+
+    Args:
+        image: The full-page screenshot.
+        result_dir: The page's result directory.
+        dom_elements: The extracted elements.
+        crop_elements: Subset of ``dom_elements`` to crop, e.g. in an
+            incremental run whose other elements reuse earlier screenshots.
+            Defaults to all of them.
+    """
     os.makedirs(result_dir, exist_ok=True)
-    
-    image = capture_full_page_screenshot(driver)
-    
-
 
-    dom_elements_with_screenshot = capture_element_screenshots(
-        image, dom_elements, result_dir
+    capture_element_screenshots(
+        image, dom_elements if crop_elements is None else crop_elements, result_dir
     )
+    dom_elements_with_screenshot = dom_elements
     
     elements_json = elements_to_json(dom_elements_with_screenshot)
     
@@ -453,3 +492,18 @@ def save_elements(
         json.dump(elements_json, f)
     
     return dom_elements_with_screenshot
+
+
+def save_elements(
+    driver: WebDriver,
+    result_dir: str,
+    dom_elements,
+    crop_elements: Optional[List[ElementInfo]] = None
+):
+    """
+    Takes a full-page screenshot with ``driver`` and saves the elements with
+    :func:`save_elements_from_image`.
+    """
+    image = capture_full_page_screenshot(driver)
+    
+    return save_elements_from_image(image, result_dir, dom_elements, crop_elements)
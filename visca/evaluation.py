@@ -0,0 +1,443 @@
+"""
+Batched evaluation of page segmentations against ground truth.
+
+A segmentation file maps every segment root XPath to the elements under it
+(``{xpath: {'count': ..., 'leaves': [...]}}``, as written by
+``segment_tree``, ``vips_tree`` or :func:`ground_truth_from_elements`). A
+page is scored on its leaf elements: every leaf belongs to the innermost
+segment that lists it (or to a segment of its own), which turns both
+segmentations into label arrays. All metrics follow from their contingency
+table in a few numpy operations:
+
+- ``precision`` / ``recall`` / ``f1``: share of the predicted (ground-truth)
+  segments whose leaves overlap a ground-truth (predicted) segment with an
+  IoU of at least ``iou_threshold``,
+- ``root_precision`` / ``root_recall``: the same for identical root XPaths,
+- ``bcubed_precision`` / ``bcubed_recall`` / ``bcubed_f1``: element-wise
+  cluster agreement,
+- ``ari``: adjusted Rand index of the two labelings,
+- ``box_precision`` / ``box_recall`` / ``box_f1`` (when both sides'
+  ``segments.json`` give the boxes of the roots): the same as ``precision``
+  and ``recall`` with the IoU of the segments' boxes, which does not depend
+  on both captures having the same XPaths.
+
+Pages are scored in a process pool, and every page's scores are cached by
+the hashes of its two files, so re-running after changing a few
+predictions only scores those::
+
+    python -m visca.evaluation evaluation/segmentation/results \\
+        --prediction auto-assert/segmentation_xpath_aa.json \\
+        --ground-truth ground-truth/segmentation_xpath_gt.json
+"""
+import os
+import json
+import time
+import bisect
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+
+from visca.geometry import BoxIndex, boxes_from_elements
+
+
+# Bump when the scores change for the same files, to invalidate the cache
+METRICS_VERSION = 1
+
+METRICS = (
+    'precision', 'recall', 'f1',
+    'root_precision', 'root_recall',
+    'bcubed_precision', 'bcubed_recall', 'bcubed_f1',
+    'ari',
+    'box_precision', 'box_recall', 'box_f1',
+)
+
+CACHE_FILE = '.evaluation_cache.json'
+
+
+def _leaf_flags(sorted_xpaths: List[str]) -> np.ndarray:
+    """For XPaths in sorted order: whether none of the others descends from it (descendants sort right after)."""
+    flags = np.ones(len(sorted_xpaths), dtype=bool)
+    for i in range(len(sorted_xpaths) - 1):
+        if sorted_xpaths[i + 1].startswith(sorted_xpaths[i] + '/'):
+            flags[i] = False
+    return flags
+
+
+def ground_truth_from_elements(elements: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Ground-truth segmentation of a page annotated with ``data-block``: one
+    segment per element with a ``gt_dataBlock``, listing the leaf elements
+    under it, in element order.
+
+    Args:
+        elements: The page's elements, e.g. its ``segments.json``.
+
+    Returns:
+        ``{xpath: {'count', 'dataBlock', 'dataBlockType', 'leaves'}}``.
+    """
+    order = sorted(range(len(elements)), key=lambda i: elements[i]['xpath'])
+    sorted_xpaths = [elements[i]['xpath'] for i in order]
+    is_leaf = _leaf_flags(sorted_xpaths)
+
+    segments: Dict[str, Dict[str, Any]] = {}
+    for element in elements:
+        if element.get('gt_dataBlock') is None:
+            continue
+        root_xpath = element['xpath']
+        # The descendants are the contiguous run of XPaths starting with root + '/'
+        start = bisect.bisect_left(sorted_xpaths, root_xpath + '/')
+        end = bisect.bisect_left(sorted_xpaths, root_xpath + '0')  # '0' follows '/'
+        leaf_positions = sorted(order[k] for k in range(start, end) if is_leaf[k])
+        leaves = [elements[i]['xpath'] for i in leaf_positions]
+        segments[root_xpath] = {
+            'count': len(leaves),
+            'dataBlock': element['gt_dataBlock'],
+            'dataBlockType': element['gt_dataBlockType'],
+            'leaves': leaves,
+        }
+    return segments
+
+
+def _labels(segmentation: Dict[str, Dict[str, Any]], index: Dict[str, int]) -> np.ndarray:
+    """Segment of every item: the innermost (longest root XPath) segment listing it, or -1."""
+    labels = np.full(len(index), -1, dtype=np.int64)
+    depth = np.full(len(index), -1, dtype=np.int64)
+    for label, (root, segment) in enumerate(segmentation.items()):
+        items = np.fromiter((index[x] for x in segment.get('leaves', []) if x in index), dtype=np.int64)
+        deeper = items[depth[items] < len(root)]
+        labels[deeper] = label
+        depth[deeper] = len(root)
+    return labels
+
+
+def _f1(p: float, r: float) -> float:
+    return 2 * p * r / (p + r) if p + r else 0.0
+
+
+def _pairs(counts: np.ndarray) -> float:
+    return float((counts * (counts - 1) // 2).sum())
+
+
+def score_segmentation(
+    prediction: Dict[str, Dict[str, Any]],
+    ground_truth: Dict[str, Dict[str, Any]],
+    iou_threshold: float = 0.5
+) -> Dict[str, float]:
+    """
+    Scores a predicted segmentation of a page against its ground truth
+    (see the module docstring for the metrics).
+
+    Args:
+        prediction: ``{root_xpath: {'leaves': [...], ...}}``.
+        ground_truth: The same for the ground truth.
+        iou_threshold: Leaf IoU at which two segments match.
+
+    Returns:
+        The metrics, plus the number of items and of segments on each side.
+    """
+    # Items: the leaves listed by either side that have no listed descendant
+    listed = sorted({x for s in prediction.values() for x in s.get('leaves', [])} |
+                    {x for s in ground_truth.values() for x in s.get('leaves', [])})
+    items = [x for x, leaf in zip(listed, _leaf_flags(listed)) if leaf]
+    index = {x: i for i, x in enumerate(items)}
+    n = len(items)
+
+    predicted = _labels(prediction, index)
+    actual = _labels(ground_truth, index)
+
+    # Unassigned items are singleton segments
+    n_pred, n_gt = len(prediction), len(ground_truth)
+    predicted = np.where(predicted >= 0, predicted, n_pred + np.arange(n))
+    actual = np.where(actual >= 0, actual, n_gt + np.arange(n))
+
+    pair_ids, n_ij = np.unique(predicted * (n_gt + n) + actual, return_counts=True)
+    pred_ids, gt_ids = pair_ids // (n_gt + n), pair_ids % (n_gt + n)
+    pred_sizes = np.bincount(predicted, minlength=n_pred + n)
+    gt_sizes = np.bincount(actual, minlength=n_gt + n)
+
+    # Segment matching, over the real segments that have items
+    real = (pred_ids < n_pred) & (gt_ids < n_gt)
+    iou = n_ij[real] / (pred_sizes[pred_ids[real]] + gt_sizes[gt_ids[real]] - n_ij[real])
+    matched = iou >= iou_threshold
+    pred_present = np.count_nonzero(pred_sizes[:n_pred])
+    gt_present = np.count_nonzero(gt_sizes[:n_gt])
+    precision = float(np.unique(pred_ids[real][matched]).size / pred_present) if pred_present else 0.0
+    recall = float(np.unique(gt_ids[real][matched]).size / gt_present) if gt_present else 0.0
+
+    common_roots = len(prediction.keys() & ground_truth.keys())
+
+    if n:
+        bcubed_precision = float((n_ij ** 2 / pred_sizes[pred_ids]).sum() / n)
+        bcubed_recall = float((n_ij ** 2 / gt_sizes[gt_ids]).sum() / n)
+    else:
+        bcubed_precision = bcubed_recall = 0.0
+
+    same_pairs, pred_pairs, gt_pairs = _pairs(n_ij), _pairs(pred_sizes), _pairs(gt_sizes)
+    all_pairs = n * (n - 1) / 2
+    expected = pred_pairs * gt_pairs / all_pairs if all_pairs else 0.0
+    maximum = (pred_pairs + gt_pairs) / 2
+    ari = (same_pairs - expected) / (maximum - expected) if maximum != expected else 1.0
+
+    return {
+        'precision': precision,
+        'recall': recall,
+        'f1': _f1(precision, recall),
+        'root_precision': common_roots / n_pred if n_pred else 0.0,
+        'root_recall': common_roots / n_gt if n_gt else 0.0,
+        'bcubed_precision': bcubed_precision,
+        'bcubed_recall': bcubed_recall,
+        'bcubed_f1': _f1(bcubed_precision, bcubed_recall),
+        'ari': float(ari),
+        'items': n,
+        'predicted_segments': n_pred,
+        'ground_truth_segments': n_gt,
+    }
+
+
+def score_boxes(
+    predicted_boxes: np.ndarray,
+    ground_truth_boxes: np.ndarray,
+    iou_threshold: float = 0.5
+) -> Dict[str, float]:
+    """
+    Segment precision and recall by box: the share of the predicted
+    (ground-truth) segment boxes that overlap a ground-truth (predicted) box
+    with an IoU of at least ``iou_threshold``.
+
+    Args:
+        predicted_boxes: ``(n, 4)`` boxes of the predicted segments.
+        ground_truth_boxes: ``(m, 4)`` boxes of the ground-truth segments.
+        iou_threshold: Box IoU at which two segments match.
+    """
+    predicted_ids, ground_truth_ids, _ = BoxIndex(ground_truth_boxes).overlaps(
+        predicted_boxes, min_iou=max(iou_threshold, 1e-9)
+    )
+    precision = float(np.unique(predicted_ids).size / len(predicted_boxes)) if len(predicted_boxes) else 0.0
+    recall = float(np.unique(ground_truth_ids).size / len(ground_truth_boxes)) if len(ground_truth_boxes) else 0.0
+    return {'box_precision': precision, 'box_recall': recall, 'box_f1': _f1(precision, recall)}
+
+
+def _root_boxes(segmentation: Dict[str, Dict[str, Any]], elements_path: Union[str, Path]) -> np.ndarray:
+    """Boxes of the segment roots listed in an elements file (roots it lacks are left out)."""
+    with open(elements_path, 'r', encoding='utf-8') as f:
+        elements = {e['xpath']: e for e in json.load(f)}
+    return boxes_from_elements([elements[xpath] for xpath in segmentation if xpath in elements])
+
+
+def _load_segmentation(path: Union[str, Path]) -> Dict[str, Dict[str, Any]]:
+    """A segmentation file, or the ground truth built from a ``segments.json`` element list."""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        return ground_truth_from_elements(data)
+    return data
+
+
+def _file_hash(path: Union[str, Path]) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def evaluate_page(
+    prediction_path: str,
+    ground_truth_path: str,
+    iou_threshold: float = 0.5,
+    prediction_elements: Optional[str] = None,
+    ground_truth_elements: Optional[str] = None
+) -> Dict[str, float]:
+    """
+    Scores one page's files with :func:`score_segmentation`, and with
+    :func:`score_boxes` if the elements files of both sides are given.
+    """
+    prediction = _load_segmentation(prediction_path)
+    ground_truth = _load_segmentation(ground_truth_path)
+    scores = score_segmentation(prediction, ground_truth, iou_threshold)
+    if prediction_elements is not None and ground_truth_elements is not None:
+        scores.update(score_boxes(
+            _root_boxes(prediction, prediction_elements),
+            _root_boxes(ground_truth, ground_truth_elements),
+            iou_threshold
+        ))
+    return scores
+
+
+def find_pages(
+    results_root: Union[str, Path],
+    prediction: str,
+    ground_truth: str,
+    prediction_elements: Optional[str] = None,
+    ground_truth_elements: Optional[str] = None
+) -> Dict[str, List[Optional[Path]]]:
+    """
+    ``{page: [prediction, ground_truth, prediction_elements,
+    ground_truth_elements]}`` paths of the page directories of
+    ``results_root`` that have the first two (paths relative to a page
+    directory; the ground truth may also be a ``segments.json``). The
+    elements files are None unless both exist.
+    """
+    pages = {}
+    for page_dir in sorted(p for p in Path(results_root).iterdir() if p.is_dir()):
+        paths = [page_dir / prediction, page_dir / ground_truth, None, None]
+        if not (paths[0].is_file() and paths[1].is_file()):
+            continue
+        if prediction_elements is not None and ground_truth_elements is not None and \
+                (page_dir / prediction_elements).is_file() and (page_dir / ground_truth_elements).is_file():
+            paths[2:] = [page_dir / prediction_elements, page_dir / ground_truth_elements]
+        pages[page_dir.name] = paths
+    return pages
+
+
+def _load_cache(cache_path: Path) -> Dict[str, Any]:
+    if cache_path.is_file():
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Warning: ignoring unreadable evaluation cache {cache_path}: {e}")
+    return {}
+
+
+def _save_cache(cache_path: Path, cache: Dict[str, Any]) -> None:
+    tmp_path = cache_path.with_name(cache_path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f)
+        f.flush()
+        os.fsync(f.fileno())
+    tmp_path.replace(cache_path)
+
+
+def evaluate_dataset(
+    results_root: Union[str, Path],
+    prediction: str = 'auto-assert/segmentation_xpath_aa.json',
+    ground_truth: str = 'ground-truth/segmentation_xpath_gt.json',
+    prediction_elements: Optional[str] = 'auto-assert/segments.json',
+    ground_truth_elements: Optional[str] = 'ground-truth/segments.json',
+    iou_threshold: float = 0.5,
+    processes: Optional[int] = None,
+    cache_path: Optional[Union[str, Path]] = None,
+    output: Optional[Union[str, Path]] = None
+) -> Dict[str, Any]:
+    """
+    Scores the prediction of every page of ``results_root`` against its
+    ground truth, in a process pool, reusing the cached scores of pages
+    whose two files have not changed.
+
+    Args:
+        results_root: Directory with one directory per page.
+        prediction: The prediction file, relative to a page directory.
+        ground_truth: The ground-truth file (or ``segments.json``), relative
+            to a page directory.
+        prediction_elements: The elements of the predicted page, giving the
+            boxes of its segments; None to skip the box metrics.
+        ground_truth_elements: The same for the ground-truth page.
+        iou_threshold: Leaf IoU at which two segments match.
+        processes: Worker processes; defaults to the number of CPUs.
+        cache_path: The score cache; defaults to ``results_root/.evaluation_cache.json``.
+        output: Where to also write the report as JSON.
+
+    Returns:
+        ``{'settings', 'pages': {page: scores}, 'mean': {metric: macro average}}``.
+    """
+    results_root = Path(results_root)
+    cache_path = Path(cache_path) if cache_path is not None else results_root / CACHE_FILE
+    pages = find_pages(results_root, prediction, ground_truth, prediction_elements, ground_truth_elements)
+    cache = _load_cache(cache_path)
+    start = time.perf_counter()
+
+    keys = {
+        page: ':'.join([str(METRICS_VERSION), str(iou_threshold)] +
+                       [_file_hash(path) if path is not None else '' for path in paths])
+        for page, paths in pages.items()
+    }
+    missing = [page for page in pages if keys[page] not in cache]
+    print(f"▶ Evaluating {len(pages)} pages ({len(pages) - len(missing)} cached)")
+
+    if missing:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = {
+                page: pool.submit(
+                    evaluate_page, str(pages[page][0]), str(pages[page][1]), iou_threshold,
+                    *(str(path) if path is not None else None for path in pages[page][2:])
+                )
+                for page in missing
+            }
+            for page, future in futures.items():
+                try:
+                    cache[keys[page]] = future.result()
+                except Exception as e:
+                    print(f"✘ {page}: {e}")
+        _save_cache(cache_path, cache)
+
+    scores = {page: cache[keys[page]] for page in pages if keys[page] in cache}
+    report = {
+        'settings': {
+            'prediction': prediction,
+            'ground_truth': ground_truth,
+            'prediction_elements': prediction_elements,
+            'ground_truth_elements': ground_truth_elements,
+            'iou_threshold': iou_threshold,
+        },
+        'pages': scores,
+        # Over the pages that have the metric
+        'mean': {
+            metric: float(np.mean([s[metric] for s in scores.values() if metric in s]))
+            for metric in METRICS if any(metric in s for s in scores.values())
+        },
+    }
+    print(f"✔ Evaluated in {time.perf_counter() - start:.2f}s")
+
+    if output is not None:
+        Path(output).parent.mkdir(parents=True, exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def print_report(report: Dict[str, Any], pages: bool = False) -> None:
+    columns = [c for c in ('f1', 'precision', 'recall', 'bcubed_f1', 'ari', 'box_f1') if c in report['mean']]
+    header = f"{'page':<36}" + ''.join(f"{c:>11}" for c in columns)
+    print(header)
+    if pages:
+        for page, scores in report['pages'].items():
+            print(f"{page[:35]:<36}" + ''.join(
+                f"{scores[c]:>11.3f}" if c in scores else f"{'-':>11}" for c in columns
+            ))
+    print(f"{'mean of ' + str(len(report['pages'])) + ' pages':<36}"
+          + ''.join(f"{report['mean'][c]:>11.3f}" for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m visca.evaluation', description="Segmentation evaluation")
+    parser.add_argument('results_root', help="directory with one directory per page")
+    parser.add_argument('--prediction', default='auto-assert/segmentation_xpath_aa.json')
+    parser.add_argument('--ground-truth', default='ground-truth/segmentation_xpath_gt.json')
+    parser.add_argument('--prediction-elements', default='auto-assert/segments.json')
+    parser.add_argument('--ground-truth-elements', default='ground-truth/segments.json')
+    parser.add_argument('--iou', type=float, default=0.5, help="leaf (and box) IoU at which segments match")
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--out', default=None, help="where to write the JSON report")
+    parser.add_argument('--pages', action='store_true', help="print every page's scores")
+    args = parser.parse_args()
+
+    report = evaluate_dataset(
+        args.results_root,
+        prediction=args.prediction,
+        ground_truth=args.ground_truth,
+        prediction_elements=args.prediction_elements,
+        ground_truth_elements=args.ground_truth_elements,
+        iou_threshold=args.iou,
+        processes=args.processes,
+        output=args.out
+    )
+    print_report(report, pages=args.pages)
+
+
+if __name__ == '__main__':
+    main()
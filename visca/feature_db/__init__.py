@@ -0,0 +1,30 @@
+from .index import (
+    VectorIndex,
+    ExactIndex,
+    IVFIndex,
+    create_index,
+)
+from .database import (
+    InMemoryWarningVectorDB,
+    query_similar_features,
+)
+from .storage import (
+    save_db,
+    load_db,
+    compact_db,
+    import_pickle_db,
+)
+
+
+__all__ = [
+    'VectorIndex',
+    'ExactIndex',
+    'IVFIndex',
+    'create_index',
+    'InMemoryWarningVectorDB',
+    'query_similar_features',
+    'save_db',
+    'load_db',
+    'compact_db',
+    'import_pickle_db',
+]
@@ -0,0 +1,307 @@
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .index import VectorIndex, create_index
+from .rows import EmbeddingRows
+
+
+def _matches_filter(doc: Dict[str, Any], filters: Dict[str, Any]) -> bool:
+    """Evaluates the small subset of Mongo-style filters used by the notebooks."""
+    for key, filter_value in filters.items():
+        doc_value = doc.get(key)
+        if isinstance(filter_value, dict) and '$in' in filter_value:
+            if doc_value not in filter_value['$in']:
+                return False
+        elif doc_value != filter_value:
+            return False
+    return True
+
+
+class InMemoryWarningVectorDB:
+    def __init__(self, index_type: str = 'exact', index_options: Optional[Dict[str, Any]] = None):
+        """
+        Minimal in-memory database for storing features and component features,
+        with vector similarity search capability.
+
+        Embeddings are kept in an append-only row store, separate from the
+        feature documents, and searched through one similarity index per app
+        partition. A query restricted to an app only scans that app's vectors
+        and always returns up to ``top_k`` hits from it. Partition indexes are
+        built on first use, so opening a persisted DB does not touch them.
+
+        Args:
+            index_type: The index used for each partition ('exact' or 'ivf').
+            index_options: Extra keyword arguments for the index constructor.
+        """
+        self.features: Dict[str, Dict[str, Any]] = {}  # _id -> feature_doc (without embedding)
+        self.component_features: List[Dict[str, Any]] = []
+
+        self.index_type = index_type
+        self.index_options = index_options or {}
+        self._partitions: Dict[Optional[str], VectorIndex] = {}
+        self._embedding_dim: int = -1
+
+        self._rows: Optional[EmbeddingRows] = None
+        self._feature_rows: Dict[str, int] = {}  # _id -> row in self._rows
+
+        # Mutations since the last save, consumed by visca.feature_db.storage
+        self._feature_log: List[Dict[str, Any]] = []
+        self._component_log: List[Dict[str, Any]] = []
+        # Directory and manifest this DB was last opened from or saved to
+        self._storage: Optional[Dict[str, Any]] = None
+
+
+    # --- Internal Embedding Management ---
+    def _validate_and_set_embedding_dim(self, embedding: List[float]) -> None:
+        current_len = len(embedding)
+        if self._embedding_dim == -1:
+            if current_len == 0:
+                raise ValueError("Embedding dimension cannot be 0.")
+            self._embedding_dim = current_len
+        elif current_len != self._embedding_dim:
+            raise ValueError(
+                f"All embeddings must have the same dimension. "
+                f"Expected {self._embedding_dim}, got {current_len}."
+            )
+
+
+    def _append_row(self, embedding: List[float]) -> int:
+        if self._rows is None:
+            self._rows = EmbeddingRows(self._embedding_dim)
+        return self._rows.append(np.asarray(embedding, dtype=np.float32))
+
+
+    def _partition(self, app: Optional[str]) -> VectorIndex:
+        """Returns the index of ``app``, building it from the row store on first use."""
+        if app not in self._partitions:
+            partition = create_index(self.index_type, self._embedding_dim, **self.index_options)
+            feature_ids = [_id for _id, doc in self.features.items() if doc.get("app") == app]
+            if feature_ids:
+                rows = np.fromiter((self._feature_rows[_id] for _id in feature_ids), dtype=np.int64)
+                partition.add_many(feature_ids, self._rows.take(rows))
+            self._partitions[app] = partition
+        return self._partitions[app]
+
+
+    def _index_feature(self, feature_id: str, feature_doc: Dict[str, Any]) -> None:
+        # Partitions that were not built yet pick the feature up when they are
+        partition = self._partitions.get(feature_doc.get("app"))
+        if partition is not None:
+            partition.add(feature_id, self._rows.get(self._feature_rows[feature_id]))
+
+
+    def _unindex_feature(self, feature_id: str, feature_doc: Dict[str, Any]) -> None:
+        partition = self._partitions.get(feature_doc.get("app"))
+        if partition is not None:
+            partition.remove(feature_id)
+
+
+    def _with_embedding(self, feature_id: str) -> Dict[str, Any]:
+        feature = self.features[feature_id].copy()
+        feature["embedding"] = self._rows.get(self._feature_rows[feature_id]).tolist()
+        return feature
+
+
+    def rebuild_index(self) -> None:
+        """Drops the partition indexes; they are rebuilt from the row store on next use."""
+        self._partitions.clear()
+
+
+    @property
+    def dead_rows(self) -> int:
+        """Number of stored embedding rows no longer referenced by any feature."""
+        if self._rows is None:
+            return 0
+        return len(self._rows) - len(self._feature_rows)
+
+
+    # --- Feature Management Methods ---
+    def add_feature(self, feature_doc: Dict[str, Any]) -> str:
+        _id = str(feature_doc.get("_id", uuid.uuid4().hex)) # Use hex for shorter UUID string
+
+        embedding_val = feature_doc.get("embedding")
+        if embedding_val is None or not isinstance(embedding_val, list):
+            raise ValueError("Feature document must contain a valid 'embedding' list.")
+
+        self._validate_and_set_embedding_dim(embedding_val)
+
+        feature_doc["_id"] = _id
+        if _id in self.features:
+            raise ValueError(f"Feature with ID {_id} already exists. Use update_feature instead.")
+
+        stored_doc = {k: v for k, v in feature_doc.items() if k != "embedding"}
+        self.features[_id] = stored_doc
+        self._feature_rows[_id] = self._append_row(embedding_val)
+        self._index_feature(_id, stored_doc)
+        self._feature_log.append({"op": "put", "_id": _id, "row": self._feature_rows[_id], "doc": stored_doc.copy()})
+        return _id
+
+
+    def get_feature(self, feature_id: str) -> Optional[Dict[str, Any]]:
+        feature_id_str = str(feature_id)
+        if feature_id_str not in self.features:
+            return None
+        return self._with_embedding(feature_id_str) # Return a copy
+
+
+    def update_feature(self, feature_id: str, updates: Dict[str, Any]) -> bool:
+        feature_id_str = str(feature_id)
+        if feature_id_str not in self.features:
+            return False
+
+        original_feature = self.features[feature_id_str]
+        new_embedding = None
+        modified = False
+
+        if "embedding" in updates:
+            new_embedding = updates["embedding"]
+            if new_embedding is None or not isinstance(new_embedding, list):
+                raise ValueError("Updated 'embedding' must be a valid list.")
+            self._validate_and_set_embedding_dim(new_embedding)
+            current = self._rows.get(self._feature_rows[feature_id_str])
+            if np.array_equal(current, np.asarray(new_embedding, dtype=np.float32)):
+                new_embedding = None
+        reindex = new_embedding is not None or \
+            ("app" in updates and original_feature.get("app") != updates["app"])
+
+        if reindex:
+            self._unindex_feature(feature_id_str, original_feature)
+
+        for key, value in updates.items():
+            if key != "embedding" and original_feature.get(key) != value:
+                original_feature[key] = value
+                modified = True
+        if new_embedding is not None:
+            # Rows are append-only; the old row becomes garbage until compaction
+            self._feature_rows[feature_id_str] = self._append_row(new_embedding)
+            modified = True
+
+        if reindex:
+            self._index_feature(feature_id_str, original_feature)
+        if modified:
+            self._feature_log.append({
+                "op": "put",
+                "_id": feature_id_str,
+                "row": self._feature_rows[feature_id_str],
+                "doc": original_feature.copy()
+            })
+
+        return modified
+
+
+    def delete_feature(self, feature_id: str) -> bool:
+        feature_id_str = str(feature_id)
+        if feature_id_str in self.features:
+            self._unindex_feature(feature_id_str, self.features.pop(feature_id_str))
+            del self._feature_rows[feature_id_str]
+            self._feature_log.append({"op": "del", "_id": feature_id_str})
+            return True
+        return False
+
+
+    def list_features(self, app_filter: Optional[str] = None) -> List[Dict[str, Any]]:
+        return [
+            self._with_embedding(_id) for _id, feat in self.features.items()
+            if not app_filter or feat.get("app") == app_filter
+        ]
+
+
+    def vector_search_features(
+        self,
+        query_embedding: List[float],
+        top_k: int,
+        app_filter: Optional[str] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Returns up to ``top_k`` ``(feature_id, cosine_similarity)`` pairs, best first.
+
+        With ``app_filter`` only that app's partition is searched, so the
+        filter is applied before ranking instead of after it.
+        """
+        self._validate_and_set_embedding_dim(query_embedding)
+        query_vec_np = np.asarray(query_embedding, dtype=np.float32)
+
+        if app_filter is not None:
+            return self._partition(app_filter).search(query_vec_np, top_k)
+
+        results: List[Tuple[str, float]] = []
+        for app in {doc.get("app") for doc in self.features.values()}:
+            results.extend(self._partition(app).search(query_vec_np, top_k))
+        results.sort(key=lambda r: r[1], reverse=True)
+        return results[:top_k]
+
+
+    # --- Component Feature Management Methods ---
+    def add_component_feature(self, component_feature_doc: Dict[str, Any]) -> str:
+        _id = str(component_feature_doc.get("_id", uuid.uuid4().hex))
+        doc_copy = component_feature_doc.copy()
+        doc_copy["_id"] = _id
+        self.component_features.append(doc_copy)
+        self._component_log.append({"op": "add", "doc": doc_copy.copy()})
+        return _id
+
+
+    def list_component_features(self, filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        if not filters:
+            return [doc.copy() for doc in self.component_features]
+        return [doc.copy() for doc in self.component_features if _matches_filter(doc, filters)]
+
+
+    def update_component_features(self, filter_criteria: Dict[str, Any], updates: Dict[str, Any]) -> int:
+        updated_count = 0
+        for doc in self.component_features: # Operates on original docs in list
+            if _matches_filter(doc, filter_criteria):
+                doc.update(updates)
+                updated_count += 1
+        if updated_count > 0:
+            self._component_log.append({"op": "update", "filter": filter_criteria, "updates": updates})
+        return updated_count
+
+
+    def delete_component_features(self, filter_criteria: Dict[str, Any]) -> int:
+        initial_count = len(self.component_features)
+        self.component_features = [
+            doc for doc in self.component_features if not _matches_filter(doc, filter_criteria)
+        ]
+        deleted_count = initial_count - len(self.component_features)
+        if deleted_count > 0:
+            self._component_log.append({"op": "delete", "filter": filter_criteria})
+        return deleted_count
+
+
+    # --- Utility ---
+    def clear_all_data(self):
+        for feature_id in list(self.features):
+            self.delete_feature(feature_id)
+        self.delete_component_features({})
+        self._partitions.clear()
+
+
+def query_similar_features(
+    db: InMemoryWarningVectorDB,
+    app_name: str,
+    query_embedding: List[float],
+    vector_search_limit: int = 10,
+    result_limit: int = 5
+) -> List[Dict[str, Any]]:
+    """
+    Finds the features of ``app_name`` most similar to ``query_embedding``.
+
+    The search runs on the app's own partition, so up to ``result_limit``
+    features are returned whenever the app has that many.
+    """
+    candidate_tuples = db.vector_search_features(
+        query_embedding,
+        top_k=min(vector_search_limit, result_limit),
+        app_filter=app_name
+    )
+
+    results = []
+    for feature_id, similarity_score in candidate_tuples:
+        feature_doc = db.get_feature(feature_id) # Returns a copy
+        if feature_doc:
+            feature_doc['search_similarity_score'] = similarity_score
+            results.append(feature_doc)
+    return results
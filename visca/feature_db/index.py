@@ -0,0 +1,295 @@
+from abc import ABC, abstractmethod
+from typing import Dict, Hashable, List, Tuple
+
+import numpy as np
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    Scales every row of ``matrix`` to unit length so that cosine similarity
+    becomes a plain dot product. Zero rows are kept as zeros.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms != 0)
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Returns the indices of the ``top_k`` highest scores, best first."""
+    if top_k <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.int64)
+    if top_k < scores.size:
+        candidates = np.argpartition(scores, -top_k)[-top_k:]
+        return candidates[np.argsort(scores[candidates])[::-1]]
+    return np.argsort(scores)[::-1]
+
+
+class VectorIndex(ABC):
+    """
+    Interface shared by the similarity indexes of the feature database.
+
+    Vectors are identified by a hashable key (the feature id). All indexes
+    compare unit-normalized vectors, so scores are cosine similarities.
+    """
+
+    def __init__(self, dim: int):
+        if dim <= 0:
+            raise ValueError("Embedding dimension must be positive.")
+        self.dim = dim
+
+
+    @abstractmethod
+    def add(self, key: Hashable, vector: np.ndarray) -> None:
+        ...
+
+
+    def add_many(self, keys: List[Hashable], vectors: np.ndarray) -> None:
+        """Inserts several vectors at once; ``vectors`` has one row per key."""
+        for key, vector in zip(keys, vectors):
+            self.add(key, vector)
+
+
+    @abstractmethod
+    def remove(self, key: Hashable) -> bool:
+        ...
+
+
+    @abstractmethod
+    def search(self, query: np.ndarray, top_k: int) -> List[Tuple[Hashable, float]]:
+        ...
+
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+
+    @abstractmethod
+    def __contains__(self, key: Hashable) -> bool:
+        ...
+
+
+class ExactIndex(VectorIndex):
+    """
+    Brute-force index backed by a single growable matrix.
+
+    Rows live in a preallocated buffer whose capacity doubles when full, so
+    insertions are amortized O(1) instead of rebuilding the matrix. Removal
+    moves the last row into the freed slot. A query is one BLAS matrix-vector
+    product followed by a partial sort.
+    """
+
+    def __init__(self, dim: int, initial_capacity: int = 64):
+        super().__init__(dim)
+        self._matrix = np.empty((max(initial_capacity, 1), dim), dtype=np.float32)
+        self._keys: List[Hashable] = []
+        self._positions: Dict[Hashable, int] = {}
+
+
+    def _ensure_capacity(self, size: int) -> None:
+        capacity = self._matrix.shape[0]
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        grown = np.empty((capacity, self.dim), dtype=np.float32)
+        grown[:len(self._keys)] = self._matrix[:len(self._keys)]
+        self._matrix = grown
+
+
+    def add(self, key: Hashable, vector: np.ndarray) -> None:
+        unit = normalize_rows(vector)[0]
+        if unit.shape[0] != self.dim:
+            raise ValueError(f"Expected a vector of dimension {self.dim}, got {unit.shape[0]}.")
+
+        if key in self._positions:
+            self._matrix[self._positions[key]] = unit
+            return
+
+        self._ensure_capacity(len(self._keys) + 1)
+        self._matrix[len(self._keys)] = unit
+        self._positions[key] = len(self._keys)
+        self._keys.append(key)
+
+
+    def add_many(self, keys: List[Hashable], vectors: np.ndarray) -> None:
+        if any(key in self._positions for key in keys) or len(set(keys)) != len(keys):
+            super().add_many(keys, vectors)
+            return
+
+        units = normalize_rows(vectors)
+        if units.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors of dimension {self.dim}, got {units.shape[1]}.")
+        start = len(self._keys)
+        self._ensure_capacity(start + len(keys))
+        self._matrix[start:start + len(keys)] = units
+        for offset, key in enumerate(keys):
+            self._positions[key] = start + offset
+        self._keys.extend(keys)
+
+
+    def remove(self, key: Hashable) -> bool:
+        position = self._positions.pop(key, None)
+        if position is None:
+            return False
+
+        last = len(self._keys) - 1
+        if position != last:
+            moved_key = self._keys[last]
+            self._matrix[position] = self._matrix[last]
+            self._keys[position] = moved_key
+            self._positions[moved_key] = position
+        self._keys.pop()
+        return True
+
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """View over the live (unit-normalized) rows of the index."""
+        return self._matrix[:len(self._keys)]
+
+
+    @property
+    def keys(self) -> List[Hashable]:
+        return list(self._keys)
+
+
+    def search(self, query: np.ndarray, top_k: int) -> List[Tuple[Hashable, float]]:
+        if not self._keys:
+            return []
+        unit_query = normalize_rows(query)[0]
+        scores = self.vectors @ unit_query
+        return [(self._keys[i], float(scores[i])) for i in top_k_indices(scores, top_k)]
+
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._positions
+
+
+class IVFIndex(VectorIndex):
+    """
+    Inverted-file index: vectors are bucketed under their closest k-means
+    centroid and a query only scans the ``nprobe`` closest buckets.
+
+    Until ``train_threshold`` vectors are inserted the index keeps a single
+    bucket, which makes it exact. The coarse quantizer is (re)trained when the
+    index has grown ``retrain_factor`` times since the last training, so the
+    bucket sizes stay around ``sqrt(n)`` and query latency stays flat as the
+    number of features grows.
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        nprobe: int = 4,
+        train_threshold: int = 1024,
+        retrain_factor: float = 4.0,
+        kmeans_iterations: int = 10,
+        seed: int = 0
+    ):
+        super().__init__(dim)
+        self.nprobe = nprobe
+        self.train_threshold = train_threshold
+        self.retrain_factor = retrain_factor
+        self.kmeans_iterations = kmeans_iterations
+        self._rng = np.random.default_rng(seed)
+
+        self._centroids = np.zeros((1, dim), dtype=np.float32)
+        self._lists: List[ExactIndex] = [ExactIndex(dim)]
+        self._assignment: Dict[Hashable, int] = {}
+        self._trained_size = 0
+
+
+    def _closest_lists(self, unit_vector: np.ndarray, count: int) -> np.ndarray:
+        if len(self._lists) == 1:
+            return np.zeros(1, dtype=np.int64)
+        return top_k_indices(self._centroids @ unit_vector, count)
+
+
+    def _train(self) -> None:
+        keys: List[Hashable] = []
+        vectors: List[np.ndarray] = []
+        for inverted_list in self._lists:
+            keys.extend(inverted_list.keys)
+            vectors.append(inverted_list.vectors)
+        data = np.concatenate(vectors, axis=0)
+
+        n_lists = max(1, int(np.sqrt(len(keys))))
+        centroids = data[self._rng.choice(len(keys), size=n_lists, replace=False)].copy()
+        for _ in range(self.kmeans_iterations):
+            assignment = np.argmax(data @ centroids.T, axis=1)
+            for c in range(n_lists):
+                members = data[assignment == c]
+                if len(members) > 0:
+                    centroids[c] = members.mean(axis=0)
+            centroids = normalize_rows(centroids)
+        assignment = np.argmax(data @ centroids.T, axis=1)
+
+        self._centroids = centroids
+        self._lists = [ExactIndex(self.dim) for _ in range(n_lists)]
+        self._assignment = {}
+        for key, vector, list_id in zip(keys, data, assignment):
+            self._lists[list_id].add(key, vector)
+            self._assignment[key] = int(list_id)
+        self._trained_size = len(keys)
+
+
+    def add(self, key: Hashable, vector: np.ndarray) -> None:
+        unit = normalize_rows(vector)[0]
+        if unit.shape[0] != self.dim:
+            raise ValueError(f"Expected a vector of dimension {self.dim}, got {unit.shape[0]}.")
+
+        self.remove(key)
+        list_id = int(self._closest_lists(unit, 1)[0])
+        self._lists[list_id].add(key, unit)
+        self._assignment[key] = list_id
+
+        size = len(self._assignment)
+        if size >= self.train_threshold and size >= self._trained_size * self.retrain_factor:
+            self._train()
+
+
+    def remove(self, key: Hashable) -> bool:
+        list_id = self._assignment.pop(key, None)
+        if list_id is None:
+            return False
+        return self._lists[list_id].remove(key)
+
+
+    def search(self, query: np.ndarray, top_k: int) -> List[Tuple[Hashable, float]]:
+        if not self._assignment:
+            return []
+        unit_query = normalize_rows(query)[0]
+
+        results: List[Tuple[Hashable, float]] = []
+        for list_id in self._closest_lists(unit_query, self.nprobe):
+            results.extend(self._lists[list_id].search(unit_query, top_k))
+        results.sort(key=lambda r: r[1], reverse=True)
+        return results[:top_k]
+
+
+    def __len__(self) -> int:
+        return len(self._assignment)
+
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._assignment
+
+
+INDEX_TYPES = {
+    'exact': ExactIndex,
+    'ivf': IVFIndex,
+}
+
+
+def create_index(index_type: str, dim: int, **kwargs) -> VectorIndex:
+    """Instantiates one of the registered index types (``exact`` or ``ivf``)."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}'. Expected one of {list(INDEX_TYPES)}.")
+    return INDEX_TYPES[index_type](dim, **kwargs)
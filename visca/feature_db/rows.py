@@ -0,0 +1,70 @@
+from typing import Optional
+
+import numpy as np
+
+
+class EmbeddingRows:
+    """
+    Append-only float32 row store for feature embeddings.
+
+    Rows ``[0, len(base))`` come from a read-only (usually memory-mapped)
+    ``base`` matrix, newer rows live in an in-memory tail buffer that doubles
+    its capacity when full. Rows are never modified in place: updating an
+    embedding appends a new row, which keeps the on-disk file append-only.
+    """
+
+    def __init__(self, dim: int, base: Optional[np.ndarray] = None, initial_capacity: int = 64):
+        if dim <= 0:
+            raise ValueError("Embedding dimension must be positive.")
+        if base is not None and (base.ndim != 2 or base.shape[1] != dim):
+            raise ValueError(f"Base matrix must have shape (n, {dim}), got {base.shape}.")
+        self.dim = dim
+        self._base = base if base is not None else np.empty((0, dim), dtype=np.float32)
+        self._tail = np.empty((initial_capacity, dim), dtype=np.float32)
+        self._tail_size = 0
+
+
+    def __len__(self) -> int:
+        return self._base.shape[0] + self._tail_size
+
+
+    def append(self, vector: np.ndarray) -> int:
+        """Appends one row and returns its row number."""
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dim:
+            raise ValueError(f"Expected a vector of dimension {self.dim}, got {vector.shape[0]}.")
+
+        if self._tail_size == self._tail.shape[0]:
+            grown = np.empty((self._tail.shape[0] * 2, self.dim), dtype=np.float32)
+            grown[:self._tail_size] = self._tail[:self._tail_size]
+            self._tail = grown
+
+        self._tail[self._tail_size] = vector
+        self._tail_size += 1
+        return len(self) - 1
+
+
+    def get(self, row: int) -> np.ndarray:
+        base_size = self._base.shape[0]
+        if row < base_size:
+            return np.asarray(self._base[row])
+        return self._tail[row - base_size]
+
+
+    def take(self, rows: np.ndarray) -> np.ndarray:
+        """Gathers several rows into a new ``(len(rows), dim)`` matrix."""
+        rows = np.asarray(rows, dtype=np.int64)
+        base_size = self._base.shape[0]
+        result = np.empty((rows.shape[0], self.dim), dtype=np.float32)
+        in_base = rows < base_size
+        result[in_base] = self._base[rows[in_base]]
+        result[~in_base] = self._tail[rows[~in_base] - base_size]
+        return result
+
+
+    def rows_from(self, start: int) -> np.ndarray:
+        """Returns rows ``[start, len(self))``; used to append only new rows to disk."""
+        base_size = self._base.shape[0]
+        if start >= base_size:
+            return self._tail[start - base_size:self._tail_size]
+        return np.concatenate([self._base[start:], self._tail[:self._tail_size]], axis=0)
@@ -0,0 +1,277 @@
+"""
+On-disk format for :class:`InMemoryWarningVectorDB`.
+
+A database directory contains::
+
+    manifest.json             dimension, committed row count and log lengths
+    embeddings.f32            raw little-endian float32 rows, append-only
+    features.jsonl            row-oriented log of feature puts/deletes
+    component_features.jsonl  log of component feature adds/updates/deletes
+
+Saving appends only the rows and log records created since the previous
+save, then rewrites the small manifest atomically. The manifest is the
+commit point: bytes past the committed lengths (from an interrupted save)
+are ignored on open. Opening memory-maps the embeddings file, so its cost
+does not depend on the number of stored vectors. Superseded rows and
+log records are dropped by :func:`compact_db`.
+"""
+import os
+import json
+import pickle
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+import numpy as np
+
+from .database import InMemoryWarningVectorDB
+from .rows import EmbeddingRows
+
+
+FORMAT_VERSION = 1
+
+MANIFEST_FILE = 'manifest.json'
+EMBEDDINGS_FILE = 'embeddings.f32'
+FEATURES_LOG_FILE = 'features.jsonl'
+COMPONENT_FEATURES_LOG_FILE = 'component_features.jsonl'
+
+_EMBEDDING_DTYPE = np.dtype('<f4')
+
+
+def _read_manifest(path: Path) -> Optional[Dict[str, Any]]:
+    manifest_path = path / MANIFEST_FILE
+    if not manifest_path.is_file():
+        return None
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported feature DB format {manifest.get('format_version')} in {path}; "
+            f"expected {FORMAT_VERSION}."
+        )
+    return manifest
+
+
+def _write_manifest(path: Path, manifest: Dict[str, Any]) -> None:
+    tmp_path = path / (MANIFEST_FILE + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    tmp_path.replace(path / MANIFEST_FILE)
+
+
+def _append_bytes(file_path: Path, committed_size: int, data: bytes) -> int:
+    """
+    Appends ``data`` right after the committed part of ``file_path`` (dropping
+    any uncommitted tail) and returns the new committed size.
+    """
+    with open(file_path, 'ab') as f:
+        if f.tell() != committed_size:
+            f.truncate(committed_size)
+            f.seek(committed_size)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return committed_size + len(data)
+
+
+def _encode_log(records) -> bytes:
+    return ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records).encode('utf-8')
+
+
+def _read_log(file_path: Path, committed_size: int):
+    if committed_size == 0:
+        return
+    with open(file_path, 'rb') as f:
+        data = f.read(committed_size)
+    for line in data.decode('utf-8').splitlines():
+        if line:
+            yield json.loads(line)
+
+
+def _is_attached(db: InMemoryWarningVectorDB, path: Path) -> bool:
+    return db._storage is not None and db._storage['path'].resolve() == path.resolve()
+
+
+def compact_db(db: InMemoryWarningVectorDB, path: Union[str, Path]) -> None:
+    """
+    Rewrites the database directory with only the live rows: one embedding
+    row and one ``put`` record per feature, and the current component
+    features. The new files are written next to the old ones and swapped
+    in, with the manifest replaced last.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+
+    feature_ids = list(db.features.keys())
+    if feature_ids:
+        old_rows = np.fromiter((db._feature_rows[_id] for _id in feature_ids), dtype=np.int64)
+        live_matrix = db._rows.take(old_rows)
+    else:
+        live_matrix = np.empty((0, max(db._embedding_dim, 0)), dtype=np.float32)
+
+    embeddings = np.ascontiguousarray(live_matrix, dtype=_EMBEDDING_DTYPE).tobytes()
+    features_log = _encode_log(
+        {"op": "put", "_id": _id, "row": row, "doc": db.features[_id]}
+        for row, _id in enumerate(feature_ids)
+    )
+    component_log = _encode_log({"op": "add", "doc": doc} for doc in db.component_features)
+
+    for file_name, data in [
+        (EMBEDDINGS_FILE, embeddings),
+        (FEATURES_LOG_FILE, features_log),
+        (COMPONENT_FEATURES_LOG_FILE, component_log),
+    ]:
+        tmp_path = path / (file_name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        tmp_path.replace(path / file_name)
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'dim': db._embedding_dim,
+        'rows': len(feature_ids),
+        'features_log_bytes': len(features_log),
+        'component_features_log_bytes': len(component_log),
+    }
+    _write_manifest(path, manifest)
+
+    # Re-point the DB at the compacted file: rows are renumbered densely
+    if db._embedding_dim > 0:
+        db._rows = EmbeddingRows(db._embedding_dim, base=_map_embeddings(path, manifest))
+    db._feature_rows = {_id: row for row, _id in enumerate(feature_ids)}
+    db._feature_log.clear()
+    db._component_log.clear()
+    db._storage = {'path': path, 'manifest': manifest}
+
+
+def save_db(
+    db: InMemoryWarningVectorDB,
+    path: Union[str, Path],
+    compact_ratio: float = 0.5,
+    min_rows_for_compaction: int = 1024
+) -> None:
+    """
+    Persists ``db`` under the directory ``path``.
+
+    If ``db`` was opened from (or last saved to) ``path`` only the new
+    embedding rows and log records are appended; otherwise the directory is
+    written from scratch. When more than ``compact_ratio`` of the stored rows
+    are garbage the directory is compacted afterwards.
+
+    Args:
+        db: The database to save.
+        path: The database directory.
+        compact_ratio: Fraction of dead rows that triggers a compaction.
+        min_rows_for_compaction: Small stores are never compacted automatically.
+    """
+    path = Path(path)
+    if not _is_attached(db, path) or _read_manifest(path) is None:
+        compact_db(db, path)
+        print(f"Database state saved successfully to {path}")
+        return
+
+    manifest = dict(db._storage['manifest'])
+    rows_on_disk = manifest['rows']
+
+    if db._rows is not None and len(db._rows) > rows_on_disk:
+        new_rows = np.ascontiguousarray(db._rows.rows_from(rows_on_disk), dtype=_EMBEDDING_DTYPE)
+        _append_bytes(path / EMBEDDINGS_FILE, rows_on_disk * db._embedding_dim * 4, new_rows.tobytes())
+        manifest['rows'] = len(db._rows)
+        manifest['dim'] = db._embedding_dim
+
+    manifest['features_log_bytes'] = _append_bytes(
+        path / FEATURES_LOG_FILE, manifest['features_log_bytes'], _encode_log(db._feature_log)
+    )
+    manifest['component_features_log_bytes'] = _append_bytes(
+        path / COMPONENT_FEATURES_LOG_FILE,
+        manifest['component_features_log_bytes'],
+        _encode_log(db._component_log)
+    )
+    _write_manifest(path, manifest)
+
+    db._feature_log.clear()
+    db._component_log.clear()
+    db._storage = {'path': path, 'manifest': manifest}
+
+    if manifest['rows'] >= min_rows_for_compaction and db.dead_rows > compact_ratio * manifest['rows']:
+        compact_db(db, path)
+    print(f"Database state saved successfully to {path}")
+
+
+def _map_embeddings(path: Path, manifest: Dict[str, Any]) -> np.ndarray:
+    if manifest['rows'] == 0:
+        return np.empty((0, manifest['dim']), dtype=np.float32)
+    return np.memmap(
+        path / EMBEDDINGS_FILE,
+        dtype=_EMBEDDING_DTYPE,
+        mode='r',
+        shape=(manifest['rows'], manifest['dim'])
+    )
+
+
+def load_db(
+    path: Union[str, Path],
+    index_type: str = 'exact',
+    index_options: Optional[Dict[str, Any]] = None
+) -> InMemoryWarningVectorDB:
+    """
+    Opens a database directory written by :func:`save_db`.
+
+    The embeddings file is memory-mapped rather than read; the metadata logs
+    are replayed to rebuild the feature and component feature documents.
+    """
+    path = Path(path)
+    manifest = _read_manifest(path)
+    if manifest is None:
+        raise FileNotFoundError(f"No feature database found at {path}")
+
+    db = InMemoryWarningVectorDB(index_type=index_type, index_options=index_options)
+    db._embedding_dim = manifest['dim']
+    if manifest['dim'] > 0:
+        db._rows = EmbeddingRows(manifest['dim'], base=_map_embeddings(path, manifest))
+
+    for record in _read_log(path / FEATURES_LOG_FILE, manifest['features_log_bytes']):
+        if record['op'] == 'put':
+            db.features[record['_id']] = record['doc']
+            db._feature_rows[record['_id']] = record['row']
+        elif record['op'] == 'del':
+            db.features.pop(record['_id'], None)
+            db._feature_rows.pop(record['_id'], None)
+
+    for record in _read_log(path / COMPONENT_FEATURES_LOG_FILE, manifest['component_features_log_bytes']):
+        if record['op'] == 'add':
+            db.component_features.append(record['doc'])
+        elif record['op'] == 'update':
+            db.update_component_features(record['filter'], record['updates'])
+        elif record['op'] == 'delete':
+            db.delete_component_features(record['filter'])
+    db._component_log.clear()
+
+    db._storage = {'path': path, 'manifest': manifest}
+    return db
+
+
+def import_pickle_db(
+    filepath: Union[str, Path],
+    index_type: str = 'exact',
+    index_options: Optional[Dict[str, Any]] = None
+) -> InMemoryWarningVectorDB:
+    """
+    Reads a database pickled by the older notebook ``save_db_to_file`` (such
+    as ``models/*.db``) so it can be re-saved with :func:`save_db`.
+
+    Warning:
+        The pickle module is not secure. Only use with trusted files.
+    """
+    with open(filepath, 'rb') as f:
+        loaded_data = pickle.load(f)
+
+    db = InMemoryWarningVectorDB(index_type=index_type, index_options=index_options)
+    for feature_doc in loaded_data.get("features", {}).values():
+        db.add_feature(dict(feature_doc))
+    for component_feature_doc in loaded_data.get("component_features", []):
+        db.add_component_feature(component_feature_doc)
+    return db
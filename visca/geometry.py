@@ -0,0 +1,197 @@
+"""
+Vectorized box geometry on element tables.
+
+Boxes are float arrays whose last axis is ``(x0, y0, x1, y1)``, built from
+the ``x``, ``y``, ``width`` and ``height`` of elements by
+:func:`boxes_from_elements`. The pairwise functions broadcast over the
+leading axes, so ``iou(a, b)`` compares box ``i`` of ``a`` with box ``i``
+of ``b`` and ``iou(a[:, None], b[None])`` is the full matrix.
+
+For thousands of boxes on each side, a :class:`BoxIndex` answers the same
+queries in batches without building the matrix: its boxes are sorted by
+left edge within classes of similar widths, and only those whose left edge
+falls in a query's sweep window are compared.
+"""
+from typing import Any, Dict, Iterator, List, Tuple, Union
+
+import numpy as np
+
+
+# Candidate pairs compared at once by a BoxIndex
+_PAIRS_PER_CHUNK = 1 << 22
+
+
+def boxes_from_elements(elements: List[Union[Dict[str, Any], Any]]) -> np.ndarray:
+    """
+    ``(n, 4)`` boxes of element dicts (or objects with the same attributes,
+    such as ``VirtualNodeData``); missing coordinates count as 0.
+    """
+    coordinates = np.array([
+        [
+            (e.get(k) if isinstance(e, dict) else getattr(e, k, None)) or 0
+            for k in ('x', 'y', 'width', 'height')
+        ]
+        for e in elements
+    ], dtype=np.float64).reshape(-1, 4)
+    coordinates[:, 2:] += coordinates[:, :2]
+    return coordinates
+
+
+def area(boxes: np.ndarray) -> np.ndarray:
+    return np.clip(boxes[..., 2] - boxes[..., 0], 0, None) * np.clip(boxes[..., 3] - boxes[..., 1], 0, None)
+
+
+def intersection_area(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    width = np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0])
+    height = np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1])
+    return np.clip(width, 0, None) * np.clip(height, 0, None)
+
+
+def iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Intersection over union (0 for two empty boxes)."""
+    intersection = intersection_area(a, b)
+    union = area(a) + area(b) - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def contains(outer: np.ndarray, inner: np.ndarray, tolerance: float = 0.0) -> np.ndarray:
+    """Whether ``inner`` lies within ``outer`` grown by ``tolerance`` px on every side."""
+    return (
+        (inner[..., 0] >= outer[..., 0] - tolerance) & (inner[..., 1] >= outer[..., 1] - tolerance) &
+        (inner[..., 2] <= outer[..., 2] + tolerance) & (inner[..., 3] <= outer[..., 3] + tolerance)
+    )
+
+
+def distance(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Euclidean gap between the boxes (0 if they touch or overlap)."""
+    dx = np.clip(np.maximum(a[..., 0], b[..., 0]) - np.minimum(a[..., 2], b[..., 2]), 0, None)
+    dy = np.clip(np.maximum(a[..., 1], b[..., 1]) - np.minimum(a[..., 3], b[..., 3]), 0, None)
+    return np.hypot(dx, dy)
+
+
+class BoxIndex:
+    """
+    Sorted-sweep index of boxes for batched overlap, containment and
+    nearest-box queries. Queries return indices into the indexed boxes.
+    """
+
+    def __init__(self, boxes: np.ndarray):
+        """
+        Args:
+            boxes: ``(n, 4)`` boxes, e.g. from :func:`boxes_from_elements`.
+        """
+        self.boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        # One sweep per width class (widths within a factor of two), so a few
+        # page-wide boxes do not widen the window of every query
+        widths = np.clip(self.boxes[:, 2] - self.boxes[:, 0], 0, None)
+        width_class = np.floor(np.log2(widths + 1)).astype(np.int64)
+        self._sweeps: List[Tuple[np.ndarray, np.ndarray, float]] = []
+        for c in np.unique(width_class):
+            members = np.flatnonzero(width_class == c)
+            order = members[np.argsort(self.boxes[members, 0], kind='stable')]
+            self._sweeps.append((order, self.boxes[order, 0], float(widths[members].max())))
+
+
+    @classmethod
+    def from_elements(cls, elements: List[Union[Dict[str, Any], Any]]) -> 'BoxIndex':
+        return cls(boxes_from_elements(elements))
+
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+
+    def _candidates(self, queries: np.ndarray, margin: float = 0.0) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        ``(query_ids, box_ids)`` chunks of the pairs whose horizontal extents
+        come within ``margin`` of each other: in every width class, the boxes
+        whose left edge lies between a query's left edge minus the class'
+        widest box and its right edge.
+        """
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, 4)
+        for order, left, max_width in self._sweeps:
+            starts = np.searchsorted(left, queries[:, 0] - max_width - margin, side='left')
+            ends = np.searchsorted(left, queries[:, 2] + margin, side='right')
+            counts = ends - starts
+
+            first = 0
+            while first < len(queries):
+                # As many queries as fit in a chunk, at least one
+                totals = np.cumsum(counts[first:])
+                last = first + max(1, int(np.searchsorted(totals, _PAIRS_PER_CHUNK, side='right')))
+                chunk = counts[first:last]
+                query_ids = np.repeat(np.arange(first, last), chunk)
+                offsets = np.arange(len(query_ids)) - np.repeat(np.cumsum(chunk) - chunk, chunk)
+                positions = np.repeat(starts[first:last], chunk) + offsets
+                yield query_ids, order[positions]
+                first = last
+
+
+    def overlaps(self, queries: np.ndarray, min_iou: float = 0.0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Pairs of a query box and an indexed box that overlap (with a positive
+        intersection and at least ``min_iou``).
+
+        Returns:
+            ``(query_ids, box_ids, ious)`` arrays.
+        """
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, 4)
+        found_queries, found_boxes, found_ious = [], [], []
+        for query_ids, box_ids in self._candidates(queries):
+            a, b = queries[query_ids], self.boxes[box_ids]
+            overlap = iou(a, b)
+            keep = (intersection_area(a, b) > 0) & (overlap >= min_iou)
+            found_queries.append(query_ids[keep])
+            found_boxes.append(box_ids[keep])
+            found_ious.append(overlap[keep])
+        if not found_queries:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+        return np.concatenate(found_queries), np.concatenate(found_boxes), np.concatenate(found_ious)
+
+
+    def containing(self, queries: np.ndarray, tolerance: float = 0.0) -> Tuple[np.ndarray, np.ndarray]:
+        """``(query_ids, box_ids)`` of the indexed boxes that contain a query box."""
+        return self._containment(queries, tolerance, query_inside=True)
+
+
+    def contained_in(self, queries: np.ndarray, tolerance: float = 0.0) -> Tuple[np.ndarray, np.ndarray]:
+        """``(query_ids, box_ids)`` of the indexed boxes that lie within a query box."""
+        return self._containment(queries, tolerance, query_inside=False)
+
+
+    def _containment(self, queries: np.ndarray, tolerance: float, query_inside: bool) -> Tuple[np.ndarray, np.ndarray]:
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, 4)
+        found_queries, found_boxes = [], []
+        for query_ids, box_ids in self._candidates(queries, margin=tolerance):
+            a, b = queries[query_ids], self.boxes[box_ids]
+            keep = contains(b, a, tolerance) if query_inside else contains(a, b, tolerance)
+            found_queries.append(query_ids[keep])
+            found_boxes.append(box_ids[keep])
+        if not found_queries:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(found_queries), np.concatenate(found_boxes)
+
+
+    def nearest(self, queries: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The ``k`` indexed boxes closest to every query box (by
+        :func:`distance`, ties broken by larger IoU).
+
+        Returns:
+            ``(box_ids, distances)``, both ``(len(queries), k)``, nearest first.
+        """
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, 4)
+        k = min(k, len(self.boxes))
+        box_ids = np.empty((len(queries), k), dtype=np.int64)
+        distances = np.empty((len(queries), k))
+        rows = max(1, _PAIRS_PER_CHUNK // max(1, len(self.boxes)))
+        for first in range(0, len(queries), rows):
+            chunk = queries[first:first + rows, None]
+            # Overlapping boxes are all at distance 0; rank them by how much they overlap
+            score = distance(chunk, self.boxes[None]) - iou(chunk, self.boxes[None])
+            best = np.argpartition(score, k - 1, axis=1)[:, :k] if k < len(self.boxes) else \
+                np.broadcast_to(np.arange(k), (len(chunk), k))
+            best = np.take_along_axis(best, np.argsort(np.take_along_axis(score, best, axis=1), axis=1), axis=1)
+            box_ids[first:first + rows] = best
+            distances[first:first + rows] = distance(chunk[:, 0, None], self.boxes[best])
+        return box_ids, distances
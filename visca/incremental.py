@@ -0,0 +1,221 @@
+from typing import Dict, List, Optional, Set
+
+from visca.dedup import deduplicate_screenshots
+from visca.element_extractor import ElementInfo
+from visca.virtual_node import (
+    VirtualNode,
+    LabelSource,
+    TreeDiff,
+    build_dom_tree,
+    diff_trees,
+    subtree_hashes,
+    iter_preorder,
+)
+
+
+class ProcessedState:
+    """
+    An app state that went through the whole pipeline, kept as the base of
+    incremental runs of the states that follow it.
+
+    Attributes:
+        state_id: The id of the state in the crawl model.
+        raw_tree: Tree of every extracted element (with the screenshot paths
+            of the crop step), before deduplication.
+        tree: The deduplicated, classified and transformed tree.
+    """
+
+    def __init__(self, state_id: str, elements: List[ElementInfo], tree: VirtualNode):
+        """
+        Args:
+            state_id: The id of the state in the crawl model.
+            elements: The extracted elements after the crop step, i.e. the
+                output of ``save_elements``.
+            tree: The processed tree of the state.
+        """
+        self.state_id = state_id
+        self.raw_tree = build_dom_tree(list(elements))
+        self.raw_hashes = subtree_hashes(self.raw_tree)
+        self.tree = tree
+        self._nodes_by_xpath: Optional[Dict[str, VirtualNode]] = None
+
+
+    def node_at(self, xpath: str) -> Optional[VirtualNode]:
+        """Returns the node of the processed tree with ``xpath``, if it survived deduplication."""
+        if self._nodes_by_xpath is None:
+            self._nodes_by_xpath = {node.data.xpath: node for node in iter_preorder(self.tree)}
+        return self._nodes_by_xpath.get(xpath)
+
+
+class IncrementalPlan:
+    """
+    What to reuse from a processed base state and what to process again for
+    a new state, derived from the diff of their raw trees.
+
+    Attributes:
+        base: The processed state the new one is compared against.
+        diff: Diff of ``base.raw_tree`` (left) and the new raw tree (right).
+        reused: New XPath -> base XPath of every element inside an identical
+            subtree. Their screenshots, dedup decisions and labels carry over.
+        changed: XPaths of the new elements in updated or added subtrees,
+            which go through crop, dedup and the LLM stages.
+    """
+
+    def __init__(self, base: ProcessedState, raw_tree: VirtualNode, diff: TreeDiff):
+        self.base = base
+        self.raw_tree = raw_tree
+        self.diff = diff
+
+        self.reused: Dict[str, str] = {}
+        for left, right in diff.iter_same_pairs():
+            self.reused[right.data.xpath] = left.data.xpath
+
+        self.changed: Set[str] = {right.data.xpath for _, right in diff.updated}
+        for added in diff.added:
+            self.changed.update(node.data.xpath for node in iter_preorder(added))
+        # The artificial roots are always paired
+        self.reused.pop('', None)
+        self.changed.discard('')
+
+        self._raw_nodes = {node.data.xpath: node for node in iter_preorder(raw_tree)}
+        self._base_raw_nodes = {node.data.xpath: node for node in iter_preorder(base.raw_tree)}
+
+
+    @property
+    def changed_fraction(self) -> float:
+        return len(self.changed) / max(len(self.changed) + len(self.reused), 1)
+
+
+    def elements_to_crop(self, elements: List[ElementInfo]) -> List[ElementInfo]:
+        """Elements whose screenshots have to be taken from the new page."""
+        return [e for e in elements if e['xpath'] not in self.reused]
+
+
+    def carry_over_screenshots(self, elements: List[ElementInfo]) -> List[ElementInfo]:
+        """
+        Points every reused element to the screenshot of its base element.
+        Reused elements that had no screenshot in the base state get none.
+        """
+        for element in elements:
+            base_xpath = self.reused.get(element['xpath'])
+            if base_xpath is None:
+                continue
+            base_node = self._base_raw_nodes.get(base_xpath)
+            if base_node is not None and base_node.data.screenshot:
+                element['screenshot'] = base_node.data.screenshot
+        return elements
+
+
+    def deduplicate(self, elements: List[ElementInfo], allowed_deviation=0.075) -> List[ElementInfo]:
+        """
+        Incremental ``deduplicate_screenshots``. Reused elements keep their
+        base decision (kept if they are in the base's processed tree). Only
+        the changed elements are compared, together with the reused elements
+        right under a changed one, since an updated parent with an unchanged
+        only child is still a padding-duplicate candidate. Hash duplicates
+        between a changed element and a distant reused one are not detected.
+
+        Args:
+            elements: Elements with a screenshot, in the order of the page.
+            allowed_deviation: See ``deduplicate_screenshots``.
+
+        Returns:
+            The kept elements, in their original order.
+        """
+        def under_changed(xpath: str) -> bool:
+            node = self._raw_nodes.get(xpath)
+            return node is not None and node.parent is not None and node.parent.data.xpath in self.changed
+
+        compared = [
+            e for e in elements
+            if e['xpath'] in self.changed or (e['xpath'] in self.reused and under_changed(e['xpath']))
+        ]
+        compared_xpaths = {e['xpath'] for e in compared}
+        kept_xpaths = {e['xpath'] for e in deduplicate_screenshots(compared, allowed_deviation)} if compared else set()
+
+        kept: List[ElementInfo] = []
+        for element in elements:
+            xpath = element['xpath']
+            if xpath in compared_xpaths:
+                if xpath in kept_xpaths:
+                    kept.append(element)
+            elif xpath in self.reused:
+                if self.base.node_at(self.reused[xpath]) is not None:
+                    kept.append(element)
+            else:
+                kept.append(element)
+        return kept
+
+
+    def carry_over_components(self, tree: VirtualNode) -> int:
+        """
+        Copies the component info (type, title, context and code) of the base
+        state to every reused node of ``tree``, marked with
+        ``LabelSource.CARRIED`` so the classification and generation stages
+        skip them.
+
+        Returns:
+            The number of nodes that were labeled.
+        """
+        count = 0
+        for node in iter_preorder(tree):
+            base_xpath = self.reused.get(node.data.xpath)
+            if base_xpath is None:
+                continue
+            base_node = self.base.node_at(base_xpath)
+            if base_node is None or base_node.component_info is None \
+                or base_node.component_info.component_type is None:
+                continue
+            info = base_node.component_info
+            node.add_component_info(
+                component_title=info.component_title or '',
+                component_context=info.component_context or '',
+                component_type=info.component_type,
+                component_code=info.component_code,
+                previously_seen=info.previously_seen or self.base.state_id,
+                label_source=LabelSource.CARRIED
+            )
+            count += 1
+        return count
+
+
+def plan_incremental(
+    elements: List[ElementInfo],
+    states: List[ProcessedState],
+    max_changed_fraction: float = 0.5
+) -> Optional[IncrementalPlan]:
+    """
+    Diffs the raw tree of a new state against every processed state and
+    plans an incremental run against the closest one, the one with the
+    fewest elements to process again.
+
+    Args:
+        elements: The elements extracted from the new state, before cropping.
+        states: The already processed states.
+        max_changed_fraction: Above this fraction of changed elements the
+            states are too different and None is returned.
+
+    Returns:
+        The plan, or None if the new state should be processed from scratch.
+    """
+    if not states:
+        return None
+
+    raw_tree = build_dom_tree(list(elements))
+    raw_hashes = subtree_hashes(raw_tree)
+
+    best_state, best_diff, best_count = None, None, 0
+    for state in states:
+        diff = diff_trees(state.raw_tree, raw_tree, state.raw_hashes, raw_hashes)
+        count = len(diff.updated) + sum(1 for added in diff.added for _ in iter_preorder(added))
+        if best_diff is None or count < best_count:
+            best_state, best_diff, best_count = state, diff, count
+        if best_diff.is_unchanged:
+            break
+
+    best = IncrementalPlan(best_state, raw_tree, best_diff)
+    print(f"▶ Closest processed state: {best.base.state_id} "
+          f"({len(best.changed)} changed, {len(best.reused)} reused elements)")
+    if best.changed_fraction > max_changed_fraction:
+        return None
+    return best
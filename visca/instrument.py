@@ -0,0 +1,292 @@
+"""
+Lightweight tracing of where the pipeline's time goes.
+
+Stages and model calls are wrapped in spans::
+
+    from visca.instrument import span
+
+    with span('dedup', state_id=state_id) as s:
+        ...
+        s.set(duplicates=len(duplicates))
+
+Every finished span records its wall time, the CPU time of the thread that
+ran it, the process' peak RSS so far, the bytes the process wrote meanwhile
+(Linux only; concurrent spans count each other's writes) and any
+attributes set on it, such as token counts. Spans nest: a span opened
+inside another (in the same thread or asyncio task, or in a function run
+with :func:`contextvars.copy_context`) records it as its parent.
+
+Until a :class:`Tracer` is installed nothing is recorded, and ``span``
+costs one function call::
+
+    with Tracer('results/trace.jsonl', chrome_path='results/trace.json'):
+        pipeline.run()
+
+The JSONL trace has one finished span per line; the Chrome trace-event file
+can be opened in chrome://tracing or https://ui.perfetto.dev.
+"""
+import os
+import sys
+import json
+import time
+import itertools
+import threading
+import functools
+import contextvars
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def max_rss_bytes() -> Optional[int]:
+    """Peak resident set size of the process so far, or None where unknown."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def bytes_written() -> Optional[int]:
+    """Bytes the process has written so far (``wchar`` of /proc/self/io), or None where unknown."""
+    try:
+        with open('/proc/self/io', 'rb') as f:
+            for line in f:
+                if line.startswith(b'wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class Span:
+    """A running span; :meth:`set` adds attributes to its record."""
+
+    __slots__ = ('tracer', 'name', 'span_id', 'parent_id', 'attributes',
+                 '_token', '_start', '_wall', '_cpu', '_written')
+
+    def __init__(self, tracer: 'Tracer', name: str, attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.span_id = next(tracer._ids)
+        self.parent_id = _current_span.get()
+
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+
+    def add(self, **counts: float) -> None:
+        """Adds to numeric attributes, e.g. ``s.add(prompt_tokens=n)``."""
+        for key, value in counts.items():
+            self.attributes[key] = self.attributes.get(key, 0) + value
+
+
+    def __enter__(self) -> 'Span':
+        self._token = _current_span.set(self.span_id)
+        self._written = bytes_written()
+        self._start = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = time.perf_counter() - self._wall
+        cpu = time.thread_time() - self._cpu
+        written = bytes_written()
+        _current_span.reset(self._token)
+
+        record = {
+            'name': self.name,
+            'id': self.span_id,
+            'parent': self.parent_id,
+            'pid': os.getpid(),
+            'thread': threading.current_thread().name,
+            'start': self._start,
+            'wall_seconds': wall,
+            'cpu_seconds': cpu,
+            'max_rss_bytes': max_rss_bytes(),
+            'bytes_written': written - self._written if written is not None and self._written is not None else None,
+            'error': exc_type.__name__ if exc_type is not None else None,
+            'attributes': self.attributes,
+        }
+        self.tracer._finish(record)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+    def add(self, **counts: float) -> None:
+        pass
+
+    def __enter__(self) -> '_NoopSpan':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+# Id of the innermost open span of the current thread / asyncio task
+_current_span: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar('visca_span', default=None)
+
+_tracer: Optional['Tracer'] = None
+
+
+class Tracer:
+    """
+    Collects finished spans, appends them to a JSONL file as they finish
+    and, on :meth:`close`, writes a Chrome trace-event file. Installed as
+    the global tracer while used as a context manager (or after
+    :meth:`install`). Safe to use from several threads.
+    """
+
+    def __init__(
+        self,
+        path: Optional[Union[str, Path]] = None,
+        chrome_path: Optional[Union[str, Path]] = None
+    ):
+        """
+        Args:
+            path: JSONL trace, appended to.
+            chrome_path: Chrome trace-event JSON, written on :meth:`close`.
+        """
+        self.path = Path(path) if path is not None else None
+        self.chrome_path = Path(chrome_path) if chrome_path is not None else None
+        self.records: List[Dict[str, Any]] = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._file = None
+        self._previous: Optional['Tracer'] = None
+        # Worker processes forked while it is installed inherit it; they record nothing
+        self._pid = os.getpid()
+
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+
+    def span(self, name: str, **attributes: Any) -> Span:
+        return Span(self, name, attributes)
+
+
+    def _finish(self, record: Dict[str, Any]) -> None:
+        with self._lock:
+            self.records.append(record)
+            if self._file is not None:
+                self._file.write(json.dumps(record, default=str) + '\n')
+                self._file.flush()
+
+
+    def install(self) -> 'Tracer':
+        global _tracer
+        self._previous, _tracer = _tracer, self
+        return self
+
+
+    def close(self) -> None:
+        """Uninstalls the tracer, closes the JSONL trace and writes the Chrome trace."""
+        global _tracer
+        if _tracer is self:
+            _tracer = self._previous
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.chrome_path is not None:
+            self.write_chrome_trace(self.chrome_path)
+
+
+    def __enter__(self) -> 'Tracer':
+        return self.install()
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def write_chrome_trace(self, path: Union[str, Path]) -> None:
+        """Writes the spans as complete ("X") events of the Chrome trace-event format."""
+        with self._lock:
+            records = list(self.records)
+
+        thread_ids: Dict[str, int] = {}
+        events = []
+        for record in records:
+            tid = thread_ids.setdefault(record['thread'], len(thread_ids) + 1)
+            args = {k: v for k, v in record.items() if k not in ('name', 'pid', 'thread', 'start', 'attributes')}
+            args.update(record['attributes'])
+            events.append({
+                'name': record['name'],
+                'ph': 'X',
+                'ts': record['start'] * 1e6,
+                'dur': record['wall_seconds'] * 1e6,
+                'pid': record['pid'],
+                'tid': tid,
+                'args': args,
+            })
+        for thread, tid in thread_ids.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': thread}})
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, default=str)
+
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Count, wall and CPU seconds and tokens of the spans, per name."""
+        totals: Dict[str, Dict[str, float]] = {}
+        with self._lock:
+            for record in self.records:
+                total = totals.setdefault(record['name'], {'count': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'tokens': 0})
+                total['count'] += 1
+                total['wall_seconds'] += record['wall_seconds']
+                total['cpu_seconds'] += record['cpu_seconds']
+                total['tokens'] += record['attributes'].get('total_tokens', 0) or 0
+        return totals
+
+
+    def print_summary(self) -> None:
+        print(f"{'span':<24}{'count':>8}{'wall s':>10}{'cpu s':>10}{'tokens':>10}")
+        for name, total in sorted(self.summary().items(), key=lambda item: -item[1]['wall_seconds']):
+            print(f"{name:<24}{total['count']:>8}{total['wall_seconds']:>10.2f}"
+                  f"{total['cpu_seconds']:>10.2f}{total['tokens']:>10.0f}")
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+def span(name: str, **attributes: Any) -> Union[Span, _NoopSpan]:
+    """A span of the installed tracer, or a shared no-op span if there is none."""
+    tracer = _tracer
+    if tracer is None or tracer._pid != os.getpid():
+        return _NOOP_SPAN
+    return Span(tracer, name, attributes)
+
+
+def traced(name: Optional[str] = None) -> Callable[[Callable], Callable]:
+    """Decorator running every call of a function in a span (named after the function by default)."""
+    def decorator(fn: Callable) -> Callable:
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return fn(*args, **kwargs)
+            with span(span_name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+    return decorator
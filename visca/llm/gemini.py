@@ -1,8 +1,12 @@
 import os
+import time
 
 from google import genai
 from google.genai import types
 
+from visca.instrument import span
+from visca.llm.usage import record_call
+
 
 def create_model(
     system_prompt,
@@ -40,14 +44,15 @@ def create_model(
             "total_tokens": 0,
     }
 
-    def invoke(file=None, prompt=''):
+    def _invoke(file=None, prompt=''):
         parts = []
 
         
         if file is not None:
-            files = [
-                client.files.upload(file=file),
-            ]
+            with span('llm.upload'):
+                files = [
+                    client.files.upload(file=file),
+                ]
             parts.append(
                 types.Part.from_uri(
                     file_uri=files[0].uri,
@@ -100,6 +105,24 @@ def create_model(
 
         return response
 
+    def invoke(file=None, prompt=''):
+        with span('llm', model=model, file=file is not None) as llm_span:
+            start = time.perf_counter()
+            try:
+                response = _invoke(file, prompt)
+            except Exception as e:
+                record_call(model, None, time.perf_counter() - start, error=type(e).__name__)
+                raise
+            usage = getattr(response, "usage_metadata", None)
+            record_call(model, usage, time.perf_counter() - start)
+            if usage is not None:
+                llm_span.set(
+                    prompt_tokens=usage.prompt_token_count or 0,
+                    response_tokens=usage.candidates_token_count or 0,
+                    total_tokens=usage.total_token_count or 0
+                )
+            return response
+
     invoke.stats = _stats
     return invoke
 
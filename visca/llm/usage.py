@@ -0,0 +1,331 @@
+"""
+Ledger of the model usage of the pipeline, per app, state and node.
+
+Every model call (and every answer served from the component memory
+instead) is a row of a SQLite database::
+
+    with UsageLedger('results/usage.db', app='TASKCAFE'):
+        with usage_context(state_id=state_id):
+            ...            # calls made here are attributed to the state
+
+The pipeline sets the state, node XPath and purpose of its calls with
+:func:`usage_context`; ``create_model`` records into the installed ledger.
+Rows outlive the process, so the aggregation queries (e.g.
+:meth:`UsageLedger.top_components`) cover every run of an app.
+"""
+import os
+import time
+import sqlite3
+import threading
+import contextlib
+import contextvars
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+
+# USD per million (input, output) tokens; cached input tokens are billed at a quarter of the input price,
+# thinking tokens at the output price
+DEFAULT_PRICES: Dict[str, Tuple[float, float]] = {
+    'gemini-2.5-flash-preview-04-17': (0.15, 0.60),
+    'gemini-2.5-pro-exp-03-25': (1.25, 10.0),
+}
+
+CACHED_INPUT_DISCOUNT = 0.25
+
+# Purposes whose calls are looked up in the component memory first
+MEMORY_PURPOSES = ('classify', 'generate')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS calls (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    app TEXT,
+    state_id TEXT,
+    xpath TEXT,
+    purpose TEXT,
+    model TEXT,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    response_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    thoughts_tokens INTEGER NOT NULL DEFAULT 0,
+    total_tokens INTEGER NOT NULL DEFAULT 0,
+    latency_seconds REAL NOT NULL DEFAULT 0,
+    cost REAL NOT NULL DEFAULT 0,
+    memory_hit INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS calls_app_state ON calls (app, state_id);
+CREATE INDEX IF NOT EXISTS calls_app_xpath ON calls (app, xpath);
+"""
+
+# Attribution of the calls made in the current thread / asyncio task
+_context: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar('visca_usage_context', default={})
+
+_ledger: Optional['UsageLedger'] = None
+
+
+@contextlib.contextmanager
+def usage_context(**attribution: Any) -> Iterator[None]:
+    """
+    Attributes the model calls made inside the block to ``app``,
+    ``state_id``, ``xpath`` and/or ``purpose``; nested blocks add to
+    (or override) the outer ones.
+    """
+    token = _context.set({**_context.get(), **attribution})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class UsageLedger:
+    """
+    SQLite ledger of model calls, with aggregation queries. Installed as
+    the global ledger while used as a context manager (or after
+    :meth:`install`). Safe to use from several threads.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path] = ':memory:',
+        app: Optional[str] = None,
+        prices: Optional[Dict[str, Tuple[float, float]]] = None
+    ):
+        """
+        Args:
+            path: The database file, created if needed.
+            app: App of the calls made outside an ``app`` usage context.
+            prices: USD per million input and output tokens, per model;
+                defaults to :data:`DEFAULT_PRICES`.
+        """
+        if str(path) != ':memory:':
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.app = app
+        self.prices = prices if prices is not None else DEFAULT_PRICES
+        self._lock = threading.Lock()
+        self._previous: Optional['UsageLedger'] = None
+        # Worker processes forked while it is installed inherit it; they record nothing
+        self._pid = os.getpid()
+
+        self._connection = sqlite3.connect(str(path), check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        if str(path) != ':memory:':
+            self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.executescript(_SCHEMA)
+        # Ledgers created before thinking tokens were recorded
+        columns = {row['name'] for row in self._connection.execute('PRAGMA table_info(calls)')}
+        if 'thoughts_tokens' not in columns:
+            self._connection.execute('ALTER TABLE calls ADD COLUMN thoughts_tokens INTEGER NOT NULL DEFAULT 0')
+            self._connection.commit()
+
+
+    def cost(
+        self,
+        model: Optional[str],
+        prompt_tokens: int,
+        response_tokens: int,
+        cached_tokens: int = 0,
+        thoughts_tokens: int = 0
+    ) -> float:
+        input_price, output_price = self.prices.get(model, (0.0, 0.0))
+        billed_input = prompt_tokens - cached_tokens + cached_tokens * CACHED_INPUT_DISCOUNT
+        return (billed_input * input_price + (response_tokens + thoughts_tokens) * output_price) / 1e6
+
+
+    def record(
+        self,
+        model: Optional[str] = None,
+        prompt_tokens: int = 0,
+        response_tokens: int = 0,
+        cached_tokens: int = 0,
+        thoughts_tokens: int = 0,
+        total_tokens: Optional[int] = None,
+        latency_seconds: float = 0.0,
+        memory_hit: bool = False,
+        error: Optional[str] = None,
+        **attribution: Any
+    ) -> None:
+        """
+        Records one call, attributed to the current :func:`usage_context`
+        (``attribution`` overrides it).
+        """
+        context = {'app': self.app, **_context.get(), **attribution}
+        row = (
+            time.time(),
+            context.get('app'),
+            context.get('state_id'),
+            context.get('xpath'),
+            context.get('purpose'),
+            model,
+            prompt_tokens,
+            response_tokens,
+            cached_tokens,
+            thoughts_tokens,
+            total_tokens if total_tokens is not None else prompt_tokens + response_tokens + thoughts_tokens,
+            latency_seconds,
+            self.cost(model, prompt_tokens, response_tokens, cached_tokens, thoughts_tokens),
+            int(memory_hit),
+            error,
+        )
+        with self._lock:
+            self._connection.execute(
+                'INSERT INTO calls (time, app, state_id, xpath, purpose, model, prompt_tokens, response_tokens, '
+                'cached_tokens, thoughts_tokens, total_tokens, latency_seconds, cost, memory_hit, error) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                row
+            )
+            self._connection.commit()
+
+
+    def query(self, sql: str, parameters: Tuple = ()) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(row) for row in self._connection.execute(sql, parameters)]
+
+
+    def _where(self, app: Optional[str], purpose: Optional[str] = None) -> Tuple[str, Tuple]:
+        clauses, parameters = [], []
+        if app is not None:
+            clauses.append('app = ?')
+            parameters.append(app)
+        if purpose is not None:
+            clauses.append('purpose = ?')
+            parameters.append(purpose)
+        return ('WHERE ' + ' AND '.join(clauses)) if clauses else '', tuple(parameters)
+
+
+    def top_components(self, limit: int = 10, app: Optional[str] = None) -> List[Dict[str, Any]]:
+        """The nodes (by app and XPath, over all states) that cost the most."""
+        where, parameters = self._where(app)
+        return self.query(
+            f"""SELECT app, xpath, COUNT(*) - SUM(memory_hit) AS calls, SUM(memory_hit) AS memory_hits,
+                       COUNT(DISTINCT state_id) AS states, SUM(total_tokens) AS tokens,
+                       SUM(latency_seconds) AS latency_seconds, SUM(cost) AS cost
+                FROM calls {where} {'AND' if where else 'WHERE'} xpath IS NOT NULL
+                GROUP BY app, xpath ORDER BY cost DESC, tokens DESC LIMIT ?""",
+            parameters + (limit,)
+        )
+
+
+    def cost_per_state(self, app: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Calls, tokens, latency and cost of every state, most expensive first."""
+        where, parameters = self._where(app)
+        return self.query(
+            f"""SELECT app, state_id, COUNT(*) - SUM(memory_hit) AS calls, SUM(memory_hit) AS memory_hits,
+                       SUM(prompt_tokens) AS prompt_tokens, SUM(response_tokens) AS response_tokens,
+                       SUM(cached_tokens) AS cached_tokens, SUM(thoughts_tokens) AS thoughts_tokens,
+                       SUM(latency_seconds) AS latency_seconds,
+                       SUM(cost) AS cost
+                FROM calls {where} GROUP BY app, state_id ORDER BY cost DESC""",
+            parameters
+        )
+
+
+    def cost_per_purpose(self, app: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Calls, tokens, latency and cost per purpose (context, classify, generate, ...)."""
+        where, parameters = self._where(app)
+        return self.query(
+            f"""SELECT purpose, COUNT(*) - SUM(memory_hit) AS calls, SUM(total_tokens) AS tokens,
+                       AVG(CASE WHEN memory_hit = 0 THEN latency_seconds END) AS mean_latency_seconds,
+                       SUM(cost) AS cost
+                FROM calls {where} GROUP BY purpose ORDER BY cost DESC""",
+            parameters
+        )
+
+
+    def cache_hit_rate(self, app: Optional[str] = None, purpose: Optional[str] = None) -> Optional[float]:
+        """
+        Share of the lookups answered by the component memory, or None
+        without lookups. Lookups are the calls of ``purpose`` or, without
+        one, of all :data:`MEMORY_PURPOSES` (other calls never go through
+        the memory).
+        """
+        where, parameters = self._where(app, purpose)
+        if purpose is None:
+            where += (' AND ' if where else 'WHERE ') + f"purpose IN ({', '.join('?' * len(MEMORY_PURPOSES))})"
+            parameters += MEMORY_PURPOSES
+        row = self.query(f"SELECT COUNT(*) AS lookups, SUM(memory_hit) AS hits FROM calls {where}", parameters)[0]
+        return row['hits'] / row['lookups'] if row['lookups'] else None
+
+
+    def print_dashboard(self, app: Optional[str] = None, limit: int = 10) -> None:
+        totals = self.query(
+            "SELECT COUNT(*) - SUM(memory_hit) AS calls, SUM(total_tokens) AS tokens, "
+            "SUM(latency_seconds) AS latency, SUM(cost) AS cost FROM calls " + self._where(app)[0],
+            self._where(app)[1]
+        )[0]
+        hit_rate = self.cache_hit_rate(app)
+        print(f"▶ {totals['calls'] or 0} model calls, {totals['tokens'] or 0} tokens, "
+              f"{totals['latency'] or 0:.1f}s, ${totals['cost'] or 0:.4f}, memory hit rate "
+              + (f"{hit_rate:.0%}" if hit_rate is not None else "n/a"))
+
+        print(f"\n{'purpose':<12}{'calls':>8}{'tokens':>12}{'mean s':>9}{'cost $':>10}")
+        for row in self.cost_per_purpose(app):
+            print(f"{str(row['purpose']):<12}{row['calls']:>8}{row['tokens']:>12}"
+                  f"{row['mean_latency_seconds'] or 0:>9.2f}{row['cost']:>10.4f}")
+
+        print(f"\n{'state':<40}{'calls':>8}{'hits':>6}{'seconds':>9}{'cost $':>10}")
+        for row in self.cost_per_state(app)[:limit]:
+            print(f"{str(row['state_id'])[:39]:<40}{row['calls']:>8}{row['memory_hits']:>6}"
+                  f"{row['latency_seconds']:>9.1f}{row['cost']:>10.4f}")
+
+        print(f"\n{'component':<60}{'calls':>7}{'states':>8}{'tokens':>10}{'cost $':>10}")
+        for row in self.top_components(limit, app):
+            print(f"{row['xpath'][-59:]:<60}{row['calls']:>7}{row['states']:>8}{row['tokens']:>10}{row['cost']:>10.4f}")
+
+
+    def install(self) -> 'UsageLedger':
+        global _ledger
+        self._previous, _ledger = _ledger, self
+        return self
+
+
+    def close(self) -> None:
+        global _ledger
+        if _ledger is self:
+            _ledger = self._previous
+        with self._lock:
+            self._connection.close()
+
+
+    def __enter__(self) -> 'UsageLedger':
+        return self.install()
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def get_ledger() -> Optional[UsageLedger]:
+    """The installed ledger, or None if there is none (or in a forked worker process)."""
+    ledger = _ledger
+    if ledger is None or ledger._pid != os.getpid():
+        return None
+    return ledger
+
+
+def record_call(model: Optional[str], usage: Any, latency_seconds: float, error: Optional[str] = None) -> None:
+    """
+    Records a model call into the installed ledger, if any. ``usage`` is the
+    response's ``usage_metadata`` (or None).
+    """
+    ledger = get_ledger()
+    if ledger is None:
+        return
+    ledger.record(
+        model=model,
+        prompt_tokens=getattr(usage, 'prompt_token_count', None) or 0,
+        response_tokens=getattr(usage, 'candidates_token_count', None) or 0,
+        cached_tokens=getattr(usage, 'cached_content_token_count', None) or 0,
+        thoughts_tokens=getattr(usage, 'thoughts_token_count', None) or 0,
+        total_tokens=getattr(usage, 'total_token_count', None),
+        latency_seconds=latency_seconds,
+        error=error
+    )
+
+
+def record_memory_hit(**attribution: Any) -> None:
+    """Records an answer served from the component memory instead of the model, if a ledger is installed."""
+    ledger = get_ledger()
+    if ledger is not None:
+        ledger.record(memory_hit=True, **attribution)
@@ -1,6 +1,9 @@
 import re
+import html
+import time
 import hashlib
-from typing import List, Dict, Set
+from collections import deque
+from typing import List, Dict, Optional, Set, Tuple, TypedDict
 import json
 from pathlib import Path
 
@@ -9,9 +12,15 @@ from PIL import Image
 
 from visca.virtual_node import (
     VirtualNode,
-    ComponentType
+    ComponentType,
+    LabelSource,
+    iter_preorder
 )
 from visca.html_processing import clean_html
+from visca.segment.fingerprint import RepeatedGroup, find_repeated_children, find_lists
+from visca.preclassify import Preclassifier, node_title
+from visca.instrument import traced
+from visca.llm.usage import usage_context, record_memory_hit
 
 
 def hash_string(string: str) -> str:
@@ -54,6 +63,13 @@ def _get_ancestor_context(node: VirtualNode):
 
     return list(reversed(contexts))
 
+
+def _is_carried_over(node: VirtualNode) -> bool:
+    """True if the node's labels were copied from an already processed state."""
+    info = node.component_info
+    return info is not None and info.label_source == LabelSource.CARRIED
+
+
 def collect_parent_nodes(
     root: "VirtualNode",
     targets: Set[str],
@@ -71,9 +87,11 @@ def collect_parent_nodes(
         xp = node.data.xpath
         if xp in targets:                 # parent segment hit!
             found[xp] = node
-            found[xp].add_component_info(
-                component_type=ComponentType.CONTAINER
-            )
+            # Carried-over labels are kept as they are
+            if not _is_carried_over(node):
+                found[xp].add_component_info(
+                    component_type=ComponentType.CONTAINER
+                )
             targets.remove(xp)
         # else:
         #     stack.extend(node.children)   
@@ -82,18 +100,43 @@ def collect_parent_nodes(
     print(f"Nodes Traversed: {counter}")
 
 
+@traced('classify')
 def classify_and_describe_candidates(
     root: VirtualNode,
     classification_model,
     page_context,
     memory: dict,
     segment_json_path: str | Path,
+    lists: Optional[Dict[str, RepeatedGroup]] = None,
+    preclassifier: Optional[Preclassifier] = None,
 ):
+    """
+    Classifies the segments of ``segment_json_path`` and, breadth-first,
+    the children of the containers, with the model or from ``memory``.
+
+    Args:
+        root: The (deduplicated) tree of the state.
+        classification_model: Model with the classification prompt.
+        page_context: Description of the page.
+        memory: Labels and code of components seen before, by screenshot hash.
+        segment_json_path: The state's ``segmentation_xpath_aa.json``.
+        lists: Nodes that are obviously lists (see :func:`find_lists`), by
+            XPath; they are labeled as such without the model.
+        preclassifier: Labels the nodes it is confident about without the
+            model (see :mod:`visca.preclassify`); None asks the model for all.
+
+    Returns:
+        The classified tree and the run log.
+    """
+    if lists is None:
+        lists = {}
+
     #  Logging
     run_log: dict = {
         "meta": {},
         "nodes": {}
     }
+    start = time.perf_counter()
 
     # 1 ─ Load parent-segment XPaths
     with open(segment_json_path, "r") as f:
@@ -115,18 +158,35 @@ def classify_and_describe_candidates(
 
         # print(node.data.xpath)
         
+        # Labeled in an incremental run, along with its whole (unchanged) subtree
+        if _is_carried_over(node):
+            run_log["nodes"][node.data.xpath] = {
+                "node_id"       : None,
+                "component_type": node.component_info.component_type.name,
+                "component_title": node.component_info.component_title,
+                "source"        : LabelSource.CARRIED.value
+            }
+            queue = queue[1:]
+            continue
+        
+        node_start = time.perf_counter()
         while True:
             try:
                 # node_id = hash_string(clean_html(node.data.raw_html).prettify())
                 node_id = compute_image_hash(node.data.screenshot)
                 ancestor_ctx = "\n".join(_get_ancestor_context(node))
                 
-                if node_id not in memory:
-                    response_full = classification_model(
-                        file=node.data.screenshot,
-                        prompt = f"Page Context: {page_context}\n"
-                                 f"Ancestors:\n{ancestor_ctx}"
-                    )
+                prediction = None
+                if preclassifier is not None and node_id not in memory and node.data.xpath not in lists:
+                    prediction = preclassifier.classify(node, lists)
+                
+                if node_id not in memory and node.data.xpath not in lists and prediction is None:
+                    with usage_context(xpath=node.data.xpath, purpose='classify'):
+                        response_full = classification_model(
+                            file=node.data.screenshot,
+                            prompt = f"Page Context: {page_context}\n"
+                                     f"Ancestors:\n{ancestor_ctx}"
+                        )
                     response = response_full.text
 
                     if not isinstance(response, str) or not response.strip():
@@ -144,10 +204,29 @@ def classify_and_describe_candidates(
                     node.add_component_info(
                         component_type=ComponentType(component_type),
                         component_title=component_title,
-                        component_context=component_context
+                        component_context=component_context,
+                        label_source=LabelSource.MODEL
                     )
                     
                     print(node.data.xpath, node_id, component_type, component_title)
+                elif prediction is not None:
+                    node.add_component_info(
+                        component_type=prediction['type'],
+                        component_title=node_title(node),
+                        label_source=LabelSource.HEURISTIC
+                    )
+                    
+                    print('HEURISTIC', node.data.xpath, node_id, prediction['type'].value, prediction['rule'])
+                elif node_id not in memory:
+                    group = lists[node.data.xpath]
+                    item_tag = group['representative'].rsplit('/', 1)[-1].split('[')[0]
+                    node.add_component_info(
+                        component_type=ComponentType.LIST,
+                        component_title=f"List of {len(group['members'])} {item_tag} items",
+                        label_source=LabelSource.STRUCTURE
+                    )
+                    
+                    print('STRUCTURE', node.data.xpath, node_id, ComponentType.LIST.value)
                 else:
                     component_type = memory[node_id]['type']
                     component_context = memory[node_id]['context']
@@ -157,8 +236,10 @@ def classify_and_describe_candidates(
                         component_type=component_type,
                         component_title=component_title,
                         component_context=component_context,
-                        previously_seen=previously_seen
+                        previously_seen=previously_seen,
+                        label_source=LabelSource.MEMORY
                     )
+                    record_memory_hit(xpath=node.data.xpath, purpose='classify')
                     
                     print('IN MEMORY', node.data.xpath, node_id, component_type, component_title)
                 
@@ -166,7 +247,8 @@ def classify_and_describe_candidates(
                     "node_id"       : str(node_id),
                     "component_type": node.component_info.component_type.name,
                     "component_title": node.component_info.component_title,
-                    "source"        : "memory" if node_id in memory else "model"
+                    "source"        : node.component_info.label_source.value,
+                    "seconds"       : time.perf_counter() - node_start
                 }
 
                 
@@ -179,33 +261,258 @@ def classify_and_describe_candidates(
         
         queue = queue[1:]
     
+    run_log["meta"]["seconds"] = time.perf_counter() - start
     return root, run_log
 
 
+def _generation_prompt(node: VirtualNode, page_context: str) -> str:
+    ancestor_ctx = "\n".join(_get_ancestor_context(node))
+    return f"""Page Context: {page_context}
+                    Ancestors:
+                    {ancestor_ctx}
+                    Raw HTML:
+                    {node.data.raw_html}"""
+
+
+def _generate_code(component_generation_model, node: VirtualNode, page_context: str, element_class: str) -> str:
+    with usage_context(xpath=node.data.xpath, purpose='generate'):
+        response = component_generation_model(
+            file=node.data.screenshot,
+            prompt=f'Class: {element_class}\n{_generation_prompt(node, page_context)}'
+        )
+    return extract_response_from_tag(
+        response.text.replace('```jsx', '').replace('```', ''),
+        'JsxOutput'
+    )
+
+
+# Attributes that differ between the items of a list
+BOUND_ATTRIBUTES = ('href', 'src', 'alt', 'title', 'aria-label', 'placeholder', 'value')
+
+# A JSX tag: closing slash, name, attributes (quoted strings and {expressions} may hold '>') and self-closing slash
+_JSX_TAG = re.compile(r'<(/?)([A-Za-z][\w.]*)((?:[^>"\'{]|"[^"]*"|\'[^\']*\'|\{[^{}]*\})*?)(/?)>')
+_JSX_ATTRIBUTE = re.compile(r'(\s)([\w:-]+)=(?:"([^"]*)"|\'([^\']*)\')')
+
+
+class ItemField(TypedDict):
+    # Property of the item data, e.g. 'text0' or 'href1'
+    name: str
+    # 'text' for the text of a leaf, else the attribute
+    source: str
+    # The value in the template item
+    value: str
+
+
+def _leaf_text(node: VirtualNode) -> str:
+    """Full text of a leaf (``text`` is cut at 50 characters, the outer HTML is not)."""
+    if node.data.raw_html:
+        return html.unescape(re.sub(r'<[^>]*>', '', node.data.raw_html)).strip()
+    return node.data.text_content.strip()
+
+
+def _relative_nodes(root: VirtualNode) -> Dict[str, VirtualNode]:
+    prefix = len(root.data.xpath)
+    return {n.data.xpath[prefix:]: n for n in iter_preorder(root)}
+
+
+def _field_values(node: Optional[VirtualNode]) -> Dict[str, str]:
+    """``{source: value}`` of the texts and :data:`BOUND_ATTRIBUTES` of one node ('' if it is missing)."""
+    if node is None:
+        return {}
+    values = {} if node.children else {'text': _leaf_text(node)}
+    values.update((name, node.data.attributes[name]) for name in BOUND_ATTRIBUTES if name in node.data.attributes)
+    return values
+
+
+def item_fields(template: VirtualNode, items: List[VirtualNode]) -> Tuple[List[ItemField], List[Dict[str, str]]]:
+    """
+    The texts (of leaves) and :data:`BOUND_ATTRIBUTES` values of the
+    ``template`` item that differ between the ``items``, and every item's
+    values of them, taken from the node at the same relative XPath ('' if
+    it has none). Template values shorter than two characters are left out.
+
+    Returns:
+        The fields and, per item, ``{field name: value}``.
+    """
+    relative_items = [_relative_nodes(item) for item in items]
+    fields: List[ItemField] = []
+    data: List[Dict[str, str]] = [{} for _ in items]
+    seen: Set[str] = set()
+
+    for path, node in _relative_nodes(template).items():
+        for source, value in _field_values(node).items():
+            if len(value) < 2 or value in seen:
+                continue
+            values = [_field_values(nodes.get(path)).get(source, '') for nodes in relative_items]
+            if all(v == value for v in values):
+                continue
+            seen.add(value)
+            name = re.sub(r'-(\w)', lambda match: match.group(1).upper(), source) + str(len(fields))
+            fields.append({'name': name, 'source': source, 'value': value})
+            for row, v in zip(data, values):
+                row[name] = v
+    return fields, data
+
+
+def parametrize_template(code: str, fields: List[ItemField]) -> str:
+    """
+    Turns the JSX of the template item into the body of a ``.map(item => ...)``:
+    inside its elements' text and its :data:`BOUND_ATTRIBUTES` values, the
+    values of ``fields`` become ``{item.<field>}``. Component names, other
+    props, class names and code outside the elements are left as they are.
+    """
+    if not fields:
+        return code
+    by_value = {field['value']: field['name'] for field in fields}
+
+    def pattern(value: str) -> str:
+        left = r'(?<![\w-])' if re.match(r'\w', value[0]) else ''
+        right = r'(?![\w-])' if re.match(r'\w', value[-1]) else ''
+        return left + re.escape(value) + right
+
+    text_regex = re.compile('|'.join(pattern(value) for value in sorted(by_value, key=len, reverse=True)))
+
+    def substitute_text(text: str) -> str:
+        # Only the literal parts, not the {expressions} in the text
+        parts = re.split(r'(\{[^{}]*\})', text)
+        return ''.join(
+            part if part.startswith('{') else text_regex.sub(lambda m: f'{{item.{by_value[m.group(0)]}}}', part)
+            for part in parts
+        )
+
+    def substitute_attributes(attributes: str) -> str:
+        def replace(match: re.Match) -> str:
+            value = match.group(3) if match.group(3) is not None else match.group(4)
+            if match.group(2) in BOUND_ATTRIBUTES and value in by_value:
+                return f'{match.group(1)}{match.group(2)}={{item.{by_value[value]}}}'
+            return match.group(0)
+        return _JSX_ATTRIBUTE.sub(replace, attributes)
+
+    out, depth, position = [], 0, 0
+    for tag in _JSX_TAG.finditer(code):
+        between = code[position:tag.start()]
+        out.append(substitute_text(between) if depth > 0 else between)
+        closing, name, attributes, self_closing = tag.groups()
+        out.append(f'<{closing}{name}{substitute_attributes(attributes) if not closing else attributes}{self_closing}>')
+        if closing:
+            depth -= 1
+        elif not self_closing:
+            depth += 1
+        position = tag.end()
+    out.append(code[position:])
+    return ''.join(out)
+
+
+def _with_key(code: str) -> str:
+    """Adds ``key={index}`` to the root element of a mapped item."""
+    return re.sub(r'^(\s*<[A-Za-z][\w.]*)', r'\1 key={index}', code, count=1)
+
+
+def _indent(code: str, spaces: int) -> str:
+    return '\n'.join(' ' * spaces + line if line.strip() else line for line in code.splitlines())
+
+
+def _generate_list_code(
+    node: VirtualNode,
+    group: RepeatedGroup,
+    component_generation_model,
+    page_context: str,
+    memory: dict
+) -> str:
+    """
+    Code of a list from one model call: the representative item is
+    generated (or taken from ``memory``) as a template reading its texts
+    and attributes from ``item``, and one ``List`` maps it over the other
+    items' values. Children outside the group are generated on their own,
+    before or after the items.
+    """
+    children = {child.data.xpath: child for child in node.children}
+    template = children[group['representative']]
+
+    template_id = compute_image_hash(template.data.screenshot)
+    if template_id in memory and memory[template_id].get('code'):
+        template_code = memory[template_id]['code']
+        record_memory_hit(xpath=node.data.xpath, purpose='generate')
+    else:
+        template_code = _generate_code(component_generation_model, template, page_context, 'SegmentIsSingularComponent')
+
+    # Not a single JSX element (e.g. a whole module): the representative item stands for the list
+    if not template_code.strip().startswith('<'):
+        print('TEMPLATE', node.data.xpath, "representative item only from", template.data.xpath)
+        return template_code
+
+    member_xpaths = set(group['members'])
+    members = [child for child in node.children if child.data.xpath in member_xpaths]
+    fields, data = item_fields(template, members)
+    first = node.children.index(members[0])
+    before, after = [], []
+    for i, child in enumerate(node.children):
+        if child.data.xpath not in member_xpaths:
+            code = _generate_code(component_generation_model, child, page_context, 'SegmentIsSingularComponent')
+            (before if i < first else after).append(_indent(code.strip(), 2))
+
+    items = ',\n'.join('    ' + json.dumps(row, ensure_ascii=False) for row in data)
+    title = html.escape(node.component_info.component_title or 'List') if node.component_info else 'List'
+    body = '\n'.join(before + [
+        f"  {{[\n{items}\n  ].map((item, index) => (",
+        _indent(_with_key(parametrize_template(template_code.strip(), fields)), 4),
+        "  ))}",
+    ] + after)
+
+    print('TEMPLATE', node.data.xpath, f"{len(members)} items from", template.data.xpath)
+    return f'<List name="{title}">\n{body}\n</List>'
+
+
+@traced('generate')
 def transform_candidate(
     root: VirtualNode,
     component_generation_model,
     page_context: str,
     memory: dict,
-    state_id: str
+    state_id: str,
+    list_templates: bool = True,
+    lists: Optional[Dict[str, RepeatedGroup]] = None
 ):
+    """
+    Generates the code of the classified tree, breadth-first through the
+    containers, with the model or from ``memory``.
+
+    Args:
+        root: The classified tree.
+        component_generation_model: Model with the generation prompt.
+        page_context: Description of the page.
+        memory: Labels and code of components seen before, by screenshot
+            hash; updated with the generated code.
+        state_id: The state, recorded as where new components were first seen.
+        list_templates: Generate lists whose children are mostly
+            near-identical items (see :func:`find_lists`) from one item,
+            mapped over the texts and attributes of the others, instead of
+            as a whole.
+        lists: The lists of the tree (see :func:`find_lists`), found before
+            dedup and mapped onto it with :func:`map_lists`; by default they
+            are looked for among the children of every list node, which
+            dedup may have left too few of.
+
+    Returns:
+        The memory and the tree.
+    """
     queue: List[VirtualNode] = [root]
     
     while len(queue) > 0:
         node = queue[0]
         
-        if node.data.tag_name == 'root':
+        # The root and the wrappers above the top-level segments are not classified
+        if node.data.tag_name == 'root' or node.component_info is None:
             queue.extend(node.children)
             queue = queue[1:]
             continue
-
-        ancestor_ctx = "\n".join(_get_ancestor_context(node))
-        prompt = f"""Page Context: {page_context}
-                    Ancestors:
-                    {ancestor_ctx}
-                    Raw HTML:
-                    {node.data.raw_html}"""
         
+        # Code of carried-over subtrees comes with their labels
+        if _is_carried_over(node):
+            print('CARRIED', node.data.xpath)
+            queue = queue[1:]
+            continue
+
         while True:
             try:
                 # node_id = hash_string(clean_html(node.data.raw_html).prettify())
@@ -215,6 +522,8 @@ def transform_candidate(
                     node.add_component_info(
                         component_code=memory[node_id]['code']
                     )
+                    if node.component_info.component_type != ComponentType.CONTAINER:
+                        record_memory_hit(xpath=node.data.xpath, purpose='generate')
                     
                     print('IN MEMORY', node.data.xpath, node_id)
                     
@@ -224,14 +533,19 @@ def transform_candidate(
                     if node.component_info.component_type == ComponentType.CONTAINER:
                         queue.extend(node.children)
                     else:
-                        element_class = 'SegmentIsListOfItems' if node.component_info.component_type == ComponentType.LIST else 'SegmentIsSingularComponent'
-                        component = extract_response_from_tag(
-                            component_generation_model(
-                                file=node.data.screenshot,
-                                prompt=f'Class: {element_class}\n{prompt}'
-                            ).text.replace('```jsx', '').replace('```', ''),
-                            'JsxOutput'
-                        )
+                        is_list = node.component_info.component_type == ComponentType.LIST
+                        group = None
+                        if is_list and list_templates:
+                            node_lists = lists if lists is not None else \
+                                find_lists(node, groups=find_repeated_children(node, descendants=False))
+                            group = node_lists.get(node.data.xpath)
+                        if group is not None:
+                            component = _generate_list_code(
+                                node, group, component_generation_model, page_context, memory
+                            )
+                        else:
+                            element_class = 'SegmentIsListOfItems' if is_list else 'SegmentIsSingularComponent'
+                            component = _generate_code(component_generation_model, node, page_context, element_class)
                         node.add_component_info(component_code=component)
                     
                     memory[node_id] = {
@@ -251,3 +565,108 @@ def transform_candidate(
         queue = queue[1:]
     
     return memory, root
+
+
+def find_all_components(root: VirtualNode) -> List[VirtualNode]:
+    """
+    Returns the non-container nodes reached through containers (and the
+    unclassified nodes above the top-level segments), in BFS order.
+    """
+    queue = deque([root])
+    components: List[VirtualNode] = []
+
+    while queue:
+        node = queue.popleft()
+        
+        if node.component_info is None:
+            queue.extend(node.children)
+        elif node.component_info.component_type != ComponentType.CONTAINER:
+            components.append(node)
+        else:
+            queue.extend(node.children)
+
+    return components
+
+
+def get_hierarchy(node: VirtualNode) -> Tuple[str, str]:
+    """
+    Returns the titles (joined with ' > ') and contexts (one per line) of the
+    node's classified ancestors, outermost first.
+    """
+    titles = []
+    contexts = []
+    
+    parent = node.parent
+    
+    while parent is not None and parent.data.tag_name != 'root':
+        if parent.component_info is not None:
+            titles.append(parent.component_info.component_title)
+            contexts.append(parent.component_info.component_context)
+        parent = parent.parent
+
+    titles = list(filter(lambda x: x is not None, reversed(titles)))
+    contexts = list(filter(lambda x: x is not None, reversed(contexts)))
+    
+    return ' > '.join(titles), '\n'.join(contexts)
+
+
+def build_component_model(root: VirtualNode) -> List[dict]:
+    """The ``components`` entry of a state in the app model: one dict per component."""
+    component_model = []
+    
+    for component in find_all_components(root):
+        if component.component_info is None:
+            continue
+        htitles, hcontexts = get_hierarchy(component)
+        component_model.append({
+            'id': component.data.xpath,
+            'htitles': htitles,
+            'hcontexts': hcontexts,
+            'title': component.component_info.component_title,
+            'context': component.component_info.component_context,
+            'code': component.component_info.component_code,
+            'original_state': component.component_info.previously_seen,
+        })
+    
+    return component_model
+
+
+def export_component_labels(root: VirtualNode) -> Dict[str, dict]:
+    """
+    JSON-serializable labels of the classified nodes of a tree, keyed by
+    XPath, e.g. to resume at the generation step from a fresh tree.
+    """
+    labels = {}
+    
+    for node in iter_preorder(root):
+        info = node.component_info
+        if info is None:
+            continue
+        labels[node.data.xpath] = {
+            'type': info.component_type.value if info.component_type is not None else None,
+            'title': info.component_title,
+            'context': info.component_context,
+            'code': info.component_code,
+            'previously_seen': info.previously_seen,
+            'label_source': info.label_source.value if info.label_source is not None else None,
+        }
+    
+    return labels
+
+
+def apply_component_labels(root: VirtualNode, labels: Dict[str, dict]) -> VirtualNode:
+    """Sets the labels of :func:`export_component_labels` on the nodes of ``root`` with the same XPaths."""
+    for node in iter_preorder(root):
+        label = labels.get(node.data.xpath)
+        if label is None:
+            continue
+        node.add_component_info(
+            component_title=label['title'] or '',
+            component_context=label['context'] or '',
+            component_type=ComponentType(label['type']) if label['type'] is not None else None,
+            component_code=label.get('code'),
+            previously_seen=label['previously_seen'] or '',
+            label_source=LabelSource(label['label_source']) if label['label_source'] is not None else None
+        )
+    
+    return root
@@ -0,0 +1,255 @@
+"""
+Heuristic pre-classification of segments, to skip obvious model calls.
+
+Classification sends every segment (and every child of a container) to the
+vision model, including single buttons, bare text and wrappers with one
+child. A :class:`Preclassifier` looks at cheap features of the node
+(:class:`NodeFeatures`: tag, children, box, interactivity, whether its
+children repeat one template) and applies a few rules, each with a
+confidence. Predictions at or above the threshold become the label;
+anything else is left to the model::
+
+    preclassifier = Preclassifier(threshold=0.9)
+    classify_and_describe_candidates(..., preclassifier=preclassifier)
+
+How far the threshold can go down is measured against the model's labels
+of past crawls::
+
+    python -m visca.preclassify results/taskcafe
+"""
+import re
+import json
+import argparse
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, TypedDict, Union
+
+from visca.virtual_node import VirtualNode, ComponentType, build_dom_tree, iter_preorder
+from visca.segment import RepeatedGroup, find_lists, map_lists
+
+
+DEFAULT_THRESHOLD = 0.9
+
+INTERACTIVE_TAGS = frozenset(('a', 'button', 'input', 'select', 'textarea', 'label', 'option', 'summary'))
+INTERACTIVE_ROLES = frozenset(('button', 'link', 'checkbox', 'radio', 'switch', 'tab', 'menuitem', 'option'))
+
+# A box at most this large (px) is a control or a line of text, not a section
+SMALL_WIDTH, SMALL_HEIGHT = 320, 80
+# A box at least this tall, with several children, is a region of the page
+LARGE_HEIGHT = 600
+
+
+class NodeFeatures(TypedDict):
+    tag: str
+    children: int
+    descendants: int
+    width: int
+    height: int
+    interactive: bool
+    # Whether the children are mostly items of one template (see find_lists)
+    repeated_children: bool
+
+
+class Prediction(TypedDict):
+    type: ComponentType
+    confidence: float
+    rule: str
+
+
+def _is_interactive(node: VirtualNode) -> bool:
+    data = node.data
+    if data.tag_name.lower() in INTERACTIVE_TAGS:
+        return True
+    if data.extras and data.extras.get('isInteractive'):
+        return True
+    attributes = data.attributes
+    return attributes.get('role', '').lower() in INTERACTIVE_ROLES or 'onclick' in attributes
+
+
+def node_features(node: VirtualNode, lists: Optional[Dict[str, RepeatedGroup]] = None) -> NodeFeatures:
+    """The features of ``node`` the rules look at; ``lists`` as returned by :func:`find_lists` on its tree."""
+    data = node.data
+    return {
+        'tag': data.tag_name.lower(),
+        'children': len(node.children),
+        'descendants': sum(1 for _ in iter_preorder(node)) - 1,
+        'width': data.width,
+        'height': data.height,
+        'interactive': _is_interactive(node),
+        'repeated_children': lists is not None and data.xpath in lists,
+    }
+
+
+# (name, type, confidence, test), tried in order; the first match predicts
+RULES: Tuple[Tuple[str, ComponentType, float, Callable[[NodeFeatures], bool]], ...] = (
+    ('repeated_children', ComponentType.LIST, 0.95,
+     lambda f: f['repeated_children']),
+    ('interactive_leaf', ComponentType.COMPONENT, 0.95,
+     lambda f: f['interactive'] and f['descendants'] == 0),
+    ('small_interactive', ComponentType.COMPONENT, 0.9,
+     lambda f: f['interactive'] and f['width'] <= SMALL_WIDTH and f['height'] <= SMALL_HEIGHT),
+    ('leaf', ComponentType.COMPONENT, 0.9,
+     lambda f: f['descendants'] == 0),
+    ('small_box', ComponentType.COMPONENT, 0.85,
+     lambda f: f['width'] <= SMALL_WIDTH and f['height'] <= SMALL_HEIGHT and f['descendants'] <= 3),
+    ('single_child_wrapper', ComponentType.CONTAINER, 0.8,
+     lambda f: f['children'] == 1 and not f['interactive']),
+    ('large_region', ComponentType.CONTAINER, 0.7,
+     lambda f: f['height'] >= LARGE_HEIGHT and f['children'] >= 3),
+)
+
+
+class Preclassifier:
+    """
+    Rule-based classifier of nodes; answers only when its confidence
+    reaches the threshold.
+    """
+
+    def __init__(
+        self,
+        threshold: float = DEFAULT_THRESHOLD,
+        confidences: Optional[Dict[str, float]] = None
+    ):
+        """
+        Args:
+            threshold: Smallest confidence of a prediction that is used.
+            confidences: Per-rule confidences overriding those of :data:`RULES`,
+                e.g. ``{'small_box': 0.95}`` after measuring its precision.
+        """
+        self.threshold = threshold
+        self.confidences = {name: confidence for name, _, confidence, _ in RULES}
+        if confidences:
+            unknown = set(confidences) - set(self.confidences)
+            if unknown:
+                raise ValueError(f"Unknown rules: {sorted(unknown)}. Expected some of {list(self.confidences)}.")
+            self.confidences.update(confidences)
+
+
+    def predict(self, features: NodeFeatures) -> Optional[Prediction]:
+        """The prediction of the first matching rule, whatever its confidence."""
+        for name, component_type, _, test in RULES:
+            if test(features):
+                return {'type': component_type, 'confidence': self.confidences[name], 'rule': name}
+        return None
+
+
+    def classify(self, node: VirtualNode, lists: Optional[Dict[str, RepeatedGroup]] = None) -> Optional[Prediction]:
+        """The prediction for ``node`` if it is confident enough, else None (ask the model)."""
+        prediction = self.predict(node_features(node, lists))
+        if prediction is None or prediction['confidence'] < self.threshold:
+            return None
+        return prediction
+
+
+def node_title(node: VirtualNode) -> str:
+    """A title for a node labeled without the model: its text, or its tag."""
+    text = re.sub(r'\s+', ' ', node.data.text_content or '').strip()
+    return text[:40] if text else node.data.tag_name.capitalize()
+
+
+def _past_labels(result_dir: Path) -> List[Tuple[str, Dict[str, dict]]]:
+    """``(state_id, labels)`` of the classified states of a crawl's journal."""
+    # Imported here: visca.crawl pulls in the browser stack
+    from visca.crawl.journal import CheckpointJournal
+
+    journal = CheckpointJournal(result_dir / 'journal.jsonl')
+    states = []
+    for state_id in journal.finished_states():
+        classified = journal.result(state_id, 'classify')
+        if classified is not None and (result_dir / state_id / 'deduplicated.json').is_file():
+            states.append((state_id, classified['labels']))
+    return states
+
+
+def evaluate_preclassifier(
+    result_dir: Union[str, Path],
+    thresholds: Sequence[float] = (0.95, 0.9, 0.85, 0.8, 0.7),
+    confidences: Optional[Dict[str, float]] = None,
+    sources: Sequence[str] = ('model', 'memory')
+) -> Dict[str, object]:
+    """
+    Replays the pre-classifier on the nodes the model labeled in a past
+    crawl (its ``journal.jsonl`` and per-state ``deduplicated.json``).
+
+    Args:
+        result_dir: The crawl's result directory.
+        thresholds: Thresholds to report.
+        confidences: Rule confidences, as for :class:`Preclassifier`.
+        sources: Label sources that count as model labels.
+
+    Returns:
+        ``{'nodes', 'rules': {rule: {'predicted', 'correct', 'precision'}},
+        'thresholds': {threshold: {'skipped', 'correct', 'precision',
+        'skipped_share'}}}``, where ``skipped`` are the model calls the
+        threshold would save.
+    """
+    result_dir = Path(result_dir)
+    preclassifier = Preclassifier(threshold=0.0, confidences=confidences)
+    outcomes: List[Tuple[Prediction, bool]] = []
+    nodes = 0
+
+    for state_id, labels in _past_labels(result_dir):
+        with open(result_dir / state_id / 'deduplicated.json', 'r', encoding='utf-8') as f:
+            tree = build_dom_tree(json.load(f))
+        # As the pipeline does: on all elements, since dedup removes most items of a list
+        segments_path = result_dir / state_id / 'segments.json'
+        if segments_path.is_file():
+            with open(segments_path, 'r', encoding='utf-8') as f:
+                lists = map_lists(find_lists(build_dom_tree(json.load(f))), tree)
+        else:
+            lists = find_lists(tree)
+        for node in iter_preorder(tree):
+            label = labels.get(node.data.xpath)
+            if label is None or label.get('label_source') not in sources or label.get('type') is None:
+                continue
+            nodes += 1
+            prediction = preclassifier.predict(node_features(node, lists))
+            if prediction is not None:
+                outcomes.append((prediction, prediction['type'].value == label['type']))
+
+    rules: Dict[str, Dict[str, float]] = {}
+    for prediction, correct in outcomes:
+        rule = rules.setdefault(prediction['rule'], {'predicted': 0, 'correct': 0})
+        rule['predicted'] += 1
+        rule['correct'] += int(correct)
+    for rule in rules.values():
+        rule['precision'] = rule['correct'] / rule['predicted']
+
+    by_threshold: Dict[float, Dict[str, float]] = {}
+    for threshold in thresholds:
+        used = [correct for prediction, correct in outcomes if prediction['confidence'] >= threshold]
+        by_threshold[threshold] = {
+            'skipped': len(used),
+            'correct': sum(used),
+            'precision': sum(used) / len(used) if used else 0.0,
+            'skipped_share': len(used) / nodes if nodes else 0.0,
+        }
+
+    return {'nodes': nodes, 'rules': rules, 'thresholds': by_threshold}
+
+
+def print_evaluation(report: Dict[str, object]) -> None:
+    print(f"▶ {report['nodes']} nodes labeled by the model")
+    print(f"\n{'rule':<24}{'predicted':>10}{'precision':>11}")
+    for name, rule in report['rules'].items():
+        print(f"{name:<24}{rule['predicted']:>10}{rule['precision']:>11.1%}")
+    print(f"\n{'threshold':<12}{'calls saved':>12}{'share':>8}{'precision':>11}")
+    for threshold, row in report['thresholds'].items():
+        print(f"{threshold:<12}{row['skipped']:>12}{row['skipped_share']:>8.1%}{row['precision']:>11.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='python -m visca.preclassify',
+        description="Precision of the pre-classifier against the model labels of past crawls"
+    )
+    parser.add_argument('result_dirs', nargs='+', help="result directories of crawls (with journal.jsonl)")
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.95, 0.9, 0.85, 0.8, 0.7])
+    args = parser.parse_args()
+
+    for result_dir in args.result_dirs:
+        print(f"\n{result_dir}")
+        print_evaluation(evaluate_preclassifier(result_dir, thresholds=args.thresholds))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,6 @@
+# Segment goes first: visca.virtual_node imports it while .utils is loading
+from .segment import Segment
+
 from .utils import (
     tag_multiset,
     jaccard_distance,
@@ -7,8 +10,24 @@ from .utils import (
     gather_instances,
     ascii_tree,
 )
-
-from .segment import Segment
+from .grouping import (
+    InstanceDetails,
+    group_instance_leaves,
+    segment_tree,
+)
+from .vips import (
+    DEFAULT_PDOC,
+    degree_of_coherence,
+    segment_vips,
+    vips_tree,
+)
+from .fingerprint import (
+    RepeatedGroup,
+    subtree_signatures,
+    find_repeated_children,
+    find_lists,
+    map_lists,
+)
 
 __all__ = [
     "Segment",
@@ -19,4 +38,16 @@ __all__ = [
     "calculate_psi_sum",
     "gather_instances",
     "ascii_tree",
+    "InstanceDetails",
+    "group_instance_leaves",
+    "segment_tree",
+    "DEFAULT_PDOC",
+    "degree_of_coherence",
+    "segment_vips",
+    "vips_tree",
+    "RepeatedGroup",
+    "subtree_signatures",
+    "find_repeated_children",
+    "find_lists",
+    "map_lists",
 ]
@@ -0,0 +1,304 @@
+"""
+Structural fingerprints of subtrees, to find repeated components.
+
+Every node gets, bottom-up, a canonical signature of its subtree: its tag,
+the size bucket of its box (half octaves of width and height) and the
+signatures of its children, in order. Siblings with the same signature are
+identical items.
+
+Near-identical items (a card with an extra badge, a row whose text wraps)
+are found with MinHash: a node's fingerprint is the MinHash of the shape
+tokens of its first levels (see :func:`shape_tokens`), and siblings whose
+fingerprints collide in a locality-sensitive hashing band, and agree on at
+least ``threshold`` of the hashes, are grouped.
+
+A node whose children are mostly items of one group is an obvious list
+(:func:`find_lists`), which classification can label without the model.
+Dedup removes most items of a list (they look alike), so lists are found
+on the tree of all elements and mapped onto the deduplicated one
+(:func:`map_lists`).
+"""
+from __future__ import annotations
+import hashlib
+from typing import Dict, List, Optional, Tuple, TypedDict
+
+import numpy as np
+
+from visca.virtual_node.traversal import iter_preorder, iter_preorder_with_depth
+
+
+# Mersenne prime of the MinHash permutations (h(x) = (a * x + b) mod p)
+_PRIME = (1 << 31) - 1
+
+DEFAULT_NUM_PERM = 64
+DEFAULT_BANDS = 16
+
+# The representative of a long list is the medoid of this many evenly spaced members
+MAX_MEDOID_CANDIDATES = 256
+# Hash comparisons made at once when comparing them to all members
+_COMPARISONS_PER_CHUNK = 1 << 22
+
+# Nodes whose alike children are the fields of one record, not the items of a list
+RECORD_TAGS = frozenset(('tr',))
+
+
+class RepeatedGroup(TypedDict):
+    parent: str
+    # XPaths of the near-identical children, in document order
+    members: List[str]
+    # The member most similar to the others
+    representative: str
+    # Mean estimated Jaccard similarity of the members to the representative
+    similarity: float
+    # Share of the parent's children in the group
+    coverage: float
+
+
+def _token(*parts) -> int:
+    """Stable 31-bit hash (``hash()`` of strings changes between processes)."""
+    digest = hashlib.blake2b(repr(parts).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') & _PRIME
+
+
+def _size_bucket(value: float, per_octave: int = 2) -> int:
+    return int(round(per_octave * np.log2(max(float(value), 0.0) + 1)))
+
+
+def subtree_signatures(root: "VirtualNode") -> Dict[int, int]:
+    """
+    ``{id(node): signature}`` of every node of the tree: equal signatures
+    mean equal tags, size buckets and child structure all the way down.
+    """
+    signatures: Dict[int, int] = {}
+    # Children come after their parent in pre-order, so reversed it is bottom-up
+    for node in reversed(list(iter_preorder(root))):
+        data = node.data
+        signatures[id(node)] = _token(
+            node.tag, _size_bucket(data.width), _size_bucket(data.height),
+            tuple(signatures[id(child)] for child in node.children)
+        )
+    return signatures
+
+
+def shape_tokens(node: "VirtualNode", depth: int = 3) -> np.ndarray:
+    """
+    The shape tokens of the first ``depth`` levels of ``node``'s subtree, as
+    a set: two per node, one for its place in the structure (relative depth,
+    parent tag and tag) and one adding its size bucket, so items that differ
+    only in the size of some text still share most tokens. Repeated shapes
+    are numbered, so the set keeps their count.
+    """
+    seen: Dict[tuple, int] = {}
+    tokens = []
+    for n, d in iter_preorder_with_depth(node, max_depth=depth - 1):
+        parent_tag = n.parent.tag if d > 0 and n.parent is not None else ''
+        size = (_size_bucket(n.data.width, per_octave=1), _size_bucket(n.data.height, per_octave=1))
+        for shape in ((d, parent_tag, n.tag), (d, n.tag) + size):
+            seen[shape] = seen.get(shape, 0) + 1
+            tokens.append(_token(shape, seen[shape]))
+    return np.array(tokens, dtype=np.int64)
+
+
+class MinHasher:
+    """``num_perm`` random hash functions, applied to token sets at once."""
+
+    def __init__(self, num_perm: int = DEFAULT_NUM_PERM, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self._a = rng.integers(1, _PRIME, size=(num_perm, 1), dtype=np.int64)
+        self._b = rng.integers(0, _PRIME, size=(num_perm, 1), dtype=np.int64)
+
+
+    def signature(self, tokens: np.ndarray) -> np.ndarray:
+        """MinHash of a token set, ``(num_perm,)``; all ``_PRIME`` for an empty set."""
+        if len(tokens) == 0:
+            return np.full(self.num_perm, _PRIME, dtype=np.int64)
+        return ((self._a * tokens[None] + self._b) % _PRIME).min(axis=1)
+
+
+def _group_similar(
+    signatures: np.ndarray,
+    exact: List[int],
+    threshold: float,
+    bands: int
+) -> List[List[int]]:
+    """Groups (as lists of row indices) of rows that are identical or similar by MinHash LSH."""
+    parent = list(range(len(signatures)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i: int, j: int) -> None:
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)
+
+    first_with: Dict[int, int] = {}
+    for i, signature in enumerate(exact):
+        union(i, first_with.setdefault(signature, i))
+
+    rows = signatures.shape[1] // bands
+    for band in range(bands):
+        buckets: Dict[bytes, int] = {}
+        for i in range(len(signatures)):
+            key = signatures[i, band * rows:(band + 1) * rows].tobytes()
+            j = buckets.setdefault(key, i)
+            # Candidates share a band; keep them if enough hashes agree
+            if j != i and find(i) != find(j) and np.mean(signatures[i] == signatures[j]) >= threshold:
+                union(i, j)
+
+    groups: Dict[int, List[int]] = {}
+    for i in range(len(signatures)):
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
+
+
+def _medoid(fingerprints: np.ndarray) -> Tuple[int, float]:
+    """
+    Row of the fingerprint most similar (by estimated Jaccard similarity) to
+    all the others, and its mean similarity to them. Only up to
+    :data:`MAX_MEDOID_CANDIDATES` rows are candidates, compared to all rows
+    in chunks, so long lists take neither quadratic time nor memory.
+    """
+    m, num_perm = fingerprints.shape
+    candidates = np.unique(np.linspace(0, m - 1, min(m, MAX_MEDOID_CANDIDATES)).round().astype(np.int64))
+    mean_similarity = np.empty(len(candidates))
+    rows = max(1, _COMPARISONS_PER_CHUNK // (m * num_perm))
+    for start in range(0, len(candidates), rows):
+        chunk = fingerprints[candidates[start:start + rows]]
+        mean_similarity[start:start + rows] = (chunk[:, None] == fingerprints[None]).mean(axis=(1, 2))
+    best = int(mean_similarity.argmax())
+    return int(candidates[best]), float(mean_similarity[best])
+
+
+def _largest_group(
+    node: "VirtualNode",
+    exact: Dict[int, int],
+    hasher: MinHasher,
+    min_items: int,
+    threshold: float,
+    depth: int,
+    bands: int
+) -> Optional[RepeatedGroup]:
+    children = node.children
+    if len(children) < min_items:
+        return None
+
+    fingerprints = np.stack([hasher.signature(shape_tokens(child, depth)) for child in children])
+    members = max(
+        _group_similar(fingerprints, [exact[id(child)] for child in children], threshold, bands),
+        key=len
+    )
+    if len(members) < min_items:
+        return None
+
+    best, similarity = _medoid(fingerprints[members])
+    return {
+        'parent': node.xpath,
+        'members': [children[i].xpath for i in members],
+        'representative': children[members[best]].xpath,
+        'similarity': similarity,
+        'coverage': len(members) / len(children),
+    }
+
+
+def find_repeated_children(
+    root: "VirtualNode",
+    min_items: int = 3,
+    threshold: float = 0.7,
+    depth: int = 3,
+    num_perm: int = DEFAULT_NUM_PERM,
+    bands: int = DEFAULT_BANDS,
+    descendants: bool = True
+) -> Dict[str, RepeatedGroup]:
+    """
+    For every node with at least ``min_items`` children, the largest group
+    of identical or near-identical children, if it has ``min_items`` members.
+
+    Args:
+        root: The element tree.
+        min_items: Smallest number of items of a group.
+        threshold: Smallest estimated Jaccard similarity of the shape tokens
+            of two near-identical items.
+        depth: Levels of an item's subtree its fingerprint covers.
+        num_perm: MinHash size.
+        bands: LSH bands; ``num_perm`` must be a multiple of it.
+        descendants: Also group the children of the descendants of ``root``,
+            not only its own.
+
+    Returns:
+        ``{parent_xpath: group}`` in document order.
+    """
+    if num_perm % bands:
+        raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands}).")
+
+    hasher = MinHasher(num_perm)
+    exact = subtree_signatures(root)
+    groups: Dict[str, RepeatedGroup] = {}
+
+    for node in (iter_preorder(root) if descendants else [root]):
+        group = _largest_group(node, exact, hasher, min_items, threshold, depth, bands)
+        if group is not None:
+            groups[node.xpath] = group
+
+    return groups
+
+
+def find_lists(
+    root: "VirtualNode",
+    min_items: int = 3,
+    min_coverage: float = 0.8,
+    groups: Optional[Dict[str, RepeatedGroup]] = None,
+    **kwargs
+) -> Dict[str, RepeatedGroup]:
+    """
+    The nodes that are obvious lists: at least ``min_coverage`` of their
+    children (and ``min_items`` of them) are near-identical items. Table
+    rows (:data:`RECORD_TAGS`) are never lists.
+
+    Args:
+        root: The element tree.
+        min_items: Smallest number of items of a list.
+        min_coverage: Smallest share of the children that are items.
+        groups: Output of :func:`find_repeated_children`, if already computed.
+        kwargs: Passed to :func:`find_repeated_children`.
+
+    Returns:
+        ``{list_xpath: group}``.
+    """
+    if groups is None:
+        groups = find_repeated_children(root, min_items=min_items, **kwargs)
+    return {
+        xpath: group for xpath, group in groups.items()
+        if len(group['members']) >= min_items and group['coverage'] >= min_coverage
+        and xpath.rsplit('/', 1)[-1].split('[')[0] not in RECORD_TAGS
+    }
+
+
+def map_lists(lists: Dict[str, RepeatedGroup], root: "VirtualNode") -> Dict[str, RepeatedGroup]:
+    """
+    The lists of a tree mapped by XPath onto ``root``, a reduced version
+    of it (e.g. deduplicated): those whose node is in ``root`` and still
+    has some of their items as children, with only those items. A removed
+    representative is replaced by the first remaining item; similarity and
+    coverage stay those of the full tree.
+
+    Args:
+        lists: Output of :func:`find_lists` on the full tree.
+        root: The reduced tree.
+
+    Returns:
+        ``{list_xpath: group}``.
+    """
+    children = {node.xpath: {child.xpath for child in node.children} for node in iter_preorder(root)}
+    mapped: Dict[str, RepeatedGroup] = {}
+    for xpath, group in lists.items():
+        members = [member for member in group['members'] if member in children.get(xpath, ())]
+        if not members:
+            continue
+        representative = group['representative'] if group['representative'] in members else members[0]
+        mapped[xpath] = {**group, 'members': members, 'representative': representative}
+    return mapped
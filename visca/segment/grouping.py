@@ -0,0 +1,125 @@
+from __future__ import annotations
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional, TypedDict, Union
+
+import numpy as np
+
+from visca.instrument import traced
+
+from .psi import segment_psi
+from .utils import gather_instances
+
+
+class InstanceDetails(TypedDict):
+    count: int
+    leaves: List[str]
+
+
+def group_instance_leaves(
+    root: "VirtualNode",
+    instances: Dict[str, int],
+    elements: List[Dict[str, Any]]
+) -> Dict[str, InstanceDetails]:
+    """
+    Groups ``elements`` under the (disjoint) instance roots they descend from.
+
+    Equivalent to keeping, for every instance XPath ``x``, the elements whose
+    XPath starts with ``x + '/'``, but without comparing every (instance,
+    element) pair. Each tree node gets the instance that owns it by filling
+    the instance's pre-order range in a :class:`FlatTree`, and each element
+    is looked up by XPath in O(1). Elements that are not in the tree (such
+    as removed duplicates) belong to the owner of their closest ancestor
+    that is.
+
+    Args:
+        root: The segmented tree.
+        instances: ``{xpath: size}`` as returned by :func:`gather_instances`.
+        elements: Element dicts with an 'xpath' key, e.g. ``segments.json``.
+
+    Returns:
+        ``{instance_xpath: {'count': size, 'leaves': [xpath, ...]}}`` with
+        the leaves in the order of ``elements``.
+    """
+    # Imported here: visca.virtual_node imports this package
+    from visca.virtual_node.flat_tree import FlatTree
+    from visca.virtual_node.utils import AncestorLookup
+
+    tree = FlatTree(root)
+    owner = np.full(len(tree), -1, dtype=np.int32)
+    instance_ids: List[int] = []
+    for xpath in instances:
+        node_id = tree.id_of(xpath)
+        if node_id is not None:
+            owner[node_id:tree.subtree_end[node_id]] = node_id
+            instance_ids.append(node_id)
+
+    leaves_by_owner: Dict[int, List[str]] = {node_id: [] for node_id in instance_ids}
+    lookup: Optional[AncestorLookup] = None
+    for element in elements:
+        xpath = element['xpath']
+        node_id = tree.id_of(xpath)
+        if node_id is not None:
+            if node_id == owner[node_id]:  # the instance root itself
+                continue
+        else:
+            if lookup is None:
+                lookup = AncestorLookup({node.data.xpath: i for i, node in enumerate(tree.nodes)})
+            node_id = lookup.closest_ancestor(xpath)
+            if node_id is None:
+                continue
+        if owner[node_id] != -1:
+            leaves_by_owner[int(owner[node_id])].append(xpath)
+
+    return {
+        xpath: {
+            'count': count,
+            'leaves': leaves_by_owner.get(tree.id_of(xpath), [])
+        }
+        for xpath, count in instances.items()
+    }
+
+
+@traced('segment')
+def segment_tree(
+    root: "VirtualNode",
+    out_dir: Union[str, Path],
+    name: str = 'aa',
+    mode: str = 'sum',
+    elements: Optional[List[Dict[str, Any]]] = None,
+    verbose: bool = False
+) -> Dict[str, InstanceDetails]:
+    """
+    Segments ``root`` with PSI and writes ``segmentation_xpath_{name}.json``
+    to ``out_dir``, mapping every instance root to its size and the XPaths
+    of the elements under it.
+
+    Args:
+        root: The (deduplicated) DOM tree of the page.
+        out_dir: The page's result directory.
+        name: Suffix of the output file.
+        mode: PSI aggregation, ``"sum"`` or ``"avg"``.
+        elements: Elements to group; defaults to ``out_dir/segments.json``.
+        verbose: Also print every instance with its subtree size.
+
+    Returns:
+        The written instance details.
+    """
+    segment_psi(root, mode=mode)
+    instances = gather_instances(root)
+
+    print("Number of Segments: ", len(instances.keys()))
+    if verbose:
+        for xp, size in instances.items():
+            print(f"{xp:<60}  subtree-nodes = {size}")
+
+    if elements is None:
+        with open(f'{out_dir}/segments.json', 'r', encoding='utf-8') as f:
+            elements = json.load(f)
+
+    instance_details = group_instance_leaves(root, instances, elements)
+
+    with open(f"{out_dir}/segmentation_xpath_{name}.json", 'w', encoding='utf-8') as out:
+        json.dump(instance_details, out, indent=2, ensure_ascii=False)
+
+    return instance_details
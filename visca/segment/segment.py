@@ -13,4 +13,5 @@ class Segment(TypedDict):
     height: int
     visible: bool
     index: int
+    parentIndex: Optional[int]  # only present for elements of extract_dom_elements
     screenshot: str
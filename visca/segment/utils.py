@@ -2,26 +2,26 @@ from __future__ import annotations
 from collections import Counter
 from typing import Dict
 
+from visca.virtual_node.traversal import iter_preorder, iter_preorder_with_depth
+
+from .psi import segment_psi
+
 # Structural Helpers
 def tag_multiset(node: "VirtualNode", depth: int = 3) -> Counter[str]:
     """Return a *multiset* of tag names in *node*'s subtree.
 
     Only the first ``depth`` levels are considered (``depth`` ≤ 0 stops
-    the recursion).  The result is a :class:`collections.Counter`, so
+    the walk).  The result is a :class:`collections.Counter`, so
     union/intersection operations are cheap.
     """
-    if depth == 0:
+    if depth <= 0:
         return Counter()
+    return Counter(n.tag for n in iter_preorder(node, max_depth=depth - 1))
 
-    sig: Counter[str] = Counter([node.tag])
-    for child in node.children:
-        sig += tag_multiset(child, depth - 1)
-    return sig
 
-
-def jaccard_distance(a: "VirtualNode", b: "VirtualNode") -> float:
+def jaccard_distance(a: "VirtualNode", b: "VirtualNode", depth: int = 3) -> float:
     """Cheap structural Jaccard distance in the interval [0, 1]."""
-    sa, sb = tag_multiset(a), tag_multiset(b)
+    sa, sb = tag_multiset(a, depth), tag_multiset(b, depth)
     inter = sum((sa & sb).values())
     union = sum((sa | sb).values())
     return 1.0 - (inter / union) if union else 0.0
@@ -29,14 +29,9 @@ def jaccard_distance(a: "VirtualNode", b: "VirtualNode") -> float:
 
 def subtree_size(node: "VirtualNode") -> int:
     """Count *all* nodes in the subtree rooted at *node*, including itself."""
-    return 1 + sum(subtree_size(ch) for ch in node.children)
+    return sum(1 for _ in iter_preorder(node))
 
 # PSI Scorers
-def _psi_vs_children(node: "VirtualNode", psi_children: float, sibling_score: float) -> float:
-    """Internal helper: compute this node's PSI given pre‑computed values."""
-    return subtree_size(node) / (1.0 + sibling_score)
-
-
 def calculate_psi_avg(node: "VirtualNode") -> float:
     """Compute PSI where the denominator uses the **average** sibling distance.
 
@@ -44,91 +39,38 @@ def calculate_psi_avg(node: "VirtualNode") -> float:
     ``node.is_instance`` ⇒ whether *node* is the chosen component root; and
     ``node.psi`` ⇒ the winning PSI value for the entire subtree.
     """
-    # ――― recurse first ―――
-    child_psis = [calculate_psi_avg(ch) for ch in node.children]
-    psi_children = 1.0
-    for v in child_psis:
-        psi_children *= v
-
-    # ――― local sibling average ―――
-    if node.parent is None:
-        sibling_avg = 0.0
-    else:
-        siblings = [sib for sib in node.parent.children if sib is not node]
-        sibling_avg = (
-            sum(jaccard_distance(node, sib) for sib in siblings) / len(siblings)
-            if siblings
-            else 0.0
-        )
-
-    psi_root = _psi_vs_children(node, psi_children, sibling_avg)
-
-    # ――― choose winner ―――
-    if psi_root >= psi_children:
-        node.psi = psi_root
-        node.is_instance = True
-        return psi_root
-    else:
-        node.psi = psi_children
-        node.is_instance = False
-        return psi_children
+    return segment_psi(node, mode="avg")
 
 
 def calculate_psi_sum(node: "VirtualNode") -> float:
     """Compute PSI where the denominator uses the **sum** of sibling distances."""
-    # ――― recurse first ―――
-    if not node.children:          # <-- NEW
-        node.psi = 1.0
-        node.is_instance = True
-        return 1.0
-    child_psis = [calculate_psi_sum(ch) for ch in node.children]
-    psi_children = 1.0
-    for v in child_psis:
-        psi_children *= v
-
-    # ――― sum of sibling distances ―――
-    if node.parent is None:
-        sibling_sum = 0.0
-    else:
-        sibling_sum = sum(
-            jaccard_distance(node, sib) for sib in node.parent.children if sib is not node
-        )
-
-    psi_root = _psi_vs_children(node, psi_children, sibling_sum)
-
-    # ――― choose winner ―――
-    if psi_root >= psi_children:
-        node.psi = psi_root
-        node.is_instance = True
-        return psi_root
-    else:
-        node.psi = psi_children
-        node.is_instance = False
-        return psi_children
+    return segment_psi(node, mode="sum")
 
 # Utility Helpers
 def gather_instances(root: "VirtualNode") -> Dict[str, int]:
     """Return a ``{xpath: size}`` mapping for all nodes flagged as instances."""
     instances: Dict[str, int] = {}
 
-    def walk(n: "VirtualNode") -> None:  # inner helper to capture *instances* dict
-        if getattr(n, "is_instance", False):
-            instances[n.xpath] = subtree_size(n)
-        else:
-            for ch in n.children:
-                walk(ch)
+    def is_instance(n: "VirtualNode") -> bool:  # instances are not descended into
+        return getattr(n, "is_instance", False)
 
-    walk(root)
+    for n in iter_preorder(root, skip_children=is_instance):
+        if is_instance(n):
+            instances[n.xpath] = subtree_size(n)
     return instances
 
 
 def ascii_tree(node: "VirtualNode", indent: str = "", is_last: bool = True) -> str:
     """Return an ASCII rendition of the subtree with PSI annotations."""
-    branch = "└── " if is_last else "├── "
-    psi = getattr(node, "psi", 0.0)
-    star = " *" if getattr(node, "is_instance", False) else ""
-    line = f"{indent}{branch}{node.tag}  ψ={psi:.2f}{star}\n"
-    indent_child = indent + ("    " if is_last else "│   ")
-    for i, ch in enumerate(node.children):
-        line += ascii_tree(ch, indent_child, i == len(node.children) - 1)
-    return line
+    lines = []
+    # guides[d] is the indentation contributed by the ancestor at depth d
+    guides = [indent]
+    for n, depth in iter_preorder_with_depth(node):
+        last = is_last if depth == 0 else n is n.parent.children[-1]
+        branch = "└── " if last else "├── "
+        psi = getattr(n, "psi", 0.0)
+        star = " *" if getattr(n, "is_instance", False) else ""
+        lines.append(f"{''.join(guides[:depth + 1])}{branch}{n.tag}  ψ={psi:.2f}{star}\n")
+        del guides[depth + 1:]
+        guides.append("    " if last else "│   ")
+    return "".join(lines)
@@ -0,0 +1,183 @@
+"""
+VIPS-style visual block segmentation on the extracted element table.
+
+A port of the ideas of the VIPS baseline (``vips/vips.js``) that needs no
+browser: it runs on the tree of extracted elements, whose boxes, tags and
+visibility are all it looks at, so it can be compared with PSI on the same
+saved captures.
+
+The tree is divided top-down. Every node gets a degree of coherence (DoC,
+1 to 11, as in VIPS) from the widest separator between its visible
+children (the gaps their boxes leave in the horizontal and vertical
+projections), the share of the page it covers and whether its children
+look alike. A node whose DoC reaches the permitted DoC (``pdoc``) is a
+block; otherwise its children are divided in turn. Unlike VIPS, blocks are
+always elements, never merged runs of siblings, so they can be classified
+and grouped like PSI instances.
+"""
+from __future__ import annotations
+import json
+import math
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+
+from visca.instrument import traced
+from visca.virtual_node.traversal import iter_preorder
+
+from .grouping import InstanceDetails, group_instance_leaves
+from .utils import tag_multiset, gather_instances
+
+
+# Permitted degree of coherence of vips.js' VipsTester
+DEFAULT_PDOC = 8
+
+# Separator width (px) that costs one degree of coherence
+GAP_UNIT = 10
+
+
+def _is_visible(node: "VirtualNode") -> bool:
+    data = node.data
+    return bool(data.visible) and data.width > 0 and data.height > 0
+
+
+def _visible_children(node: "VirtualNode") -> List["VirtualNode"]:
+    return [child for child in node.children if _is_visible(child)]
+
+
+def _max_gap(starts: np.ndarray, ends: np.ndarray) -> float:
+    """Widest stretch between intervals that none of them covers (0 if they overlap throughout)."""
+    order = np.argsort(starts, kind='stable')
+    covered_until = np.maximum.accumulate(ends[order])
+    gaps = starts[order][1:] - covered_until[:-1]
+    return float(gaps.max()) if len(gaps) and gaps.max() > 0 else 0.0
+
+
+def max_separator_width(children: List["VirtualNode"]) -> float:
+    """
+    Width of the widest separator between the boxes of ``children``: a
+    horizontal separator is a band of rows no box covers, a vertical one
+    a band of columns.
+    """
+    boxes = np.array([[c.data.x, c.data.y, c.data.width, c.data.height] for c in children], dtype=np.float64)
+    horizontal = _max_gap(boxes[:, 1], boxes[:, 1] + boxes[:, 3])
+    vertical = _max_gap(boxes[:, 0], boxes[:, 0] + boxes[:, 2])
+    return max(horizontal, vertical)
+
+
+def degree_of_coherence(
+    node: "VirtualNode",
+    children: List["VirtualNode"],
+    page_area: float,
+    gap_unit: float = GAP_UNIT
+) -> int:
+    """
+    DoC of ``node`` divided into ``children``: 11 minus one per
+    ``gap_unit`` px of the widest separator between them (children that look
+    alike, such as the items of a list, get two back), capped by the share
+    of the page the node covers, so large regions are always divided.
+    """
+    separator_doc = 11 - min(10.0, max_separator_width(children) / gap_unit)
+    if len(children) > 1:
+        first = tag_multiset(children[0], depth=2)
+        if all(tag_multiset(child, depth=2) == first for child in children[1:]):
+            separator_doc += 2
+
+    area_ratio = min(1.0, node.data.width * node.data.height / page_area) if page_area > 0 else 0.0
+    size_doc = 11 - 10 * math.sqrt(area_ratio)
+
+    return int(max(1, min(11, separator_doc, size_doc)))
+
+
+def segment_vips(root: "VirtualNode", pdoc: int = DEFAULT_PDOC, gap_unit: float = GAP_UNIT) -> Dict[str, int]:
+    """
+    Divides the tree into visual blocks, setting ``node.is_instance`` on
+    them (and clearing it everywhere else) like :func:`segment_psi` does.
+    Chains of single-child wrappers count as their innermost node, but the
+    block is the outermost wrapper. Invisible nodes belong to no block.
+
+    Args:
+        root: Root of the (deduplicated) element tree.
+        pdoc: Permitted DoC, 1 to 11; higher values give smaller blocks.
+        gap_unit: Separator width that costs one degree of coherence.
+
+    Returns:
+        ``{xpath: doc}`` of the blocks, in document order.
+    """
+    if not 1 <= pdoc <= 11:
+        raise ValueError(f"pDoC must be between 1 and 11, not {pdoc}.")
+
+    page_width = page_height = 0
+    for node in iter_preorder(root):
+        node.is_instance = False
+        if _is_visible(node):
+            page_width = max(page_width, node.data.x + node.data.width)
+            page_height = max(page_height, node.data.y + node.data.height)
+    page_area = float(page_width * page_height)
+
+    blocks: Dict[str, int] = {}
+    # The root is artificial (or the whole page), never a block
+    stack = list(reversed(_visible_children(root)))
+    while stack:
+        node = stack.pop()
+
+        inner, children = node, _visible_children(node)
+        while len(children) == 1:
+            inner = children[0]
+            children = _visible_children(inner)
+
+        doc = degree_of_coherence(node, children, page_area, gap_unit) if children else 11
+        if doc >= pdoc:
+            node.is_instance = True
+            blocks[node.xpath] = doc
+        else:
+            stack.extend(reversed(children))
+
+    return blocks
+
+
+@traced('vips')
+def vips_tree(
+    root: "VirtualNode",
+    out_dir: Union[str, Path],
+    name: str = 'vips',
+    pdoc: int = DEFAULT_PDOC,
+    elements: Optional[List[Dict[str, Any]]] = None,
+    verbose: bool = False
+) -> Dict[str, InstanceDetails]:
+    """
+    Segments ``root`` with :func:`segment_vips` and writes
+    ``segmentation_xpath_{name}.json`` to ``out_dir``, in the format of
+    :func:`segment_tree`, so the blocks can be classified and evaluated
+    like PSI instances.
+
+    Args:
+        root: The (deduplicated) DOM tree of the page.
+        out_dir: The page's result directory.
+        name: Suffix of the output file.
+        pdoc: Permitted degree of coherence, 1 to 11.
+        elements: Elements to group; defaults to ``out_dir/segments.json``.
+        verbose: Also print every block with its DoC.
+
+    Returns:
+        The written instance details.
+    """
+    blocks = segment_vips(root, pdoc=pdoc)
+    instances = gather_instances(root)
+
+    print("Number of Segments: ", len(instances.keys()))
+    if verbose:
+        for xp, doc in blocks.items():
+            print(f"{xp:<60}  DoC = {doc}")
+
+    if elements is None:
+        with open(f'{out_dir}/segments.json', 'r', encoding='utf-8') as f:
+            elements = json.load(f)
+
+    instance_details = group_instance_leaves(root, instances, elements)
+
+    with open(f"{out_dir}/segmentation_xpath_{name}.json", 'w', encoding='utf-8') as out:
+        json.dump(instance_details, out, indent=2, ensure_ascii=False)
+
+    return instance_details
@@ -1,18 +1,40 @@
 from .virtual_node import VirtualNode
 from .component_info import (
     ComponentType,
-    ComponentInfo
+    ComponentInfo,
+    LabelSource
 )
 from .build_tree import (
     parse_xpath,
     build_dom_tree,
 )
+from .diff import (
+    TreeDiff,
+    diff_trees,
+    subtree_hashes,
+)
+from .flat_tree import FlatTree
+from .traversal import (
+    iter_preorder,
+    iter_preorder_with_depth,
+    iter_postorder,
+    iter_bfs,
+)
 
 
 __all__ = [
     'VirtualNode',
+    'FlatTree',
     'ComponentType',
     'ComponentInfo',
+    'LabelSource',
     'parse_xpath',
-    'build_dom_tree'
+    'build_dom_tree',
+    'TreeDiff',
+    'diff_trees',
+    'subtree_hashes',
+    'iter_preorder',
+    'iter_preorder_with_depth',
+    'iter_postorder',
+    'iter_bfs',
 ]
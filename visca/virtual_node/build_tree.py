@@ -1,10 +1,12 @@
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 from visca.segment import Segment
 
 from .virtual_node import VirtualNode
 from .diff_info import DiffType
-from .utils import calculate_parent_xpath
+from .diff import diff_trees
+from .traversal import iter_bfs
+from .utils import AncestorLookup
 
 
 def parse_xpath(xpath: str) -> List[str]:
@@ -42,154 +44,104 @@ def parse_xpath(xpath: str) -> List[str]:
     return full_path_segments
 
 
-def build_dom_tree(segments: List[Segment]) -> VirtualNode:
+def build_dom_tree(segments: List[Segment], warnings: Optional[List[str]] = None) -> VirtualNode:
     """
-    Build a DOM tree of VirtualNode objects from a list of segments using
-    a trie-like approach based on XPath prefixes. Does not create placeholder
-    nodes. Preserves child insertion order relative to their parent.
+    Build a DOM tree of VirtualNode objects from a list of segments. Each node
+    is attached to its deepest existing ancestor; no placeholder nodes are
+    created. Preserves child insertion order relative to their parent.
+
+    Segments extracted by ``extract_dom_elements`` carry a ``parentIndex``,
+    which links them to their parent directly. The others (or those whose
+    parent was filtered out) are placed by XPath prefix with an
+    :class:`AncestorLookup`, which walks every missing ancestor only once.
 
     Args:
         segments: A list of dictionaries, each representing a node with
                     at least 'xpath' and 'tag' keys, plus other attributes.
+        warnings: If given, a message for every skipped or misplaced segment
+                    is appended to it. Only a one-line summary is printed.
 
     Returns:
         The artificial root node of the constructed tree.
     """
     # Create an artificial root node for the whole tree
     root = VirtualNode({'tag': 'root', 'xpath': '', 'id': 'ARTIFICIAL_ROOT', 'index': -1})
-    # Dictionary to quickly find nodes by their exact XPath
-    nodes_by_xpath: Dict[str, VirtualNode] = {'': root}
+    messages: List[str] = warnings if warnings is not None else []
+    warnings_before = len(messages)
 
-    # Sort segments by XPath length first, then based in index provided in the segment.
-    # This heuristic increases the likelihood of processing parents before children.
+    # Sort segments based in index provided in the segment, which is the document order
+    # for extracted elements and keeps sibling order stable.
     segments.sort(key=lambda s: s['index'])
 
+    # Phase 1: create all nodes, dropping segments without or with an already seen XPath
+    nodes: List[VirtualNode] = []
+    nodes_by_xpath: Dict[str, VirtualNode] = {'': root}
+    # Only segments from extract_dom_elements have parentIndex, and their indexes are unique
+    nodes_by_index: Dict[int, VirtualNode] = {}
     for segment_data in segments:
         xpath = segment_data.get('xpath')
         if not xpath:
-            print(f"Warning: Segment data missing 'xpath'. Skipping: {segment_data.get('tag', 'N/A')}")
+            messages.append(f"Segment data missing 'xpath'. Skipping: {segment_data.get('tag', 'N/A')}")
             continue
 
-        # Check if this exact node already exists (duplicate segment)
         if xpath in nodes_by_xpath:
-            print(f"Warning: Node with XPath '{xpath}' already exists. Skipping duplicate segment for tag '{segment_data.get('tag')}'.")
-            # Optionally update existing node data here if needed
-            # existing_node = nodes_by_xpath[xpath]
-            # Update logic... e.g., merge attributes, update text if empty?
+            messages.append(f"Node with XPath '{xpath}' already exists. Skipping duplicate segment for tag '{segment_data.get('tag')}'.")
             continue
 
-        parent_node = None
-        # Start searching from the direct parent XPath
-        current_search_xpath = calculate_parent_xpath(xpath)
-
-        while current_search_xpath is not None:
-            if current_search_xpath in nodes_by_xpath:
-                # Found the deepest existing ancestor node
-                parent_node = nodes_by_xpath[current_search_xpath]
-                break # Exit the while loop
-            # If not found, go up one level
-            current_search_xpath = calculate_parent_xpath(current_search_xpath)
+        try:
+            new_node = VirtualNode(segment_data)
+        except (TypeError, ValueError) as e:
+            messages.append(f"Error creating VirtualNode for XPath '{xpath}': {e}. Skipping segment.")
+            continue
+        nodes.append(new_node)
+        nodes_by_xpath[xpath] = new_node
+        if 'parentIndex' in segment_data:
+            nodes_by_index[segment_data['index']] = new_node
+
+    # Phase 2: attach every node to its deepest existing ancestor, in index order
+    lookup = AncestorLookup(nodes_by_xpath)
+    for new_node in nodes:
+        parent_index = new_node.data.extras.get('parentIndex') if new_node.data.extras else None
+        parent_node = nodes_by_index.get(parent_index) if parent_index is not None else None
+        if parent_node is None:
+            parent_node = lookup.closest_ancestor(new_node.data.xpath)
 
-        # If no parent found other than root (current_search_xpath becomes None),
-        # the parent is the root node. This should be caught by `nodes_by_xpath['']`.
         if parent_node is None:
-            # This case should theoretically only happen if root wasn't added to nodes_by_xpath
-            # Or if calculate_parent_xpath has issues. Assume root is the fallback.
-            print(f"Warning: Could not find existing parent for XPath '{xpath}'. Attaching to root.")
+            messages.append(f"Could not find existing parent for XPath '{new_node.data.xpath}'. Attaching to root.")
             parent_node = root
 
-        try:
-            new_node = VirtualNode(segment_data)
-            parent_node.add_child(new_node) # Adds to children list, sets parent reference
-            nodes_by_xpath[xpath] = new_node # Add new node to lookup map
-        except (TypeError, ValueError) as e:
-            print(f"Error creating VirtualNode for XPath '{xpath}': {e}. Skipping segment.")
+        # Nodes are fresh and visited once, so add_child's duplicate check is not needed
+        parent_node.children.append(new_node)
+        new_node.parent = parent_node
+
+    if len(messages) > warnings_before:
+        print(f"Warning: build_dom_tree reported {len(messages) - warnings_before} issues "
+              f"(skipped or misplaced segments) while building a tree of {len(nodes)} nodes.")
 
     return root
 
 
 def diff_bfs_update(root: VirtualNode, diff_type: DiffType) -> VirtualNode:
-    queue = [root]
-    
-    while len(queue) > 0:
-        current_node = queue[0]
-        current_node.add_diff_info(diff_type=diff_type)
-        queue.extend(current_node.children)
-        queue = queue[1:]
+    for node in iter_bfs(root):
+        node.add_diff_info(diff_type=diff_type)
     
     return root
 
 
 def build_diff_tree(left_tree: VirtualNode, right_tree: VirtualNode) -> VirtualNode:
-    new_tree = left_tree.shallow_copy()
-    new_tree.add_diff_info(DiffType.SAME)
-    
-    left_children: List[VirtualNode] = left_tree.children
-    right_children: List[VirtualNode] = right_tree.children
-
-    left_pointer = 0
-    right_pointer = 0
-    
-    # If left_children is empty, all of right_tree nodes are added nodes.
-    if len(left_children) == 0 and len(right_children) != 0:
-        for right_child in right_children:
-            new_child = right_child.full_copy()
-            new_child = diff_bfs_update(new_child, DiffType.ADDED)
-            new_tree.add_child(new_child)
-            new_tree.add_diff_info(diff_type=DiffType.UPDATED)
-            return new_tree
-    
-    while left_pointer < len(left_children):
-        left_child = left_children[left_pointer]
-        right_child = right_children[right_pointer]
-        
-        if left_child.data == right_child.data or \
-            left_child.data.is_similar(right_child.data):
-            
-            new_child = build_diff_tree(left_child, right_child)
-            new_tree.add_child(new_child)
-            
-            if new_child.diff_info.diff_type != DiffType.SAME and left_child.data != right_child.data:
-                new_tree.add_diff_info(diff_type=DiffType.UPDATED)
-            
-            left_pointer += 1
-            # Here, the match is found and the rest of the body is unnecessary.
-            right_pointer = (right_pointer + 1) % len(right_children)
-            continue
-        
-        new_child = right_child.full_copy()
-        new_child = diff_bfs_update(new_child, DiffType.ADDED)
-        new_tree.add_child(new_child)
-        new_tree.add_diff_info(diff_type=DiffType.UPDATED)
-        
-        right_pointer += 1
-        
-        # If we have compared the self_child to all the other_children and not found a match
-        # This means that self_child has been removed from the list.
-        if right_pointer == len(right_children):
-            new_child = left_child.full_copy()
-            new_child = diff_bfs_update(new_child, DiffType.DELETED)
-            new_tree.add_child(new_child)
-            new_tree.add_diff_info(diff_type=DiffType.UPDATED)
-            
-            left_pointer += 1
-            right_pointer = 0
-    
-    return new_tree
+    """
+    Builds a merged tree of copies in which every node carries the DiffType
+    of the :func:`diff_trees` result: SAME, UPDATED, ADDED (from the right
+    tree) or DELETED (from the left tree). Use :func:`diff_trees` directly
+    to avoid copying the trees.
+    """
+    return diff_trees(left_tree, right_tree).to_diff_tree()
 
 
 def print_diff_tree(root: VirtualNode):
-    queue = [root]
-    
-    while len(queue) > 0:
-        current = queue[0]
-        queue.extend(current.children)
-        
+    for current in iter_bfs(root):
         if current.diff_info.diff_type == DiffType.SAME:
-            queue = queue[1:]
             continue
         
         print(current.data.xpath, current.diff_info.diff_type.value)
         print(current.data.raw_html)
-        
-        queue = queue[1:]
@@ -11,7 +11,23 @@ class ComponentType(Enum):
     COMPONENT = "Component"
 
 
+class LabelSource(Enum):
+    MODEL = "model"
+    MEMORY = "memory"
+    # Copied from an identical subtree of an already processed state
+    CARRIED = "carried"
+    # Derived from the tree's structure (e.g. repeated children), without the model
+    STRUCTURE = "structure"
+    # Predicted from cheap features of the node (see visca.preclassify)
+    HEURISTIC = "heuristic"
+
+
 class ComponentInfo:
+    __slots__ = (
+        '_node_ref', 'component_title', 'component_context',
+        'component_type', 'component_code', 'previously_seen', 'label_source'
+    )
+
     def __init__(
         self,
         node: 'VirtualNode',
@@ -19,7 +35,8 @@ class ComponentInfo:
         component_context: str='',
         component_type: Optional[ComponentType]=None,
         component_code: Optional[str]=None,
-        previously_seen: str=''
+        previously_seen: str='',
+        label_source: Optional[LabelSource]=None
     ):
         self._node_ref = weakref.ref(node)
         self.component_title = component_title
@@ -27,6 +44,7 @@ class ComponentInfo:
         self.component_type = component_type
         self.component_code = component_code
         self.previously_seen = previously_seen
+        self.label_source = label_source
     
     
     @property
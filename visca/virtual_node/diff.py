@@ -0,0 +1,254 @@
+import hashlib
+from collections import deque
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from .virtual_node import VirtualNode
+from .virtual_node_data import VirtualNodeData
+from .diff_info import DiffType
+from .traversal import iter_bfs, iter_postorder
+
+
+# Attributes that change how an element looks or what it does while its text
+# and size stay the same (a selected row, an active tab, a new link target)
+DIGEST_ATTRIBUTES = (
+    'href', 'src', 'value', 'checked', 'selected', 'disabled', 'open',
+    'aria-selected', 'aria-checked', 'aria-expanded', 'aria-pressed', 'aria-current',
+)
+
+
+def _node_state(data: VirtualNodeData) -> str:
+    """The class list, :data:`DIGEST_ATTRIBUTES` and form state of a node, as one string."""
+    attributes = data.attributes
+    extras = data.extras or {}
+    classes = extras.get('classes')
+    parts = [' '.join(classes) if classes is not None else attributes.get('class', '')]
+    parts.extend(attributes.get(name, '\x00') for name in DIGEST_ATTRIBUTES)
+    # Checked/value/selected properties, which the markup does not reflect
+    parts.append(repr(extras.get('formState')))
+    return '\x1e'.join(parts)
+
+
+def subtree_hashes(root: VirtualNode) -> Dict[int, bytes]:
+    """
+    Computes a Merkle-style digest for every subtree under ``root``, keyed by
+    ``id(node)``.
+
+    A node's digest covers its tag, text, size, class list,
+    :data:`DIGEST_ATTRIBUTES` and form state, its offset from its parent
+    (so a subtree moved as a whole keeps its digest) and the digests of its
+    children in order. Two subtrees with the same digest are identical for
+    the purposes of :func:`diff_trees`. Digests are stable across processes.
+    """
+    digests: Dict[int, bytes] = {}
+    for node in iter_postorder(root):
+        data = node.data
+        if node is not root and node.parent is not None:
+            dx, dy = data.x - node.parent.data.x, data.y - node.parent.data.y
+        else:
+            dx, dy = 0, 0
+        h = hashlib.blake2b(
+            f"{data.tag_name}\x1f{data.text_content}\x1f{data.width}\x1f{data.height}\x1f{dx}\x1f{dy}"
+            f"\x1f{_node_state(data)}".encode('utf-8'),
+            digest_size=16
+        )
+        for child in node.children:
+            h.update(digests[id(child)])
+        digests[id(node)] = h.digest()
+    return digests
+
+
+# One entry of the aligned children of an updated pair: a matched (left, right)
+# pair, or a lone right (added) or left (deleted) child.
+_Aligned = Tuple[DiffType, Optional[VirtualNode], Optional[VirtualNode]]
+
+
+class TreeDiff:
+    """
+    Result of :func:`diff_trees`. Nodes are referenced, never copied.
+
+    Attributes:
+        same: ``(left, right)`` roots of identical subtrees. Their
+            descendants are identical as well and are not listed.
+        updated: ``(left, right)`` matched nodes whose subtree changed.
+        added: Roots of right subtrees with no counterpart on the left.
+        deleted: Roots of left subtrees with no counterpart on the right.
+    """
+
+    def __init__(self, left: VirtualNode, right: VirtualNode):
+        self.left = left
+        self.right = right
+        self.same: List[Tuple[VirtualNode, VirtualNode]] = []
+        self.updated: List[Tuple[VirtualNode, VirtualNode]] = []
+        self.added: List[VirtualNode] = []
+        self.deleted: List[VirtualNode] = []
+        # id(left node of an updated pair) -> its children, aligned
+        self._alignments: Dict[int, List[_Aligned]] = {}
+
+
+    @property
+    def is_unchanged(self) -> bool:
+        return not self.updated
+
+
+    def iter_same_pairs(self) -> Iterator[Tuple[VirtualNode, VirtualNode]]:
+        """Yields every ``(left, right)`` node pair inside the identical subtrees."""
+        for left, right in self.same:
+            stack = [(left, right)]
+            while stack:
+                left_node, right_node = stack.pop()
+                yield left_node, right_node
+                stack.extend(zip(left_node.children, right_node.children))
+
+
+    def summary(self) -> Dict[str, int]:
+        return {
+            'same': len(self.same),
+            'updated': len(self.updated),
+            'added': len(self.added),
+            'deleted': len(self.deleted),
+        }
+
+
+    def to_diff_tree(self) -> VirtualNode:
+        """
+        Materializes the diff as one merged tree of copies, every node with
+        its ``diff_info`` set, in the format produced by ``build_diff_tree``.
+        Deleted children are placed where they were in the left tree.
+        """
+        def copy_subtree(node: VirtualNode, diff_type: DiffType) -> VirtualNode:
+            copied = node.full_copy()
+            for copied_node in iter_bfs(copied):
+                copied_node.add_diff_info(diff_type=diff_type)
+            return copied
+
+        if not self.updated:
+            return copy_subtree(self.left, DiffType.SAME)
+
+        merged_root = self.left.shallow_copy()
+        merged_root.add_diff_info(DiffType.UPDATED)
+        stack = [(self.left, merged_root)]
+        while stack:
+            left_node, merged = stack.pop()
+            for diff_type, left_child, right_child in self._alignments[id(left_node)]:
+                if diff_type == DiffType.UPDATED:
+                    merged_child = left_child.shallow_copy()
+                    merged_child.add_diff_info(DiffType.UPDATED)
+                    stack.append((left_child, merged_child))
+                elif diff_type == DiffType.ADDED:
+                    merged_child = copy_subtree(right_child, DiffType.ADDED)
+                else:
+                    merged_child = copy_subtree(left_child, diff_type)
+                merged.children.append(merged_child)
+                merged_child.parent = merged
+        return merged_root
+
+
+def _align_children(
+    left_children: List[VirtualNode],
+    right_children: List[VirtualNode],
+    left_hashes: Dict[int, bytes],
+    right_hashes: Dict[int, bytes]
+) -> List[_Aligned]:
+    """
+    Pairs children in two passes: identical subtrees by digest, then the
+    rest by (tag, xpath). Returns the alignment in right-tree order, with
+    each unmatched left child placed after the entry preceding it on the left.
+    """
+    partner: List[Optional[int]] = [None] * len(left_children)
+    matched_right = [False] * len(right_children)
+
+    by_hash: Dict[bytes, Deque[int]] = {}
+    for j, child in enumerate(right_children):
+        by_hash.setdefault(right_hashes[id(child)], deque()).append(j)
+    for i, child in enumerate(left_children):
+        candidates = by_hash.get(left_hashes[id(child)])
+        if candidates:
+            j = candidates.popleft()
+            partner[i] = j
+            matched_right[j] = True
+
+    by_key: Dict[Tuple[str, str], int] = {}
+    for j, child in enumerate(right_children):
+        if not matched_right[j]:
+            by_key.setdefault((child.data.tag_name, child.data.xpath), j)
+    for i, child in enumerate(left_children):
+        if partner[i] is None:
+            j = by_key.pop((child.data.tag_name, child.data.xpath), None)
+            if j is not None:
+                partner[i] = j
+                matched_right[j] = True
+
+    left_of: Dict[int, int] = {j: i for i, j in enumerate(partner) if j is not None}
+    aligned: List[_Aligned] = []
+    # Deleted left children are emitted before the first right child that
+    # matches a left child after them
+    next_left = 0
+    for j, right_child in enumerate(right_children):
+        i = left_of.get(j)
+        if i is None:
+            aligned.append((DiffType.ADDED, None, right_child))
+            continue
+        while next_left < i:
+            if partner[next_left] is None:
+                aligned.append((DiffType.DELETED, left_children[next_left], None))
+            next_left += 1
+        next_left = max(next_left, i + 1)
+        left_child = left_children[i]
+        same = left_hashes[id(left_child)] == right_hashes[id(right_child)]
+        aligned.append((DiffType.SAME if same else DiffType.UPDATED, left_child, right_child))
+    for i in range(next_left, len(left_children)):
+        if partner[i] is None:
+            aligned.append((DiffType.DELETED, left_children[i], None))
+    return aligned
+
+
+def diff_trees(
+    left: VirtualNode,
+    right: VirtualNode,
+    left_hashes: Optional[Dict[int, bytes]] = None,
+    right_hashes: Optional[Dict[int, bytes]] = None
+) -> TreeDiff:
+    """
+    Diffs two trees in time linear in their size.
+
+    Subtree digests (see :func:`subtree_hashes`) are computed once per tree.
+    Matched pairs with equal digests are reported as SAME without visiting
+    their descendants. Otherwise the pair is UPDATED and its children are
+    aligned by digest, then by (tag, xpath); leftovers are ADDED (right)
+    or DELETED (left).
+
+    Args:
+        left: The old tree.
+        right: The new tree.
+        left_hashes: Precomputed digests of ``left``, e.g. of a stored state.
+        right_hashes: Precomputed digests of ``right``.
+
+    Returns:
+        A :class:`TreeDiff` referencing nodes of both trees.
+    """
+    if left_hashes is None:
+        left_hashes = subtree_hashes(left)
+    if right_hashes is None:
+        right_hashes = subtree_hashes(right)
+
+    diff = TreeDiff(left, right)
+    if left_hashes[id(left)] == right_hashes[id(right)]:
+        diff.same.append((left, right))
+        return diff
+
+    stack = [(left, right)]
+    while stack:
+        left_node, right_node = stack.pop()
+        diff.updated.append((left_node, right_node))
+        aligned = _align_children(left_node.children, right_node.children, left_hashes, right_hashes)
+        diff._alignments[id(left_node)] = aligned
+        for diff_type, left_child, right_child in aligned:
+            if diff_type == DiffType.SAME:
+                diff.same.append((left_child, right_child))
+            elif diff_type == DiffType.UPDATED:
+                stack.append((left_child, right_child))
+            elif diff_type == DiffType.ADDED:
+                diff.added.append(right_child)
+            else:
+                diff.deleted.append(left_child)
+    return diff
@@ -9,6 +9,8 @@ class DiffType(Enum):
 
 
 class DiffInfo:
+    __slots__ = ('diff_type',)
+
     def __init__(
         self,
         diff_type: DiffType
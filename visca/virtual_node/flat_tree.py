@@ -0,0 +1,177 @@
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from .virtual_node import VirtualNode
+from .traversal import iter_preorder_with_depth
+
+
+class FlatTree:
+    """
+    Struct-of-arrays view of a ``VirtualNode`` tree.
+
+    Nodes are numbered in pre-order, so node ``i`` is ``nodes[i]`` and its
+    subtree is the contiguous id range ``[i, subtree_end[i])``. Every
+    structural field is a NumPy int32 array indexed by node id, with -1
+    meaning "none":
+
+    - ``parent``, ``first_child``, ``next_sibling``: the linked structure.
+    - ``depth``: distance from the root (the root has depth 0).
+    - ``pre``, ``post``: pre-order (equal to the node id) and post-order ranks.
+    - ``subtree_end``: one past the last id of the node's subtree.
+
+    Because subtrees are id ranges, "is ``x`` a descendant of ``y``" is the
+    O(1) test ``y < x < subtree_end[y]`` and whole-subtree queries become
+    array slices.
+    """
+
+    def __init__(self, root: VirtualNode):
+        """
+        Flattens the tree rooted at ``root``. The ``VirtualNode`` objects are
+        referenced, not copied; use :meth:`to_virtual_node` for a new tree.
+
+        Args:
+            root: The root of the tree to flatten.
+        """
+        nodes: List[VirtualNode] = []
+        parent: List[int] = []
+        depth: List[int] = []
+        # last_at_depth[d] is the most recently visited node at depth d, which in
+        # pre-order is the parent of the next node at depth d + 1
+        last_at_depth: List[int] = []
+
+        for node, node_depth in iter_preorder_with_depth(root):
+            node_id = len(nodes)
+            nodes.append(node)
+            depth.append(node_depth)
+            parent.append(last_at_depth[node_depth - 1] if node_depth > 0 else -1)
+            del last_at_depth[node_depth:]
+            last_at_depth.append(node_id)
+
+        n = len(nodes)
+        self.nodes = nodes
+        self.parent = np.asarray(parent, dtype=np.int32)
+        self.depth = np.asarray(depth, dtype=np.int32)
+        self.pre = np.arange(n, dtype=np.int32)
+
+        # The first child of a node is the node right after it, when that one is deeper
+        self.first_child = np.full(n, -1, dtype=np.int32)
+        has_child = np.zeros(n, dtype=bool)
+        has_child[:-1] = self.depth[1:] > self.depth[:-1]
+        self.first_child[has_child] = self.pre[has_child] + 1
+
+        # Sizes are accumulated bottom-up one depth level at a time
+        sizes = np.ones(n, dtype=np.int32)
+        order = np.argsort(self.depth, kind='stable')
+        level_starts = np.searchsorted(self.depth[order], np.arange(self.depth.max(initial=0) + 2))
+        for d in range(len(level_starts) - 2, 0, -1):
+            level = order[level_starts[d]:level_starts[d + 1]]
+            np.add.at(sizes, self.parent[level], sizes[level])
+        self.subtree_end = self.pre + sizes
+
+        # A node's next sibling starts right where its subtree ends, if it has the same parent
+        self.next_sibling = np.full(n, -1, dtype=np.int32)
+        candidate = self.subtree_end
+        in_range = candidate < n
+        same_parent = np.zeros(n, dtype=bool)
+        same_parent[in_range] = self.parent[candidate[in_range]] == self.parent[in_range]
+        self.next_sibling[same_parent] = candidate[same_parent]
+
+        # Standard identity between pre-order and post-order ranks
+        self.post = self.pre + sizes - 1 - self.depth
+
+        self._tag_ids: Optional[np.ndarray] = None
+        self._tag_names: Optional[List[str]] = None
+        self._ids_by_xpath: Optional[Dict[str, int]] = None
+
+
+    @classmethod
+    def from_virtual_node(cls, root: VirtualNode) -> 'FlatTree':
+        """Builds a :class:`FlatTree` from a ``VirtualNode`` tree."""
+        return cls(root)
+
+
+    def to_virtual_node(self) -> VirtualNode:
+        """
+        Rebuilds a linked ``VirtualNode`` tree (shallow copies of the stored
+        nodes, children in their original order) and returns its root.
+        """
+        copies = [node.shallow_copy() for node in self.nodes]
+        for node_id in range(1, len(copies)):
+            copies[self.parent[node_id]].add_child(copies[node_id])
+        return copies[0]
+
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+
+    @property
+    def subtree_sizes(self) -> np.ndarray:
+        """Number of nodes in every subtree, including its root."""
+        return self.subtree_end - self.pre
+
+
+    @property
+    def is_leaf(self) -> np.ndarray:
+        return self.first_child == -1
+
+
+    def _index_tags(self) -> None:
+        tag_names, tag_ids = np.unique([node.data.tag_name for node in self.nodes], return_inverse=True)
+        self._tag_names = tag_names.tolist()
+        self._tag_ids = tag_ids.astype(np.int32)
+
+
+    @property
+    def tag_ids(self) -> np.ndarray:
+        """Per-node index into :attr:`tag_names`."""
+        if self._tag_ids is None:
+            self._index_tags()
+        return self._tag_ids
+
+
+    @property
+    def tag_names(self) -> List[str]:
+        if self._tag_names is None:
+            self._index_tags()
+        return self._tag_names
+
+
+    def id_of(self, xpath: str) -> Optional[int]:
+        """Returns the id of the node with ``xpath``, or None if it is not in the tree."""
+        if self._ids_by_xpath is None:
+            self._ids_by_xpath = {node.data.xpath: node_id for node_id, node in enumerate(self.nodes)}
+        return self._ids_by_xpath.get(xpath)
+
+
+    def is_descendant(self, node_id: int, ancestor_id: int) -> bool:
+        """True if ``node_id`` is a proper descendant of ``ancestor_id``."""
+        return ancestor_id < node_id < self.subtree_end[ancestor_id]
+
+
+    def descendant_mask(self, ancestor_ids: np.ndarray, node_ids: np.ndarray) -> np.ndarray:
+        """Element-wise :meth:`is_descendant` over two broadcastable id arrays."""
+        ancestor_ids = np.asarray(ancestor_ids)
+        node_ids = np.asarray(node_ids)
+        return (ancestor_ids < node_ids) & (node_ids < self.subtree_end[ancestor_ids])
+
+
+    def subtree(self, node_id: int) -> np.ndarray:
+        """Ids of the subtree of ``node_id`` (itself included), in pre-order."""
+        return self.pre[node_id:self.subtree_end[node_id]]
+
+
+    def children(self, node_id: int) -> Iterator[int]:
+        child = self.first_child[node_id]
+        while child != -1:
+            yield int(child)
+            child = self.next_sibling[child]
+
+
+    def ancestors(self, node_id: int) -> Iterator[int]:
+        """Ids of the proper ancestors of ``node_id``, closest first."""
+        node_id = self.parent[node_id]
+        while node_id != -1:
+            yield int(node_id)
+            node_id = self.parent[node_id]
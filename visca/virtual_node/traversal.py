@@ -0,0 +1,89 @@
+from collections import deque
+from typing import Callable, Iterator, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .virtual_node import VirtualNode
+
+
+# Explicit-stack traversals of VirtualNode trees. None of them recurse, so
+# arbitrarily deep DOMs neither hit the interpreter's recursion limit nor
+# pay for one Python frame per level.
+
+
+def iter_preorder_with_depth(
+    root: 'VirtualNode',
+    max_depth: Optional[int] = None,
+    skip_children: Optional[Callable[['VirtualNode'], bool]] = None
+) -> Iterator[Tuple['VirtualNode', int]]:
+    """
+    Yields ``(node, depth)`` pairs in pre-order (parent first, children in
+    order), with ``root`` at depth 0.
+
+    Args:
+        root: The node to start from.
+        max_depth: Nodes deeper than this are not visited.
+        skip_children: Called on each node after it has been yielded; when it
+            returns True the node's subtree is not entered.
+    """
+    stack = [(root, 0)]
+    while stack:
+        node, depth = stack.pop()
+        yield node, depth
+        if max_depth is not None and depth >= max_depth:
+            continue
+        if skip_children is not None and skip_children(node):
+            continue
+        children = node.children
+        for i in range(len(children) - 1, -1, -1):
+            stack.append((children[i], depth + 1))
+
+
+def iter_preorder(
+    root: 'VirtualNode',
+    max_depth: Optional[int] = None,
+    skip_children: Optional[Callable[['VirtualNode'], bool]] = None
+) -> Iterator['VirtualNode']:
+    """
+    Yields the nodes of the subtree in pre-order. See
+    :func:`iter_preorder_with_depth` for the arguments.
+    """
+    if max_depth is not None:
+        for node, _ in iter_preorder_with_depth(root, max_depth, skip_children):
+            yield node
+        return
+
+    # Depth is not needed here, so the stack holds bare nodes
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        yield node
+        if skip_children is not None and skip_children(node):
+            continue
+        stack.extend(reversed(node.children))
+
+
+def iter_postorder(root: 'VirtualNode') -> Iterator['VirtualNode']:
+    """
+    Yields the nodes of the subtree in post-order: every node comes after all
+    of its descendants, and siblings keep their order.
+    """
+    stack = [(root, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded or not node.children:
+            yield node
+            continue
+        stack.append((node, True))
+        children = node.children
+        for i in range(len(children) - 1, -1, -1):
+            stack.append((children[i], False))
+
+
+def iter_bfs(root: 'VirtualNode', max_depth: Optional[int] = None) -> Iterator['VirtualNode']:
+    """Yields the nodes of the subtree level by level, using a deque for O(1) pops."""
+    queue = deque([(root, 0)])
+    while queue:
+        node, depth = queue.popleft()
+        yield node
+        if max_depth is None or depth < max_depth:
+            queue.extend((child, depth + 1) for child in node.children)
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
 
 def calculate_parent_xpath(xpath: str) -> Optional[str]:
@@ -29,3 +29,54 @@ def calculate_parent_xpath(xpath: str) -> Optional[str]:
         return '' # Map parent of top-level absolute search to root ''
 
     return parent_path
+
+
+
+class AncestorLookup:
+    """
+    Finds the deepest existing ancestor of an XPath among a fixed set of
+    nodes keyed by XPath, with the same notion of parent as
+    :func:`calculate_parent_xpath`.
+
+    Prefixes are cut at '/' positions of the original string, so a direct
+    parent costs one slice and one dict lookup. Prefixes that are not in the
+    set are remembered together with the ancestor they resolved to, so each
+    gap in the tree is walked only once, no matter how many nodes sit
+    below it.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, nodes_by_xpath: Dict[str, Any]):
+        """
+        Args:
+            nodes_by_xpath: The existing nodes; '' is the root. Not copied,
+                so it must not change while the lookup is in use.
+        """
+        self._nodes_by_xpath = nodes_by_xpath
+        self._resolved_gaps: Dict[str, Any] = {}
+
+
+    def closest_ancestor(self, xpath: str) -> Any:
+        """Returns the node of the longest existing proper prefix of ``xpath``, or None."""
+        gaps: List[str] = []
+        result = None
+        cut = xpath.rfind('/')
+        while cut >= 0:
+            prefix = xpath[:cut]
+            if prefix == '/' and xpath.startswith('//'):
+                prefix = ''  # The parent of a top-level '//tag' is the root
+            found = self._nodes_by_xpath.get(prefix, self._MISSING)
+            if found is self._MISSING:
+                found = self._resolved_gaps.get(prefix, self._MISSING)
+            if found is not self._MISSING:
+                result = found
+                break
+            gaps.append(prefix)
+            if prefix == '':
+                break
+            cut = xpath.rfind('/', 0, cut)
+
+        for prefix in gaps:
+            self._resolved_gaps[prefix] = result
+        return result
@@ -3,11 +3,17 @@ from typing import Optional, List
 from visca.segment import Segment
 
 from .virtual_node_data import VirtualNodeData
-from .component_info import ComponentInfo, ComponentType
+from .component_info import ComponentInfo, ComponentType, LabelSource
 from .diff_info import DiffInfo, DiffType
 
 
 class VirtualNode:
+    # __weakref__ is needed because ComponentInfo refers back to its node weakly
+    __slots__ = (
+        'data', 'parent', 'children', 'component_info', 'diff_info',
+        'psi', 'is_instance', '__weakref__'
+    )
+
     def __init__(self, data: Segment):
         # print(data.get('xpath', ''), data.get('screenshot', ''))
         self.data = VirtualNodeData(data)
@@ -44,7 +50,8 @@ class VirtualNode:
         component_context: str='',
         component_type: Optional[ComponentType]=None,
         component_code: Optional[str]=None,
-        previously_seen: str=''
+        previously_seen: str='',
+        label_source: Optional[LabelSource]=None
     ):
         if self.component_info is None:
             self.component_info = ComponentInfo(self)
@@ -59,6 +66,8 @@ class VirtualNode:
             self.component_info.component_code = component_code
         if previously_seen != '':
             self.component_info.previously_seen = previously_seen
+        if label_source is not None:
+            self.component_info.label_source = label_source
     
     
     def add_diff_info(self, diff_type: Optional[DiffType]=None):
@@ -69,13 +78,14 @@ class VirtualNode:
         '''
         Copies all the VirtualNode's data except for the children.
         '''
-        copied_node = VirtualNode(dict(self.data._raw_data))
+        copied_node = VirtualNode(self.data.to_dict())
         
         if self.component_info is not None:
             copied_node.add_component_info(
                 component_title=self.component_info.component_title,
                 component_type=self.component_info.component_type,
-                component_code=self.component_info.component_code
+                component_code=self.component_info.component_code,
+                label_source=self.component_info.label_source
             )
         
         if self.diff_info is not None:
@@ -92,9 +102,14 @@ class VirtualNode:
         '''
         copied_node = self.shallow_copy()
         
-        for child in self.children:
-            copied_child = child.full_copy()
-            copied_node.add_child(copied_child)
+        # Explicit stack of (original, copy) pairs whose children still need copying
+        stack = [(self, copied_node)]
+        while stack:
+            original, copied = stack.pop()
+            for child in original.children:
+                copied_child = child.shallow_copy()
+                copied.add_child(copied_child)
+                stack.append((child, copied_child))
         
         return copied_node
 
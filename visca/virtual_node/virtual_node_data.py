@@ -4,11 +4,30 @@ from typing import Optional, Dict, Any, Tuple
 from visca.segment import Segment
 
 
+# Segment keys that are stored as VirtualNodeData fields; any other key is kept in ``extras``.
+_CORE_KEYS = frozenset((
+    'id', 'tag', 'xpath', 'index', 'text', 'html',
+    'x', 'y', 'width', 'height', 'visible', 'screenshot'
+))
+
+
 class VirtualNodeData:
     """
     Represents the data for a dom node.
+
+    Uses ``__slots__`` and keeps only the parsed fields (plus any non-standard
+    segment keys in ``extras``) instead of a reference to the source dict, so
+    many trees can be held in memory at once. ``attributes`` is parsed from
+    the raw HTML on first access.
     """
 
+    __slots__ = (
+        'node_id', 'tag_name', 'xpath', 'index',
+        'text_content', 'raw_html',
+        'x', 'y', 'width', 'height', 'visible', 'screenshot',
+        'extras', '_attributes'
+    )
+
     def __init__(self, data: Segment):
         """
         Initializes a VirtualNodeData from a dictionary containing its properties.
@@ -46,10 +65,44 @@ class VirtualNodeData:
         self.visible: bool = data.get('visible', True)
         self.screenshot: Optional[str] = data.get('screenshot') # Path to image segment
 
-        # Store the original data for potential future reference or debugging
-        self._raw_data: Dict[str, Any] = data
-        # Placeholder for standard HTML attributes if parsed later
-        self.attributes: Dict[str, str] = self._parse_attributes_from_html(self.raw_html)
+        # Keys outside the Segment schema; None when there are none (the common case)
+        self.extras: Optional[Dict[str, Any]] = {
+            key: value for key, value in data.items() if key not in _CORE_KEYS
+        } or None
+        # Standard HTML attributes, parsed from raw_html on first access
+        self._attributes: Optional[Dict[str, str]] = None
+
+
+    @property
+    def attributes(self) -> Dict[str, str]:
+        """HTML attributes of the node's opening tag, parsed lazily from ``raw_html``."""
+        if self._attributes is None:
+            self._attributes = self._parse_attributes_from_html(self.raw_html)
+        return self._attributes
+
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Rebuilds a segment dictionary equivalent to the one this node was
+        created from, e.g. to construct a copy of the node.
+        """
+        data: Dict[str, Any] = {
+            'id': self.node_id,
+            'tag': self.tag_name,
+            'xpath': self.xpath,
+            'index': self.index,
+            'text': self.text_content,
+            'html': self.raw_html,
+            'x': self.x,
+            'y': self.y,
+            'width': self.width,
+            'height': self.height,
+            'visible': self.visible,
+            'screenshot': self.screenshot,
+        }
+        if self.extras:
+            data.update(self.extras)
+        return data
 
 
     def _parse_attributes_from_html(self, html_snippet: Optional[str]) -> Dict[str, str]: